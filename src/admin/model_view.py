@@ -248,6 +248,10 @@ class TaskGroupAdmin(ModelView, model=TaskGroup):
                 model.close_from_test = before_edit[2]
                 await conf.bitrix_db.update_task_group(model)
 
+    async def after_model_delete(self, model, request):
+        await conf.bitrix_db.rebuild_counters()
+        conf.bit_sync.fifo.invalidate()
+
 
 class StageAdmin(ModelView, model=Stage):
     page_size = 25
@@ -296,6 +300,10 @@ class StageAdmin(ModelView, model=Stage):
         }
     }
 
+    async def after_model_delete(self, model, request):
+        await conf.bitrix_db.rebuild_counters()
+        conf.bit_sync.fifo.invalidate()
+
 
 class TaskAdmin(ModelView, model=Task):
     page_size = 25
@@ -383,6 +391,15 @@ class TaskAdmin(ModelView, model=Task):
         else:
             return RedirectResponse(request.url_for("admin:list", identity=self.identity))
 
+    # the admin panel writes past BitrixDB, the queue counters and FIFO queues are loaded again
+    async def after_model_change(self, data, model, is_created, request):
+        await conf.bitrix_db.rebuild_counters()
+        conf.bit_sync.fifo.invalidate()
+
+    async def after_model_delete(self, model, request):
+        await conf.bitrix_db.rebuild_counters()
+        conf.bit_sync.fifo.invalidate()
+
 
 class TaskUserAdmin(ModelView, model=TaskUser):
     page_size = 25
@@ -429,6 +446,12 @@ class TaskUserAdmin(ModelView, model=TaskUser):
     column_details_list = [TaskUser.id, TaskUser.task, TaskUser.user, TaskUser.role]
     form_columns = [TaskUser.id, TaskUser.task, TaskUser.user, TaskUser.role]
 
+    async def after_model_change(self, data, model, is_created, request):
+        await conf.bitrix_db.rebuild_counters()
+
+    async def after_model_delete(self, model, request):
+        await conf.bitrix_db.rebuild_counters()
+
 
 class FileAdmin(ModelView, model=File):
 
@@ -1,4 +1,13 @@
-from .api.bitrix import BitrixAPI
-from .sync.bit_sync import BitSync
-
 __all__ = ["BitrixAPI", "BitSync"]
+
+
+def __getattr__(name: str):
+    # imported on first use, so the aiohttp-free modules (cache, limiter, breaker, scheduler, phases)
+    # can be imported without the client
+    if name == "BitrixAPI":
+        from .api.bitrix import BitrixAPI
+        return BitrixAPI
+    if name == "BitSync":
+        from .sync.bit_sync import BitSync
+        return BitSync
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,12 +1,27 @@
+import json
 import asyncio
 import aiohttp
 
 from pathlib import Path
+from time import monotonic
 from dataclasses import dataclass
 from logging import ERROR
+from typing import Sequence, AsyncIterator
+from urllib.parse import quote
 
 from src.classes.base.data_save import BaseDataSave
-from src.classes.base.abc_cls import LoggerABC
+from src.classes.base.abc_cls import LoggerABC, FolderIndexABC
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, it only makes decoding faster
+    from json import loads as json_loads
+
+from .pool import HttpPool
+from .breaker import CircuitBreaker, BitrixUnavailable
+from .cache import ResponseCache, canonical_params
+from .metrics import BitrixMetrics
+from .limiter import RateLimiter, backoff_delay, get_limit_error
 
 
 @dataclass
@@ -38,18 +53,60 @@ class BitrixConf(BaseDataSave):
             return BitrixConfigData(**self._config)
 
 
+def build_query(params: dict, prefix: str = None) -> str:
+    """Encodes params like PHP http_build_query (used by Bitrix for commands inside "batch")"""
+    pairs = []
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        elif isinstance(value, (dict, list, tuple)):
+            nested = build_query(value, name)
+            if nested:
+                pairs.append(nested)
+        else:
+            if isinstance(value, bool):
+                value = int(value)
+            pairs.append(f"{quote(name, safe='[]')}={quote(str(value), safe='')}")
+
+    return "&".join(pairs)
+
+
 class Bitrix:
     """Before using it, be sure to create a session"""
     session: aiohttp.ClientSession = None
+    batch_limit = 50  # max commands in one "batch" request
+    page_size = 50  # rows in one page of list methods
+    # read only methods: concurrent identical calls of them share one request
+    single_flight_actions = ("get", "list", "groups", "current")
 
-    def __init__(self, webhook_url: str, config_path: Path, logger: LoggerABC = None, max_retries=3, retry_delay=5):
+    def __init__(
+            self, webhook_url: str, config_path: Path, logger: LoggerABC = None, max_retries=3, retry_delay=5,
+            rate_limit: float = 2.0, rate_burst: int = 50,
+            max_limit_retries: int = 5, limit_backoff: float = 1.0, pool: HttpPool = None,
+            cache: ResponseCache = None, folder_index: FolderIndexABC = None, breaker: CircuitBreaker = None,
+            metrics: BitrixMetrics = None
+    ):
         self.webhook_url = webhook_url
         self.max_retries = max_retries
         self.retry_delay = retry_delay  # delay between attempts in seconds
+        self.max_limit_retries = max_limit_retries  # retries after QUERY_LIMIT_EXCEEDED/OPERATION_TIME_LIMIT
+        self.limit_backoff = limit_backoff  # first backoff delay (seconds) after a limit error
+
+        self.limiter = RateLimiter(rate=rate_limit, burst=rate_burst)
+        self.pool = pool or HttpPool()
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or BitrixMetrics()
+        self.cache = cache  # responses of read only methods, None - without cache
+        self.folder_index = folder_index  # used by Storage.create_folder, None - list the parent folder every time
 
         self.conf = BitrixConf(config_path=config_path)
         self.logger = logger
 
+        self._in_flight: dict[tuple[str, str], asyncio.Task] = {}  # {(method, canonical params): request}
+        self.coalesced = 0  # calls that got the result of a request made by another call
+
     async def write_log(self, log_level: int, name: str, e: Exception = None, msg: str = "None") -> None:
         if isinstance(self.logger, LoggerABC):
             await self.logger.send_log(log_level, f"Bitrix API - {name}", e=e, msg=msg)
@@ -58,8 +115,8 @@ class Bitrix:
 
     async def create_session(self) -> None:
         try:
-            if self.session is None:
-                self.session = aiohttp.ClientSession()
+            if self.session is None or self.session.closed:
+                self.session = self.pool.get_session()
 
             if not self.conf.data:
                 s = await self.configurate()
@@ -70,46 +127,258 @@ class Bitrix:
 
     async def close(self) -> None:
         try:
-            if self.session and not self.session.closed:
-                await self.session.close()
+            await self.pool.close()
 
         except Exception as e:
             await self.write_log(ERROR, "close_session", e)
 
-    async def _make_request(self, url, params):
-        if self.session is None:
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Returns the pool session used for all Bitrix requests (REST, uploads, downloads)"""
+        if self.session is None or self.session.closed:
             await self.create_session()
-        for attempt in range(self.max_retries):
-            try:
-                async with self.session.post(url, json=params) as response:
-                    vot_error = await response.text()
-                    response.raise_for_status()
-                    return await response.json()
-            except (aiohttp.ClientError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
-                if attempt < self.max_retries - 1:
-                    await asyncio.sleep(self.retry_delay)
-                else:
-                    try:
-                        error_text = await response.text()
-                    except Exception as e_get_error:
-                        error_text = f"Can not get error text. Exception: {e_get_error}"
-                    msg = (
-                        f"\n------------------------------------------------------------\n"
-                        f"url={url}\nparams={params}\nError response body:{error_text}\n"
-                        f"------------------------------------------------------------"
-                    )
-                    await self.write_log(ERROR, "_make_request", e, msg)
-
-    async def call_method(self, method: str, params: dict = None) -> dict:
+        return self.session
+
+    async def _make_request(self, url, params, method: str = None, priority: int = None):
+        """
+        :param method: API method name, used by the rate limiter to track "time.operating"
+        :param priority: limiter.Priority, by default limiter.request_priority of the current task
+        :raise BitrixUnavailable: if the circuit breaker is open
+        """
+        session = await self.get_session()
+        # encoded once, so the size is known for the metrics and retries send the same bytes
+        payload = json.dumps(params).encode() if params is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else None
+
+        attempt = 0
+        limit_attempt = 0
+        sent = 0  # requests sent
+        received = 0  # response bytes
+        error = None  # code of the last error
+        operating = None
+        started = monotonic()
+        try:
+            while attempt < self.max_retries:
+                try:
+                    self.breaker.before_request()
+                except BitrixUnavailable:
+                    error = "BREAKER_OPEN"
+                    raise
+                await self.limiter.acquire(method, priority)
+                body = None
+                try:
+                    sent += 1
+                    async with session.post(url, data=payload, headers=headers) as response:
+                        body = await response.read()  # the body is read and decoded once
+                        received += len(body)
+                        limit_error = get_limit_error(response.status, body)
+
+                        if not limit_error or limit_attempt >= self.max_limit_retries:
+                            response.raise_for_status()
+                            result = json_loads(body)
+                            operating = (result.get("time") or {}).get("operating")
+                            self.limiter.update(method, result.get("time"))
+                            self.breaker.on_success()
+                            error = None
+                            return result
+
+                    self.breaker.on_success()
+                    # the limit is exceeded, wait and try again (it is not counted as a failed attempt)
+                    error = limit_error
+                    self.limiter.penalize(method, limit_error)
+                    await asyncio.sleep(backoff_delay(limit_attempt, self.limit_backoff))
+                    limit_attempt += 1
+
+                except (aiohttp.ClientError, aiohttp.ClientResponseError, asyncio.TimeoutError, ValueError) as e:
+                    attempt += 1
+                    error = str(e.status) if isinstance(e, aiohttp.ClientResponseError) else type(e).__name__
+                    if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+                        self.breaker.on_success()  # Bitrix is working, the request is wrong
+                        attempt = self.max_retries  # the same request fails again, it is not retried
+                    elif self.breaker.on_failure():
+                        await self.write_log(
+                            ERROR, "_make_request", e,
+                            f"Bitrix is unavailable, requests are stopped for {self.breaker.reset_timeout} seconds"
+                        )
+
+                    if not self.breaker.is_available:
+                        raise BitrixUnavailable(self.breaker.reset_timeout) from e
+
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(self.retry_delay)
+                    else:
+                        msg = (
+                            f"\n------------------------------------------------------------\n"
+                            f"url={url}\nparams={params}\n"
+                            f"Error response body:{body.decode(errors='replace') if body else None}\n"
+                            f"------------------------------------------------------------"
+                        )
+                        await self.write_log(ERROR, "_make_request", e, msg)
+
+        finally:
+            self.metrics.observe(
+                method or url, monotonic() - started, sent=len(payload or b"") * sent, received=received,
+                retries=max(sent - 1, 0), error=error, operating=operating
+            )
+
+    async def call_method(self, method: str, params: dict = None, priority: int = None) -> dict:
         """
         Calls the Bitrix24 API method.
 
         :param method: Name of the API method.
         :param params: Method parameters.
+        :param priority: limiter.Priority of the request, by default the priority of the current task
         :return: API response in the form of a dictionary.
+        Concurrent calls of the same read only method with the same params share one request and get the same response.
         """
+        if self.cache:
+            if self.cache.is_cached(method):
+                cached = self.cache.get(method, params)
+                if cached is not None:
+                    return cached
+            elif not self.is_single_flight(method):
+                # before and after the write: a read made while the write is sent may cache the old object
+                self.cache.on_call(method, params)
+                try:
+                    return await self._call_method(method, params, priority)
+                finally:
+                    self.cache.on_call(method, params)
+
+        if not self.is_single_flight(method):
+            return await self._call_method(method, params, priority)
+
+        key = (method, canonical_params(params))
+        request = self._in_flight.get(key)
+        if request is None:
+            request = asyncio.create_task(self._call_method(method, params, priority))
+            self._in_flight[key] = request
+            request.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield: if one caller is cancelled, the request is still needed by the others
+        return await asyncio.shield(request)
+
+    def is_single_flight(self, method: str) -> bool:
+        action = method.rsplit(".", 1)[-1].lower()
+        return action.startswith(self.single_flight_actions)
+
+    async def _call_method(self, method: str, params: dict | None, priority: int | None) -> dict:
         url = f"{self.webhook_url}{'' if self.webhook_url[-1] == '/' else '/'}{method}.json"
-        return await self._make_request(url, params)
+        result = await self._make_request(url, params, method=method, priority=priority)
+
+        if self.cache and result:
+            self.cache.set(method, params, result)
+        return result
+
+    async def call_batch(self, calls: Sequence[tuple[str, dict | None]], halt: bool = False) -> list[dict | None]:
+        """
+        Calls several methods with "batch" requests (up to "batch_limit" commands per request).
+        doc: https://apidocs.bitrix24.ru/api-reference/how-to-call-rest-api/batch.html
+
+        :param calls: [(method, params), ...]
+        :param halt: stop the batch on the first error
+        :return: responses in the order of calls. Each response has the same shape as call_method response:
+        {"result": ..., "total": ..., "next": ...} or {"error": ..., "error_description": ...} if the command failed.
+        None if the command was not executed.
+        """
+        results = []
+        for start in range(0, len(calls), self.batch_limit):
+            chunk = calls[start:start + self.batch_limit]
+            cmd = {
+                f"cmd{i}": f"{method}?{build_query(params)}" if params else method
+                for i, (method, params) in enumerate(chunk)
+            }
+            # the commands do not pass call_method, so their writes drop the cache here
+            self._invalidate_cache(chunk)
+            try:
+                response = await self.call_method(method="batch", params={"halt": int(halt), "cmd": cmd})
+            finally:
+                self._invalidate_cache(chunk)
+
+            if not response or not isinstance(response.get("result"), dict):
+                results += [None] * len(chunk)
+                continue
+
+            batch_result = response["result"]
+            # php returns an empty list instead of an empty dict
+            done = batch_result.get("result") or {}
+            errors = batch_result.get("result_error") or {}
+            totals = batch_result.get("result_total") or {}
+            nexts = batch_result.get("result_next") or {}
+
+            for key in cmd:
+                if key in errors:
+                    results.append(errors[key])
+                elif key in done:
+                    result = {"result": done[key]}
+                    if key in totals:
+                        result["total"] = totals[key]
+                    if key in nexts:
+                        result["next"] = nexts[key]
+                    results.append(result)
+                else:
+                    results.append(None)
+
+        return results
+
+    def _invalidate_cache(self, calls: Sequence[tuple[str, dict | None]]) -> None:
+        if self.cache:
+            for method, params in calls:
+                self.cache.on_call(method, params)
+
+    async def paginate(
+            self, method: str, params: dict = None, result_key: str = None,
+            concurrency: int = 5
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Iterates over the pages of a list method. "total" is taken from the first page,
+        the remaining pages are requested concurrently.
+        Pages are returned in the order of "start": a page received early waits for the previous ones.
+        Requests not needed anymore (the caller stopped iterating, a page failed) are cancelled.
+
+        :param method: list method (user.get, department.get...)
+        :param params: method parameters without "start"
+        :param result_key: if rows are inside result (tasks.task.list -> result.tasks)
+        :param concurrency: max concurrent page requests
+        :return: async iterator of pages (list of rows)
+        """
+        params = dict(params or {})
+        pages: list[asyncio.Task] = []  # in the order of offsets
+
+        def get_rows(response: dict | None, start: int) -> list[dict]:
+            if not response or "result" not in response:
+                raise Exception(f"Can't get {method} page {start=}")
+
+            rows = response["result"]
+            if result_key:
+                rows = rows.get(result_key) or []
+            return rows
+
+        try:
+            first = await self.call_method(method, {**params, "start": 0})
+            yield get_rows(first, 0)
+
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def get_page(offset: int) -> list[dict]:
+                async with semaphore:
+                    return get_rows(await self.call_method(method, {**params, "start": offset}), offset)
+
+            offsets = range(self.page_size, int(first.get("total") or 0), self.page_size)
+            pages += [asyncio.create_task(get_page(offset)) for offset in offsets]
+            for page in pages:
+                yield await page
+
+        finally:
+            for page in pages:
+                page.cancel()
+
+    async def get_list(self, method: str, params: dict = None, result_key: str = None, **kwargs) -> list[dict]:
+        """Returns all rows of a list method (see paginate)"""
+        rows = []
+        async for page in self.paginate(method, params, result_key, **kwargs):
+            rows += page
+        return rows
 
     async def configurate(self) -> BitrixConfigData:
         domain = self.webhook_url[:self.webhook_url.index("/rest")]
@@ -122,19 +391,10 @@ class Bitrix:
             getting the storage id to create a folder where task files will be stored
             doc: https://dev.1c-bitrix.ru/rest_help/disk/storage/disk_storage_getlist.php
             """
-            index = 1
-            all_storages = []
-            while True:
-                storages = await self.call_method(method="disk.storage.getlist", params={"sort": "ID", "start": index})
-                if storages:
-                    all_storages += storages["result"]
-                    index += 50
-                    if len(storages["result"]) < 50:
-                        break
-
-            for storage in all_storages:
-                if storage["NAME"] == f_name:
-                    return storage["ID"]
+            async for storages in self.paginate(method="disk.storage.getlist", params={"sort": "ID"}):
+                for storage in storages:
+                    if storage["NAME"] == f_name:
+                        return storage["ID"]
 
         user_storage_id = await get_user_storage_id(full_name)
 
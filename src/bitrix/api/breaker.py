@@ -0,0 +1,81 @@
+from time import monotonic
+
+
+class BitrixUnavailable(Exception):
+    """Bitrix is not responding, the request was not sent (the circuit breaker is open)"""
+
+    def __init__(self, retry_after: float = 0):
+        super().__init__(f"Bitrix is unavailable, retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class BreakerState:
+    CLOSED = "closed"  # requests are sent
+    OPEN = "open"  # requests fail immediately with BitrixUnavailable
+    HALF_OPEN = "half_open"  # one probe request is sent, others fail
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to Bitrix after "failure_threshold" failures in a row (connection errors, timeouts, 5xx).
+    After "reset_timeout" seconds one probe request is let through: if it succeeds, the breaker is closed,
+    otherwise it is opened again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0  # failures in a row
+        self.opened_at: float | None = None
+        self._probe_at: float | None = None  # start of the half-open probe
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return BreakerState.CLOSED
+        if monotonic() - self.opened_at < self.reset_timeout:
+            return BreakerState.OPEN
+        return BreakerState.HALF_OPEN
+
+    @property
+    def is_available(self) -> bool:
+        """False if requests will fail without being sent"""
+        return self.state == BreakerState.CLOSED
+
+    def check(self) -> None:
+        """Raises BitrixUnavailable if the breaker is open"""
+        if self.state == BreakerState.OPEN:
+            raise BitrixUnavailable(self.opened_at + self.reset_timeout - monotonic())
+
+    def before_request(self) -> None:
+        """Raises BitrixUnavailable if the request must not be sent"""
+        state = self.state
+        if state == BreakerState.CLOSED:
+            return
+
+        if state == BreakerState.HALF_OPEN:
+            now = monotonic()
+            # one probe at a time (a probe that hangs longer than reset_timeout is replaced by a new one)
+            if self._probe_at is None or now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now
+                return
+
+        raise BitrixUnavailable(max(self.opened_at + self.reset_timeout - monotonic(), 0))
+
+    def on_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def on_failure(self) -> bool:
+        """:return: True if the breaker was opened by this failure"""
+        self.failures += 1
+        was_closed = self.opened_at is None
+
+        if self._probe_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
+            self._probe_at = None
+            return was_closed
+
+        return False
@@ -0,0 +1,144 @@
+import json
+from copy import deepcopy
+from time import monotonic
+from dataclasses import dataclass
+from collections import OrderedDict
+
+
+def canonical_params(params: dict | None) -> str:
+    """Params as a string that does not depend on the order of keys (cache and single-flight key)"""
+    return json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+@dataclass
+class CacheStats:
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    invalidations: int
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return round(self.hits / requests, 3) if requests else 0.0
+
+
+class ResponseCache:
+    """
+    LRU cache of responses of read only Bitrix methods.
+    Each method has its own TTL, only methods from "ttls" are cached.
+
+    Responses are tagged ("task", task_id), ("group", group_id), ("folder", folder_id),
+    so they can be dropped when Bitrix reports a change (webhooks) or when we change the object ourselves.
+    """
+    ttls = {
+        "tasks.task.get": 30,
+        "task.stages.get": 300,
+        "disk.folder.getchildren": 60,
+        "sonet_group.user.groups": 300,
+    }
+
+    # {method: (tag name, param name)} used to tag responses
+    tag_params = {
+        "tasks.task.get": ("task", "taskId"),
+        "task.stages.get": ("group", "entityId"),
+        "disk.folder.getchildren": ("folder", "id"),
+    }
+
+    # write methods drop the responses of the object they change
+    invalidated_by = {
+        "tasks.task.update": ("task", "taskId"),
+        "tasks.task.delete": ("task", "taskId"),
+        "tasks.task.complete": ("task", "taskId"),
+        "tasks.task.approve": ("task", "taskId"),
+        "tasks.task.disapprove": ("task", "taskId"),
+        "disk.folder.addsubfolder": ("folder", "id"),
+        "disk.folder.uploadfile": ("folder", "id"),
+    }
+
+    def __init__(self, max_size: int = 1000, ttls: dict[str, float] = None):
+        """
+        :param max_size: max responses in the cache, the least recently used are removed
+        :param ttls: {method: seconds} overrides of the default TTLs, 0 disables the cache of the method
+        """
+        self.max_size = max_size
+        self.ttls = {**self.ttls, **(ttls or {})}
+
+        # {key: (expires, response, tag)}
+        self._data: OrderedDict[tuple[str, str], tuple[float, dict, tuple | None]] = OrderedDict()
+        self._tags: dict[tuple[str, int], set[tuple[str, str]]] = {}  # {tag: keys}
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def is_cached(self, method: str) -> bool:
+        return bool(self.ttls.get(method))
+
+    def get(self, method: str, params: dict | None) -> dict | None:
+        key = (method, canonical_params(params))
+        item = self._data.get(key)
+        if item is None or item[0] < monotonic():
+            if item is not None:
+                self._remove(key)
+            self._counters["misses"] += 1
+            return None
+
+        self._data.move_to_end(key)
+        self._counters["hits"] += 1
+        return deepcopy(item[1])  # the caller may change the response
+
+    def set(self, method: str, params: dict | None, response: dict) -> None:
+        ttl = self.ttls.get(method)
+        if not ttl or not response or "error" in response:
+            return
+
+        key = (method, canonical_params(params))
+        tag = self._get_tag(self.tag_params.get(method), params)
+        self._data[key] = (monotonic() + ttl, deepcopy(response), tag)
+        self._data.move_to_end(key)
+
+        if tag:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._data) > self.max_size:
+            self._remove(next(iter(self._data)))
+
+    def on_call(self, method: str, params: dict | None) -> None:
+        """Drops the cached responses of the object changed by a write method"""
+        tag = self._get_tag(self.invalidated_by.get(method), params)
+        if tag:
+            self.invalidate(*tag)
+
+    def invalidate(self, tag_name: str, object_id: int | str) -> None:
+        keys = self._tags.pop((tag_name, int(object_id)), set())
+        for key in keys:
+            self._data.pop(key, None)
+        self._counters["invalidations"] += len(keys)
+
+    def invalidate_task(self, task_id: int | str) -> None:
+        self.invalidate("task", task_id)
+
+    def clear(self, method: str = None) -> None:
+        for key in [key for key in self._data if method is None or key[0] == method]:
+            self._remove(key)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(size=len(self._data), max_size=self.max_size, **self._counters)
+
+    @staticmethod
+    def _get_tag(tag_param: tuple[str, str] | None, params: dict | None) -> tuple[str, int] | None:
+        if not tag_param or not params:
+            return None
+
+        tag_name, param = tag_param
+        try:
+            return tag_name, int(params[param])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        _, _, tag = self._data.pop(key)
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
@@ -1,24 +1,21 @@
+from typing import AsyncIterator
+
 from .base import Bitrix
+from .structs import BitDepartment, BitUser
 
 
 class Department(Bitrix):
-    async def get_departments(self) -> list[dict] | None:  # TODO
+    async def get_departments(self) -> list[BitDepartment] | None:
         """Returns a list of all departments."""
+        departments = await self.get_list(method="department.get", params={"sort": "ID"})
+        return [BitDepartment.from_dict(department) for department in departments]
 
-        index = 1
-        all_departments = []
-        while True:
-            departments = await self.call_method(method="department.get", params={"sort": "ID", "start": index})
-            if departments:
-                all_departments += departments["result"]
-                index += 50
-                if len(departments["result"]) < 50:
-                    break
-
-        return all_departments
+    async def iter_departments(self, concurrency: int = 5) -> AsyncIterator[list[BitDepartment]]:
+        """Returns all departments page by page, pages come as soon as they are received."""
+        async for departments in self.paginate(method="department.get", params={"sort": "ID"}, concurrency=concurrency):
+            yield [BitDepartment.from_dict(department) for department in departments]
 
-    async def employees_departments(self, department_id: int) -> list[dict] | None:
+    async def employees_departments(self, department_id: int) -> list[BitUser] | None:
         """Returns a list of all users in a department."""
-        result = await self.call_method(method="user.get", params={"FILTER": {"UF_DEPARTMENT": department_id}})
-        if result:
-            return result.get("result")
+        users = await self.get_list(method="user.get", params={"FILTER": {"UF_DEPARTMENT": department_id}})
+        return [BitUser.from_dict(user) for user in users]
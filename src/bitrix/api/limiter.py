@@ -0,0 +1,145 @@
+import json
+import asyncio
+import heapq
+from itertools import count
+from random import uniform
+from time import monotonic, time
+from contextvars import ContextVar
+
+
+class Priority:
+    INTERACTIVE = 0  # bot handlers, the user is waiting for an answer
+    WEBHOOK = 1  # Bitrix webhooks
+    BACKGROUND = 2  # sync loops, reports
+
+    ALL = {INTERACTIVE, WEBHOOK, BACKGROUND}
+
+
+# priority of the Bitrix requests made in the current task (set once at the start of a loop/handler)
+request_priority: ContextVar[int] = ContextVar("request_priority", default=Priority.WEBHOOK)
+
+QUERY_LIMIT_EXCEEDED = "QUERY_LIMIT_EXCEEDED"
+OPERATION_TIME_LIMIT = "OPERATION_TIME_LIMIT"
+LIMIT_ERRORS = {QUERY_LIMIT_EXCEEDED, OPERATION_TIME_LIMIT}
+
+
+def backoff_delay(attempt: int, base: float = 1.0, max_delay: float = 60.0) -> float:
+    """Exponential backoff with jitter: half of the delay is fixed, the other half is random"""
+    delay = min(max_delay, base * 2 ** attempt)
+    return delay / 2 + uniform(0, delay / 2)
+
+
+def get_limit_error(status: int, body: str | bytes) -> str | None:
+    """Returns the Bitrix limit error code from the error response"""
+    if status < 400:
+        return None
+
+    try:
+        error = json.loads(body).get("error")
+    except (ValueError, AttributeError):
+        return None
+
+    return error if error in LIMIT_ERRORS else None
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests of one Bitrix client.
+    When there are no free tokens, requests wait in a queue and tokens are given to the highest priority first.
+
+    Bitrix also limits the execution time of each method ("time.operating" in every response,
+    480 seconds per 10 minutes). When a method uses up its share of this time,
+    requests to it wait until "operating_reset_at". Interactive requests have the largest share.
+    """
+    operating_shares = {Priority.INTERACTIVE: 1.0, Priority.WEBHOOK: 0.9, Priority.BACKGROUND: 0.7}
+
+    def __init__(self, rate: float = 2.0, burst: int = 50, operating_limit: float = 480.0):
+        """
+        :param rate: tokens per second
+        :param burst: bucket size
+        :param operating_limit: seconds of method execution time per 10 minutes
+        """
+        self.rate = rate
+        self.burst = burst
+        self.operating_limit = operating_limit
+
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.operating: dict[str, tuple[float, float]] = {}  # {method: (operating seconds, reset unix time)}
+
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []  # heap (priority, order, future)
+        self._order = count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def acquire(self, method: str = None, priority: int = None) -> None:
+        priority = request_priority.get() if priority is None else priority
+        await self._wait_operating(method, priority)
+
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._release()
+        await future
+
+    def update(self, method: str | None, time_info: dict | None) -> None:
+        """Saves "time" from the Bitrix response"""
+        if not method or not time_info or "operating" not in time_info:
+            return
+
+        reset_at = time_info.get("operating_reset_at") or time() + 600
+        self.operating[method] = (float(time_info["operating"]), float(reset_at))
+
+    def penalize(self, method: str | None, error: str) -> None:
+        """Called when Bitrix answered with a limit error: stop giving tokens until the bucket is refilled"""
+        self.tokens = 0
+        self.updated = monotonic()
+
+        if method and error == OPERATION_TIME_LIMIT:
+            _, reset_at = self.operating.get(method, (0, time() + 60))
+            self.operating[method] = (self.operating_limit, reset_at)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    async def _wait_operating(self, method: str | None, priority: int) -> None:
+        info = self.operating.get(method)
+        if not info:
+            return
+
+        used, reset_at = info
+        delay = reset_at - time()
+        if delay <= 0:
+            self.operating.pop(method, None)
+
+        elif used >= self.operating_limit * self.operating_shares.get(priority, 1.0):
+            await asyncio.sleep(delay)
+            if self.operating.get(method) == info:
+                self.operating.pop(method, None)
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._release()
+
+    def _release(self) -> None:
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            *_, future = heapq.heappop(self._waiters)
+            if future.done():  # cancelled
+                continue
+
+            self.tokens -= 1
+            future.set_result(None)
+
+        if self._waiters and self._timer is None:
+            delay = max(1 - self.tokens, 0) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
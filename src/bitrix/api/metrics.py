@@ -0,0 +1,178 @@
+from bisect import bisect_left
+from time import monotonic
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+
+class Subsystem:
+    BOT = "bot"  # bot handlers
+    WEBHOOK = "webhook"  # Bitrix webhooks
+    SYNC = "sync"  # sync loops
+    REPORT = "report"  # task reports
+
+
+# subsystem that makes the Bitrix requests in the current task (set once at the start of a loop/handler)
+request_subsystem: ContextVar[str] = ContextVar("request_subsystem", default=Subsystem.WEBHOOK)
+
+# upper bounds of the latency histogram buckets in seconds (the last bucket is +Inf)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass(slots=True)
+class MethodStats:
+    calls: int = 0
+    retries: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    latency_sum: float = 0.0
+    latency_max: float = 0.0
+    operating: float = 0.0  # last "time.operating" of the method reported by Bitrix (seconds used in 10 minutes)
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    errors: dict[str, int] = field(default_factory=dict)  # {error code: count}
+
+    def add(
+            self, seconds: float, sent: int, received: int, retries: int, error: str | None, operating: float | None
+    ) -> None:
+        self.calls += 1
+        self.retries += retries
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        if operating is not None:
+            self.operating = operating
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    @property
+    def error_count(self) -> int:
+        return sum(self.errors.values())
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_sum / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket with the q-th call (q from 0 to 1), the max latency for the last bucket"""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        total = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, self.buckets):
+            total += bucket
+            if total >= rank:
+                return bound
+        return self.latency_max
+
+
+class BitrixMetrics:
+    """
+    Bitrix requests per (method, subsystem): latency histogram, sent and received bytes,
+    retries, error codes and "time.operating".
+    Totals are exported in Prometheus text format, the summary covers the current and the previous "window".
+    Disk transfers are recorded as "disk.upload" and "disk.download".
+    """
+
+    def __init__(self, window: float = 3600):
+        """:param window: seconds of one summary window"""
+        self.window = window
+        self.total: dict[tuple[str, str], MethodStats] = {}
+        self.current: dict[tuple[str, str], MethodStats] = {}
+        self.previous: dict[tuple[str, str], MethodStats] = {}
+        self.window_start = monotonic()
+
+    def observe(
+            self, method: str, seconds: float, sent: int = 0, received: int = 0, retries: int = 0,
+            error: str = None, operating: float = None, subsystem: str = None
+    ) -> None:
+        """
+        :param seconds: duration of the call with all retries
+        :param error: error code of the failed call (Bitrix "error", HTTP status or exception name)
+        :param subsystem: by default request_subsystem of the current task
+        """
+        self._roll()
+        key = (method, subsystem or request_subsystem.get())
+        for stats in (self.total, self.current):
+            if key not in stats:
+                stats[key] = MethodStats()
+            stats[key].add(seconds, sent, received, retries, error, operating)
+
+    def _roll(self) -> None:
+        now = monotonic()
+        if now - self.window_start >= self.window:
+            # a window without calls is also a window
+            self.previous = self.current if now - self.window_start < self.window * 2 else {}
+            self.current = {}
+            self.window_start = now
+
+    def prometheus(self) -> str:
+        """Totals since the start in Prometheus text exposition format"""
+        lines = []
+
+        def family(name: str, metric_type: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def labels(method: str, subsystem: str, **other) -> str:
+            values = {"method": method, "subsystem": subsystem, **other}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in values.items()) + "}"
+
+        family("bitrix_request_duration_seconds", "histogram", "Duration of Bitrix calls with retries")
+        for (method, subsystem), stats in sorted(self.total.items()):
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += bucket
+                lines.append(f"bitrix_request_duration_seconds_bucket{labels(method, subsystem, le=bound)} {cumulative}")
+            lines.append(f"bitrix_request_duration_seconds_bucket{labels(method, subsystem, le='+Inf')} {stats.calls}")
+            lines.append(f"bitrix_request_duration_seconds_sum{labels(method, subsystem)} {stats.latency_sum:.6f}")
+            lines.append(f"bitrix_request_duration_seconds_count{labels(method, subsystem)} {stats.calls}")
+
+        counters = (
+            ("bitrix_request_sent_bytes_total", "Request body bytes", "bytes_sent"),
+            ("bitrix_request_received_bytes_total", "Response body bytes", "bytes_received"),
+            ("bitrix_request_retries_total", "Repeated requests after errors and limits", "retries"),
+        )
+        for name, help_text, attr in counters:
+            family(name, "counter", help_text)
+            for (method, subsystem), stats in sorted(self.total.items()):
+                lines.append(f"{name}{labels(method, subsystem)} {getattr(stats, attr)}")
+
+        family("bitrix_operating_seconds", "gauge", "Last time.operating of the method reported by Bitrix")
+        for (method, subsystem), stats in sorted(self.total.items()):
+            lines.append(f"bitrix_operating_seconds{labels(method, subsystem)} {stats.operating}")
+
+        family("bitrix_request_errors_total", "counter", "Failed Bitrix calls by error code")
+        for (method, subsystem), stats in sorted(self.total.items()):
+            for code, errors in sorted(stats.errors.items()):
+                lines.append(f"bitrix_request_errors_total{labels(method, subsystem, code=code)} {errors}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 10, previous: bool = False) -> str:
+        """
+        Text summary of the window for the bot, methods with the largest total latency first.
+        :param previous: the previous full window instead of the current one
+        """
+        self._roll()
+        stats = self.previous if previous else self.current
+        if not stats:
+            return "Нет запросов к Bitrix"
+
+        minutes = (monotonic() - self.window_start) / 60
+        title = "Предыдущий период" if previous else f"Текущий период ({minutes:.0f} мин.)"
+        calls = sum(i.calls for i in stats.values())
+        errors = sum(i.error_count for i in stats.values())
+        lines = [f"<b>{title}</b>: {calls} запросов, {errors} ошибок"]
+
+        for (method, subsystem), i in sorted(stats.items(), key=lambda x: x[1].latency_sum, reverse=True)[:top]:
+            line = (
+                f"\n<code>{method}</code> ({subsystem}) - {i.calls} шт., "
+                f"ср. {i.latency_avg:.2f} с., p95 {i.percentile(0.95):.2f} с., "
+                f"{i.bytes_received / 1024:.0f} КБ, повторов {i.retries}, operating {i.operating:.1f} с."
+            )
+            if i.errors:
+                line += ", ошибки: " + ", ".join(f"{code} {count}" for code, count in i.errors.items())
+            lines.append(line)
+
+        return "".join(lines)
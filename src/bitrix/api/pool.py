@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+from dataclasses import dataclass
+
+import aiohttp
+
+
+@dataclass
+class PoolStats:
+    limit: int
+    limit_per_host: int
+    acquired: int  # connections in use now
+    idle: int  # open connections waiting for reuse
+    created: int  # connections opened since start
+    reused: int  # requests sent over an already open connection
+    waits: int  # requests that waited for a free connection
+    wait_time: float  # total seconds of waiting for a free connection
+
+
+class HttpPool:
+    """
+    One aiohttp session (connection pool) for all Bitrix traffic: REST calls, disk uploads and downloads.
+    Connections are kept alive and DNS answers are cached, so a new file does not cost a new TCP+TLS handshake.
+    """
+
+    def __init__(
+            self, limit: int = 100, limit_per_host: int = 20, keepalive_timeout: float = 30,
+            dns_cache_ttl: int = 300, timeout: float = 60, connect_timeout: float = 10,
+            transfer_timeout: float = 300
+    ):
+        """
+        :param limit: max open connections
+        :param limit_per_host: max open connections to one host
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param dns_cache_ttl: seconds the DNS answer is cached
+        :param timeout: total timeout of a REST request
+        :param connect_timeout: timeout to get a connection (includes waiting for a free one)
+        :param transfer_timeout: total timeout of a file upload/download
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.transfer_timeout = aiohttp.ClientTimeout(total=transfer_timeout, connect=connect_timeout)
+
+        self.session: aiohttp.ClientSession | None = None
+        self._counters = {"created": 0, "reused": 0, "waits": 0, "wait_time": 0.0}
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Returns the pool session, creates it on the first call (must be called inside the event loop)"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout, trace_configs=[self._trace_config()]
+            )
+
+        return self.session
+
+    def stats(self) -> PoolStats:
+        connector = self.session.connector if self.session else None
+        return PoolStats(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            acquired=len(getattr(connector, "_acquired", ())),
+            idle=sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+            created=self._counters["created"],
+            reused=self._counters["reused"],
+            waits=self._counters["waits"],
+            wait_time=round(self._counters["wait_time"], 3),
+        )
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        counters = self._counters
+
+        async def on_queued_start(_, context: SimpleNamespace, __):
+            context.queued_at = asyncio.get_running_loop().time()
+
+        async def on_queued_end(_, context: SimpleNamespace, __):
+            counters["waits"] += 1
+            counters["wait_time"] += asyncio.get_running_loop().time() - context.queued_at
+
+        async def on_create_end(*_):
+            counters["created"] += 1
+
+        async def on_reuse(*_):
+            counters["reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
@@ -3,21 +3,46 @@ import asyncio
 import aiohttp
 from io import BytesIO
 from pathlib import Path
+from time import monotonic
 from logging import ERROR
-from typing import BinaryIO, Union, IO
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Union, IO, AsyncIterable, AsyncIterator, Callable, Sequence
 
-from .base import Bitrix
+from .base import Bitrix, json_loads
+
+UploadSource = Union[Path, BinaryIO, AsyncIterable[bytes]]
+UploadProgress = Callable[[str, int], None]
+
+
+@dataclass
+class UploadResult:
+    name: str
+    file: dict | None = None  # uploaded file info from bitrix
+    error: Exception | None = None
 
 
 class Storage(Bitrix):
+    chunk_size = 64 * 1024  # bytes read from the download at once
+    spool_size = 1024 * 1024  # downloads larger than this are moved from memory to a temp file on disk
+    max_download_size = 50 * 1024 * 1024  # telegram bot api does not accept larger files
+    upload_concurrency = 4  # files uploaded at the same time by upload_files
 
     @staticmethod
     def sanitize_directory_name(directory_name):
         sanitized_name = re.sub(r'[^a-zA-Zа-яА-Я0-9_\-]', '_', directory_name)
         return sanitized_name
 
+    @staticmethod
+    def normalize_folder_name(name: str) -> str:
+        """Bitrix folder names are case-insensitive"""
+        return name.strip().lower()
+
     async def create_folder(self, target_id: int, name: str, subfolder=True) -> int | None:
         """
+        Subfolders are found in the folder index ("folder_index"), so usually it's one Bitrix call.
+        The children of the folder are indexed on the first call for this folder.
+
         :param target_id: id of the folder/storage in which the folder will be created
         :param name: folder name
         :param subfolder: create in subfolder
@@ -25,16 +50,24 @@ class Storage(Bitrix):
         """
         async def check_exits(folder_name, target_folder: int, sub=True) -> str | None:
             method = "disk.folder.getchildren" if sub else "disk.storage.getchildren"
-            storages = await self.call_method(method=method, params={"id": target_folder})
-            for storage in storages.get("result"):
-                if storage["NAME"].lower() == folder_name.lower():
-                    return storage["ID"]
+            async for storages in self.paginate(method=method, params={"id": target_folder}):
+                for storage in storages:
+                    if self.normalize_folder_name(storage["NAME"]) == folder_name:
+                        return storage["ID"]
 
         name = self.sanitize_directory_name(name)[0:128]
+        key = self.normalize_folder_name(name)
+        indexed = subfolder and self.folder_index is not None
         try:
-            exits = await check_exits(folder_name=name, target_folder=target_id, sub=subfolder)
-            if exits:
-                return int(exits)
+            if indexed:
+                folder_id = await self.folder_index.get_folder_id(target_id, key)
+                if folder_id is None and not await self.folder_index.has_folder_index(target_id):
+                    folder_id = (await self.rebuild_folder_index(target_id)).get(key)
+            else:
+                folder_id = await check_exits(folder_name=key, target_folder=target_id, sub=subfolder)
+
+            if folder_id:
+                return int(folder_id)
 
             if subfolder:
                 folder = await self.call_method(
@@ -45,7 +78,14 @@ class Storage(Bitrix):
                     method="disk.storage.addfolder", params={"id": target_id, "data": {"NAME": name}}
                 )
 
-            return int(folder.get("result").get("ID"))
+            if not folder and indexed:  # the folder was created outside the bot, the index is outdated
+                return (await self.rebuild_folder_index(target_id)).get(key)
+
+            folder_id = int(folder.get("result").get("ID"))
+            if indexed:
+                await self.folder_index.add_folder(target_id, key, folder_id)
+
+            return folder_id
 
         except Exception as e:
             await self.write_log(
@@ -55,32 +95,88 @@ class Storage(Bitrix):
                 msg=f"{target_id=}, {name=}, {subfolder=}"
             )
 
-    async def upload_file(self, folder_id: int, file_name: str, file: Union[Path, BinaryIO]) -> dict:
+    async def rebuild_folder_index(self, parent_id: int) -> dict[str, int]:
+        """
+        Reads all subfolders of the folder (all pages) and replaces them in the folder index
+        :return: {normalized name: folder id}
+        """
+        if self.cache:  # the cached children were listed before the folder was created
+            self.cache.invalidate("folder", parent_id)
+
+        folders = {}
+        params = {"id": parent_id, "filter": {"TYPE": "folder"}}
+        async for children in self.paginate(method="disk.folder.getchildren", params=params):
+            for child in children:
+                if child.get("TYPE") == "folder":
+                    folders.setdefault(self.normalize_folder_name(child["NAME"]), int(child["ID"]))
+
+        if self.folder_index is not None:
+            await self.folder_index.replace_folders(parent_id, folders)
+        return folders
+
+    async def _upload_file(
+            self, folder_id: int, file_name: str, file: UploadSource, progress: UploadProgress = None
+    ) -> dict:
+        # Get a link to download the file
+        upload_info = await self.call_method(method="disk.folder.uploadfile", params={"id": folder_id})
+        upload_url = upload_info.get("result").get("uploadUrl")
+        field_name = upload_info.get("result").get("field")
+
+        # Upload the file to the received URL
+        session = await self.get_session()
+        form = aiohttp.FormData()
+        size = 0  # bytes sent, for the metrics
+        opened = None
+
+        def count_sent(name: str, sent: int) -> None:
+            nonlocal size
+            size = sent
+            if progress:
+                progress(name, sent)
+
+        if isinstance(file, Path):
+            opened = open(file, 'rb')
+            size = file.stat().st_size
+            form.add_field(field_name, opened, filename=file.name)
+        elif isinstance(file, (BytesIO, IO)):
+            if file.seekable():
+                position = file.tell()
+                size = file.seek(0, 2) - position
+                file.seek(position)
+            form.add_field(field_name, file, filename=file_name)
+        elif isinstance(file, AsyncIterable):
+            # the chunks are sent as soon as they are received (chunked multipart body)
+            form.add_field(field_name, self._count_chunks(file, file_name, count_sent), filename=file_name)
+        else:
+            return {}
+
+        started = monotonic()
+        error = None
+        received = 0
+        try:
+            async with session.post(upload_url, data=form, timeout=self.pool.transfer_timeout) as response:
+                body = await response.read()
+                received = len(body)
+                response.raise_for_status()
+                result = json_loads(body)
+        except Exception as e:
+            error = str(e.status) if isinstance(e, aiohttp.ClientResponseError) else type(e).__name__
+            raise
+        finally:
+            if opened:
+                opened.close()
+            self.metrics.observe(
+                "disk.upload", monotonic() - started, sent=size, received=received, error=error
+            )
+
+        return result["result"]
+
+    async def upload_file(self, folder_id: int, file_name: str, file: UploadSource) -> dict:
+        """
+        :param file: path, binary file or async iterable of chunks (e.g. utils.telegram_file_stream)
+        """
         try:
-            # Get a link to download the file
-            upload_info = await self.call_method(method="disk.folder.uploadfile", params={"id": folder_id})
-            upload_url = upload_info.get("result").get("uploadUrl")
-            field_name = upload_info.get("result").get("field")
-
-            # Upload the file to the received URL
-            async with aiohttp.ClientSession() as session:
-                form = aiohttp.FormData()
-
-                if isinstance(file, Path):
-                    with open(file, 'rb') as f:
-                        form.add_field(field_name, f, filename=file.name)
-                        async with session.post(upload_url, data=form) as response:
-                            response.raise_for_status()
-                            result = await response.json()
-                elif isinstance(file, (BytesIO, IO)):
-                    form.add_field(field_name, file, filename=file_name)
-                    async with session.post(upload_url, data=form) as response:
-                        response.raise_for_status()
-                        result = await response.json()
-                else:
-                    return {}
-
-                return result["result"]
+            return await self._upload_file(folder_id, file_name, file)
         except Exception as e:
             await self.write_log(
                 log_level=ERROR,
@@ -89,44 +185,132 @@ class Storage(Bitrix):
                 msg=f"{folder_id=}, {file_name=}"
             )
 
+    async def upload_files(
+            self, folder_id: int, files: Sequence[tuple[str, UploadSource]],
+            concurrency: int = None, progress: UploadProgress = None
+    ) -> list[UploadResult]:
+        """
+        Uploads several files at once (no more than "concurrency" at the same time).
+        Async iterable sources are not read until their upload starts.
+
+        :param files: [(file_name, file), ...] file as in upload_file
+        :param concurrency: by default "upload_concurrency"
+        :param progress: called with (file_name, bytes sent) for every chunk of async iterable sources
+        :return: results in the order of files, failed uploads have "error"
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.upload_concurrency)
+
+        async def upload(file_name: str, file: UploadSource) -> UploadResult:
+            async with semaphore:
+                try:
+                    return UploadResult(name=file_name, file=await self._upload_file(folder_id, file_name, file, progress))
+                except Exception as e:
+                    await self.write_log(
+                        log_level=ERROR,
+                        name="class Storage(Bitrix) -> async def upload_files",
+                        e=e,
+                        msg=f"{folder_id=}, {file_name=}"
+                    )
+                    return UploadResult(name=file_name, error=e)
+
+        return list(await asyncio.gather(*(upload(file_name, file) for file_name, file in files)))
+
+    @staticmethod
+    async def _count_chunks(
+            chunks: AsyncIterable[bytes], file_name: str, progress: UploadProgress = None
+    ) -> AsyncIterator[bytes]:
+        sent = 0
+        async for chunk in chunks:
+            sent += len(chunk)
+            if progress:
+                progress(file_name, sent)
+            yield chunk
+
     async def get_file(self, file_bit_id: int) -> dict | None:
         result = await self.call_method(method="disk.file.get", params={"id": file_bit_id})
         if result:
             return result.get("result")
 
-    async def download_file(self, file_bit_id: int = None, download_url: str = None) -> bytes | None:
-        try:
-            if file_bit_id:
-                file = await self.get_file(file_bit_id=file_bit_id)
-                file_url = file.get("DOWNLOAD_URL")
+    async def _get_download_url(self, file_bit_id: int = None, download_url: str = None) -> str | None:
+        if file_bit_id:
+            file = await self.get_file(file_bit_id=file_bit_id)
+            return file.get("DOWNLOAD_URL")
 
-            elif download_url:
-                file_url = self.conf.data.domain+download_url
+        elif download_url:
+            return self.conf.data.domain+download_url
 
-            else:
+    async def download_file_stream(
+            self, file_bit_id: int = None, download_url: str = None, max_size: int = None
+    ) -> SpooledTemporaryFile | None:
+        """
+        Downloads the file in chunks into a temp file. The file is kept in memory up to "spool_size" bytes
+        and moved to disk when it is larger. The caller must close the returned file.
+        :param max_size: max file size in bytes, by default "max_download_size"
+        :return: temp file opened for reading (position 0)
+        """
+        max_size = max_size or self.max_download_size
+        try:
+            file_url = await self._get_download_url(file_bit_id, download_url)
+            if not file_url:
                 return
 
-            async with aiohttp.ClientSession() as session:
+            session = await self.get_session()
+            started = monotonic()
+            received = 0
+            error = None
+            try:
                 for attempt in range(3):
+                    file = SpooledTemporaryFile(max_size=self.spool_size)
                     try:
-                        async with session.get(
-                            file_url, timeout=aiohttp.ClientTimeout(total=60)
-                        ) as response:
+                        async with session.get(file_url, timeout=self.pool.transfer_timeout) as response:
                             if response.status != 200:
+                                error = str(response.status)
                                 raise Exception(f"Failed to download file: {response.status}")
 
-                            return await response.read()
+                            if response.content_length and response.content_length > max_size:
+                                error = "TOO_LARGE"
+                                raise ValueError(f"File is too large: {response.content_length} > {max_size} bytes")
+
+                            size = 0
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                size += len(chunk)
+                                received += len(chunk)
+                                if size > max_size:
+                                    error = "TOO_LARGE"
+                                    raise ValueError(f"File is too large: more than {max_size} bytes")
+                                file.write(chunk)
+
+                        file.seek(0)
+                        error = None
+                        return file
 
                     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        error = type(e).__name__
+                        file.close()
                         await asyncio.sleep(5)
 
-            raise Exception("Failed to download file after multiple attempts")
+                    except Exception:
+                        file.close()
+                        raise
+
+                raise Exception("Failed to download file after multiple attempts")
+
+            finally:
+                self.metrics.observe(
+                    "disk.download", monotonic() - started, received=received,
+                    retries=attempt, error=error
+                )
 
         except Exception as e:
             await self.write_log(
                 log_level=ERROR,
-                name="class Storage(Bitrix) -> async def download_file",
+                name="class Storage(Bitrix) -> async def download_file_stream",
                 e=e,
-                msg=f"{file_bit_id=}"
+                msg=f"{file_bit_id=}, {download_url=}"
             )
 
+    async def download_file(self, file_bit_id: int = None, download_url: str = None) -> bytes | None:
+        file = await self.download_file_stream(file_bit_id=file_bit_id, download_url=download_url)
+        if file:
+            with file:
+                return file.read()
@@ -0,0 +1,176 @@
+"""
+Typed Bitrix responses of the most used methods.
+Ids and dates are converted once when the response is decoded, dates are naive local time (like in the DB).
+"""
+from datetime import datetime
+from dataclasses import dataclass, field
+
+
+def to_int(value, default: int | None = 0) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def to_datetime(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).astimezone().replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(slots=True)
+class BitTask:
+    """tasks.task.get / tasks.task.list"""
+    id: int
+    title: str | None = None
+    description: str | None = None
+    group_id: int = 0
+    stage_id: int = 0
+    created_by: int = 0
+    responsible_id: int = 0
+    changed_by: int = 0
+    chat_id: int | None = None
+    deadline: datetime | None = None
+    changed_date: datetime | None = None
+    time_estimate: int | None = None
+    accomplices: list[int] = field(default_factory=list)
+    auditors: list[int] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitTask":
+        return cls(
+            id=to_int(data.get("id")),
+            title=data.get("title"),
+            description=data.get("description"),
+            group_id=to_int(data.get("groupId")),
+            stage_id=to_int(data.get("stageId")),
+            created_by=to_int(data.get("createdBy")),
+            responsible_id=to_int(data.get("responsibleId")),
+            changed_by=to_int(data.get("changedBy")),
+            chat_id=to_int(data.get("chatId"), None),
+            deadline=to_datetime(data.get("deadline")),
+            changed_date=to_datetime(data.get("changedDate")),
+            time_estimate=to_int(data.get("timeEstimate"), None),
+            accomplices=[int(i) for i in data.get("accomplices") or ()],
+            auditors=[int(i) for i in data.get("auditors") or ()],
+        )
+
+
+@dataclass(slots=True)
+class BitStage:
+    """task.stages.get"""
+    id: int
+    title: str
+    sort: int
+    color: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitStage":
+        return cls(
+            id=to_int(data.get("ID")),
+            title=data.get("TITLE"),
+            sort=to_int(data.get("SORT")),
+            color=data.get("COLOR"),
+        )
+
+    @classmethod
+    def from_map(cls, data: dict | list) -> dict[int, "BitStage"]:
+        """{stage_id: stage}, php returns an empty list instead of an empty dict"""
+        return {int(stage_id): cls.from_dict(stage) for stage_id, stage in (data or {}).items()}
+
+
+@dataclass(slots=True)
+class BitUser:
+    """user.get"""
+    id: int
+    name: str | None = None
+    last_name: str | None = None
+    second_name: str | None = ""
+    active: bool = True
+    departments: list[int] = field(default_factory=list)
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.last_name} {self.name} {self.second_name}"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitUser":
+        return cls(
+            id=to_int(data.get("ID")),
+            name=data.get("NAME"),
+            last_name=data.get("LAST_NAME"),
+            second_name=data.get("SECOND_NAME", ""),
+            active=data.get("ACTIVE") is not False,
+            departments=[int(i) for i in data.get("UF_DEPARTMENT") or ()],
+        )
+
+
+@dataclass(slots=True)
+class BitDepartment:
+    """department.get"""
+    id: int
+    name: str
+    parent_id: int | None = None
+    head_id: int | None = None
+    sort: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitDepartment":
+        return cls(
+            id=to_int(data.get("ID")),
+            name=data.get("NAME"),
+            parent_id=to_int(data.get("PARENT"), None) or None,
+            head_id=to_int(data.get("UF_HEAD"), None) or None,
+            sort=to_int(data.get("SORT")),
+        )
+
+
+@dataclass(slots=True)
+class BitMessage:
+    id: int
+    chat_id: int
+    author_id: int
+    text: str
+    date: datetime | None = None
+    file_ids: list[int] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitMessage":
+        params = data.get("params") or {}
+        return cls(
+            id=to_int(data.get("id")),
+            chat_id=to_int(data.get("chat_id")),
+            author_id=to_int(data.get("author_id")),
+            text=data.get("text") or "",
+            date=to_datetime(data.get("date")),
+            file_ids=[int(i) for i in params.get("FILE_ID") or ()],
+        )
+
+
+@dataclass(slots=True)
+class BitDialogFile:
+    id: int
+    name: str
+    url_download: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitDialogFile":
+        return cls(id=to_int(data.get("id")), name=data.get("name"), url_download=data.get("urlDownload"))
+
+
+@dataclass(slots=True)
+class BitDialog:
+    """im.dialog.messages.get"""
+    messages: list[BitMessage] = field(default_factory=list)
+    files: list[BitDialogFile] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BitDialog":
+        return cls(
+            messages=[BitMessage.from_dict(i) for i in data.get("messages") or ()],
+            files=[BitDialogFile.from_dict(i) for i in data.get("files") or ()],
+        )
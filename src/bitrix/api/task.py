@@ -1,28 +1,78 @@
 from datetime import datetime
-from typing import Sequence
+from typing import Sequence, AsyncIterator, Iterable
 
 from .base import Bitrix
+from .structs import BitTask, BitStage, BitDialog
 
 
 class Task(Bitrix):
-    async def get_all_tasks(self) -> list[dict] | None:
-        result = await self.call_method(
-            method="tasks.task.list",
-            params={"filter": {"CREATED_BY": self.conf.data.current_id}}
-        )
+    async def get_all_tasks(self, select: Sequence[str] = None) -> list[dict] | None:
+        """:param select: fields of the tasks (ID, TITLE, STAGE_ID...), all fields by default"""
+        params = {"filter": {"CREATED_BY": self.conf.data.current_id}}
+        if select:
+            params["select"] = list(select)
+
+        result = await self.call_method(method="tasks.task.list", params=params)
         if result:
             return result["result"]["tasks"]
 
-    async def get_task(self, task_id) -> dict | None:
-        result = await self.call_method(method="tasks.task.get", params={"taskId": task_id})
+    async def iter_changed_tasks(
+            self, changed_since: str, group_ids: Iterable[int] = None, select: Sequence[str] = ("ID", "CHANGED_DATE")
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Pages of tasks changed since "changed_since" (inclusive) and before the start of the call, only "select" fields.
+        Pages are read one by one in the order of ID (">ID" of the last task, not "start"): a task changed during
+        the scan leaves the fixed date range and does not shift the other rows, it is returned by the next call.
+        :param changed_since: ISO 8601 date time (2024-01-31T10:00:00+03:00)
+        :param group_ids: only tasks of these groups
+        """
+        changed_until = datetime.now().astimezone().isoformat(timespec="seconds")
+        params = {
+            "filter": {">=CHANGED_DATE": changed_since, "<=CHANGED_DATE": changed_until},
+            "select": list(dict.fromkeys(("ID", *select))), "order": {"ID": "asc"},
+            "start": -1,  # the rows are not counted, pages are selected by ">ID"
+        }
+        if group_ids:
+            params["filter"]["GROUP_ID"] = list(group_ids)
+
+        last_id = 0
+        while True:
+            params["filter"][">ID"] = last_id
+            result = await self.call_method(method="tasks.task.list", params=params)
+            if not result or "result" not in result:
+                raise Exception(f"Can't get changed tasks after {last_id=}")
+
+            tasks = result["result"].get("tasks") or []
+            if tasks:
+                yield tasks
+            if len(tasks) < self.page_size:
+                return
+            last_id = int(tasks[-1]["id"])
+
+    async def get_task(self, task_id, select: Sequence[str] = None) -> BitTask | None:
+        """:param select: fields of the task (ID, TITLE, STAGE_ID...), all fields by default"""
+        params = {"taskId": task_id}
+        if select:
+            params["select"] = list(select)
+
+        result = await self.call_method(method="tasks.task.get", params=params)
         if result and result.get("result"):
-            return result["result"]["task"]
+            return BitTask.from_dict(result["result"]["task"])
 
     async def get_task_files(self, task_id) -> list[dict] | None:
         result = await self.call_method(method="task.item.getfiles", params={"taskId": task_id})
         if result:
             return result["result"]
 
+    async def get_task_with_files(self, task_id) -> tuple[BitTask | None, list[dict] | None]:
+        """get_task and get_task_files in one batch request"""
+        task, files = await self.call_batch([
+            ("tasks.task.get", {"taskId": task_id}),
+            ("task.item.getfiles", {"taskId": task_id}),
+        ])
+        bit_task = BitTask.from_dict(task["result"]["task"]) if task and task.get("result") else None
+        return bit_task, files.get("result") if files else None
+
     async def create_task(
             self, title, description, files: list[int], group_id: str,
             auditors: list[int] = None, creator_id: int = None,
@@ -104,10 +154,18 @@ class Task(Bitrix):
         if result:
             return result["result"]
 
-    async def get_stages(self, group_id: int) -> dict | None:
+    async def get_stages(self, group_id: int) -> dict[int, BitStage] | None:
         result = await self.call_method(method="task.stages.get", params={"entityId": group_id})
         if result:
-            return result["result"]
+            return BitStage.from_map(result["result"])
+
+    async def get_groups_stages(self, group_ids: Sequence[int]) -> dict[int, dict[int, BitStage] | None]:
+        """get_stages of several groups with batch requests, None if the stages of the group were not received"""
+        results = await self.call_batch([("task.stages.get", {"entityId": group_id}) for group_id in group_ids])
+        return {
+            group_id: BitStage.from_map(result["result"]) if result and "result" in result else None
+            for group_id, result in zip(group_ids, results)
+        }
 
     async def add_comment(self, task_id: int, message: str, creator_id: int = None) -> int | None:
         """if a comment has a file, it cannot be created on behalf of another user"""
@@ -128,7 +186,7 @@ class Task(Bitrix):
         )
         return result["result"]["MESSAGE_ID"]
 
-    async def get_comment(self, chat_id: int, message_id: int = None) -> dict | None:
+    async def get_comment(self, chat_id: int, message_id: int = None) -> BitDialog | None:
         if message_id:
             result = await self.call_method(
                 "im.dialog.messages.get",
@@ -138,22 +196,21 @@ class Task(Bitrix):
             result = await self.call_method("im.dialog.messages.get", params={"DIALOG_ID": f"chat{chat_id}"})
 
         if result:
-            return result["result"]
+            return BitDialog.from_dict(result["result"])
 
-    async def get_comment_fix(self, chat_id: int, message_id: int) -> dict | None:
+    async def get_comment_fix(self, chat_id: int, message_id: int) -> BitDialog | None:
         # Temp method (bitrix bug in FIRST_ID and LAST_ID)
         result = await self.call_method(
             "im.dialog.messages.get",
             params={"DIALOG_ID": f"chat{chat_id}", "FIRST_ID": message_id - 1, "LAST_ID": message_id + 1} # bitrix bug!?
         )
 
-        fixed_messages = []
-        for message in result["result"]["messages"]:
-            if message["id"] == message_id:
-                fixed_messages.append(message)
-        result["result"]["messages"] = fixed_messages
+        if not result:
+            return None
 
-        return result["result"]
+        dialog = BitDialog.from_dict(result["result"])
+        dialog.messages = [message for message in dialog.messages if message.id == message_id]
+        return dialog
 
     async def get_history(self, task_id: int, stage: bool = None) -> dict | None:
         fields = {}
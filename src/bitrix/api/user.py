@@ -1,21 +1,15 @@
+from typing import AsyncIterator
+
 from .base import Bitrix
+from .structs import BitUser
 
 
 class User(Bitrix):
-    async def get_users(self) -> list[dict]:
+    async def get_users(self) -> list[BitUser]:
         """Retrieve all users."""
-        index = 1
-        users = []
-        while True:
-            result = await self.call_method("user.get", params={"sort": "ID", "start": index})
-            if result:
-                users += result["result"]
-                index += 50
-                if len(result["result"]) < 50:
-                    break
-            else:
-                return []
-
-        return users
-
+        return [BitUser.from_dict(user) for user in await self.get_list("user.get", params={"sort": "ID"})]
 
+    async def iter_users(self, concurrency: int = 5) -> AsyncIterator[list[BitUser]]:
+        """Retrieve all users page by page, pages come as soon as they are received."""
+        async for users in self.paginate("user.get", params={"sort": "ID"}, concurrency=concurrency):
+            yield [BitUser.from_dict(user) for user in users]
@@ -0,0 +1,655 @@
+"""
+Local stand-in of the Bitrix24 REST API for offline load and regression testing.
+Only the methods used by the project are implemented, all data is kept in memory.
+
+Run:
+    python -m src.bitrix.fake_server --port 8081 --latency 0.05 --rate 2 --burst 50
+and set BIT_REST_URL=http://127.0.0.1:8081/rest/1/token/
+
+Webhook events (ONTASKUPDATE...) are sent to the bot with --webhook-url or POST /fake/events.
+"""
+import re
+import asyncio
+import argparse
+from random import uniform, choice, sample
+from itertools import count
+from time import monotonic, time
+from urllib.parse import parse_qsl
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+
+def now_iso() -> str:
+    return datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def parse_date(value: str) -> datetime:
+    """Bitrix accepts dates with and without a timezone, naive dates are local time"""
+    return datetime.fromisoformat(str(value)).astimezone()
+
+
+def parse_php_query(query: str) -> dict:
+    """Reverse of base.build_query: "filter[>ID]=1&select[0]=ID" -> {"filter": {">ID": "1"}, "select": ["ID"]}"""
+    result: dict = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        parts = re.findall(r"[^\[\]]+", key)
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+
+    def lists(node):
+        if not isinstance(node, dict):
+            return node
+        node = {k: lists(v) for k, v in node.items()}
+        if node and all(k.isdigit() for k in node):
+            return [node[k] for k in sorted(node, key=int)]
+        return node
+
+    return lists(result)
+
+
+def camel(field_name: str) -> str:
+    """GROUP_ID -> groupId"""
+    first, *other = field_name.lower().split("_")
+    return first + "".join(i.capitalize() for i in other)
+
+
+class FakeError(Exception):
+    def __init__(self, error: str, description: str = "", status: int = 400):
+        super().__init__(error)
+        self.error = error
+        self.description = description
+        self.status = status
+
+
+@dataclass
+class FakeState:
+    """In-memory portal data, rows have the same fields as the Bitrix responses"""
+    current_id: int = 1
+    storage_id: int = 1
+    users: dict[int, dict] = field(default_factory=dict)
+    departments: dict[int, dict] = field(default_factory=dict)
+    groups: dict[int, dict] = field(default_factory=dict)
+    stages: dict[int, dict[int, dict]] = field(default_factory=dict)  # {group_id: {stage_id: stage}}
+    tasks: dict[int, dict] = field(default_factory=dict)
+    folders: dict[int, dict] = field(default_factory=dict)  # {folder_id: folder}, PARENT_ID = 0 - storage root
+    files: dict[int, dict] = field(default_factory=dict)
+    file_content: dict[int, bytes] = field(default_factory=dict)
+    messages: dict[int, list[dict]] = field(default_factory=dict)  # {chat_id: messages}
+    ids: count = field(default_factory=lambda: count(1000))
+
+    @classmethod
+    def generate(
+            cls, users: int = 50, departments: int = 5, groups: int = 2, stages: int = 5, tasks: int = 200
+    ) -> "FakeState":
+        state = cls()
+        state.folders[state.storage_id] = {
+            "ID": state.storage_id, "NAME": "Storage", "TYPE": "folder", "PARENT_ID": 0
+        }
+
+        for i in range(1, users + 1):
+            state.users[i] = {
+                "ID": str(i), "NAME": f"Name{i}", "LAST_NAME": f"Last{i}", "SECOND_NAME": "",
+                "ACTIVE": True, "UF_DEPARTMENT": [],
+            }
+        state.users[state.current_id].update(NAME="Bot", LAST_NAME="Bitrix")
+
+        user_ids = list(state.users)
+        for i in range(1, departments + 1):
+            state.departments[i] = {
+                "ID": str(i), "NAME": f"Department {i}", "SORT": str(i * 10),
+                "PARENT": str(choice(range(1, i))) if i > 1 else None,
+                "UF_HEAD": str(choice(user_ids)),
+            }
+        for user in state.users.values():
+            user["UF_DEPARTMENT"] = [choice(list(state.departments))] if state.departments else []
+
+        for i in range(1, groups + 1):
+            folder = state.add_folder(state.storage_id, f"Group {i}")
+            state.groups[i] = {"GROUP_ID": str(i), "GROUP_NAME": f"Group {i}", "folder_id": folder["ID"]}
+            state.stages[i] = {}
+            for sort in range(1, stages + 1):
+                stage_id = next(state.ids)
+                state.stages[i][stage_id] = {
+                    "ID": str(stage_id), "TITLE": f"Stage {sort}", "SORT": str(sort * 100),
+                    "COLOR": "00C4FB", "SYSTEM_TYPE": "NEW" if sort == 1 else "",
+                }
+
+        for _ in range(tasks):
+            group_id = choice(list(state.groups))
+            state.add_task({
+                "TITLE": "Task", "DESCRIPTION": "Description", "GROUP_ID": group_id,
+                "CREATED_BY": choice(user_ids), "RESPONSIBLE_ID": choice(user_ids),
+                "STAGE_ID": choice(list(state.stages[group_id])),
+                "AUDITORS": sample(user_ids, min(2, len(user_ids))),
+            })
+
+        return state
+
+    def add_folder(self, parent_id: int, name: str) -> dict:
+        folder_id = next(self.ids)
+        folder = {"ID": folder_id, "NAME": name, "TYPE": "folder", "PARENT_ID": parent_id, "CREATE_TIME": now_iso()}
+        self.folders[folder_id] = folder
+        return folder
+
+    def add_task(self, fields: dict) -> dict:
+        task_id = next(self.ids)
+        chat_id = next(self.ids)
+        group_id = int(fields.get("GROUP_ID") or 0)
+        group_stages = list(self.stages.get(group_id, {}))
+        task = {
+            "id": str(task_id), "title": fields.get("TITLE", ""), "description": fields.get("DESCRIPTION", ""),
+            "groupId": str(group_id), "stageId": str(fields.get("STAGE_ID") or (group_stages[0] if group_stages else 0)),
+            "createdBy": str(fields.get("CREATED_BY") or self.current_id),
+            "responsibleId": str(fields.get("RESPONSIBLE_ID") or self.current_id),
+            "changedBy": str(fields.get("CREATED_BY") or self.current_id),
+            "chatId": chat_id, "deadline": fields.get("DEADLINE"), "timeEstimate": "0", "status": "2",
+            "createdDate": now_iso(), "changedDate": now_iso(),
+            "accomplices": [str(i) for i in fields.get("ACCOMPLICES", [])],
+            "auditors": [str(i) for i in fields.get("AUDITORS", [])],
+            "ufTaskWebdavFiles": list(fields.get("UF_TASK_WEBDAV_FILES", [])),
+        }
+        self.tasks[task_id] = task
+        self.messages[chat_id] = []
+        return task
+
+    def touch_task(self, task_id: int, changed_by: int = None) -> None:
+        task = self.tasks[task_id]
+        task["changedDate"] = now_iso()
+        task["changedBy"] = str(changed_by or self.current_id)
+
+
+class FakeBitrix:
+    page_size = 50
+
+    def __init__(
+            self, state: FakeState = None, latency: float = 0.0, jitter: float = 0.0,
+            rate: float = 2.0, burst: int = 50, operating_limit: float = 480.0, method_time: float = 0.01,
+            base_url: str = "http://127.0.0.1:8081"
+    ):
+        """
+        :param latency: seconds added to every response
+        :param jitter: random seconds (0..jitter) added to latency
+        :param rate: requests per second (QUERY_LIMIT_EXCEEDED when exceeded), 0 - without limit
+        :param burst: bucket size of the rate limit
+        :param operating_limit: "time.operating" seconds per 10 minutes for a method (OPERATION_TIME_LIMIT)
+        :param method_time: "time.operating" added by one call of a method
+        :param base_url: url of this server, used in upload/download links
+        """
+        self.state = state or FakeState.generate()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.operating_limit = operating_limit
+        self.method_time = method_time
+        self.base_url = base_url.rstrip("/")
+
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.operating: dict[str, tuple[float, float]] = {}  # {method: (seconds, reset unix time)}
+        self.stats = {"requests": 0, "limited": 0, "errors": 0, "events": 0, "methods": {}}
+
+        self.methods = {
+            "batch": self.batch,
+            "user.current": self.user_current,
+            "user.get": self.user_get,
+            "department.get": self.department_get,
+            "sonet_group.user.groups": self.groups_get,
+            "task.stages.get": self.stages_get,
+            "tasks.task.get": self.task_get,
+            "tasks.task.list": self.task_list,
+            "tasks.task.add": self.task_add,
+            "tasks.task.update": self.task_update,
+            "tasks.task.delete": self.task_delete,
+            "tasks.task.history.list": self.task_history,
+            "task.item.getfiles": self.task_files,
+            "task.commentitem.add": self.comment_add,
+            "im.dialog.messages.get": self.messages_get,
+            "im.disk.file.commit": self.file_commit,
+            "disk.storage.getlist": self.storage_list,
+            "disk.storage.getchildren": self.folder_children,
+            "disk.folder.getchildren": self.folder_children,
+            "disk.storage.addfolder": self.add_folder,
+            "disk.folder.addsubfolder": self.add_folder,
+            "disk.folder.uploadfile": self.upload_url,
+            "disk.file.get": self.file_get,
+        }
+
+    # ------------------------------------------------------------------ server
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_route("*", r"/rest/{user}/{token}/{method}.json", self.handle_rest)
+        app.router.add_post(r"/upload/{folder_id}", self.handle_upload)
+        app.router.add_get(r"/download/{file_id}", self.handle_download)
+        app.router.add_post("/fake/events", self.handle_events)
+        app.router.add_get("/fake/stats", self.handle_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        """Starts the server in the current event loop (in-process use), stop it with "await runner.cleanup()" """
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    async def handle_rest(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.stats["requests"] += 1
+        self.stats["methods"][method] = self.stats["methods"].get(method, 0) + 1
+
+        if request.can_read_body:
+            params = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        else:
+            params = parse_php_query(request.query_string)
+
+        await self.delay()
+        try:
+            self.check_limit(method)
+            result = self.call(method, params or {})
+        except FakeError as e:
+            self.stats["errors"] += 1
+            return web.json_response({"error": e.error, "error_description": e.description}, status=e.status)
+
+        result["time"] = self.add_operating(method)
+        return web.json_response(result)
+
+    async def delay(self) -> None:
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + uniform(0, self.jitter))
+
+    def check_limit(self, method: str) -> None:
+        if self.rate:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.stats["limited"] += 1
+                raise FakeError("QUERY_LIMIT_EXCEEDED", "Too many requests", status=503)
+            self.tokens -= 1
+
+        used, reset_at = self.operating.get(method, (0.0, time() + 600))
+        if reset_at > time() and used >= self.operating_limit:
+            self.stats["limited"] += 1
+            raise FakeError("OPERATION_TIME_LIMIT", "Method is blocked due to operation time limit.", status=503)
+
+    def add_operating(self, method: str) -> dict:
+        used, reset_at = self.operating.get(method, (0.0, time() + 600))
+        if reset_at <= time():
+            used, reset_at = 0.0, time() + 600
+        used += self.method_time
+        self.operating[method] = (used, reset_at)
+        return {"operating": round(used, 4), "operating_reset_at": int(reset_at)}
+
+    def call(self, method: str, params: dict) -> dict:
+        handler = self.methods.get(method)
+        if not handler:
+            raise FakeError("ERROR_METHOD_NOT_FOUND", f"Method {method} not found", status=404)
+        return handler(params)
+
+    def page(self, rows: list, params: dict) -> dict:
+        start = int(params.get("start") or 0)
+        if start == -1:  # the first page without counting the rows ("total" and "next" are not returned)
+            return {"result": rows[:self.page_size]}
+
+        result = {"result": rows[start:start + self.page_size], "total": len(rows)}
+        if start + self.page_size < len(rows):
+            result["next"] = start + self.page_size
+        return result
+
+    # ------------------------------------------------------------------ methods
+    def batch(self, params: dict) -> dict:
+        done, errors, totals, nexts = {}, {}, {}, {}
+        for key, command in (params.get("cmd") or {}).items():
+            method, _, query = command.partition("?")
+            try:
+                self.check_limit(method) if method != "batch" else None
+                response = self.call(method, parse_php_query(query))
+            except FakeError as e:
+                errors[key] = {"error": e.error, "error_description": e.description}
+                if int(params.get("halt") or 0):
+                    break
+                continue
+
+            self.add_operating(method)
+            done[key] = response["result"]
+            if "total" in response:
+                totals[key] = response["total"]
+            if "next" in response:
+                nexts[key] = response["next"]
+
+        return {"result": {
+            "result": done or [], "result_error": errors or [], "result_total": totals or [],
+            "result_next": nexts or [], "result_time": [],
+        }}
+
+    def user_current(self, params: dict) -> dict:
+        return {"result": self.state.users[self.state.current_id]}
+
+    def user_get(self, params: dict) -> dict:
+        users = list(self.state.users.values())
+        user_filter = params.get("FILTER") or params.get("filter") or {}
+        if "UF_DEPARTMENT" in user_filter:
+            department = int(user_filter["UF_DEPARTMENT"])
+            users = [i for i in users if department in i["UF_DEPARTMENT"]]
+        if "ACTIVE" in user_filter:
+            users = [i for i in users if i["ACTIVE"] is bool(user_filter["ACTIVE"])]
+        return self.page(users, params)
+
+    def department_get(self, params: dict) -> dict:
+        return self.page(list(self.state.departments.values()), params)
+
+    def groups_get(self, params: dict) -> dict:
+        return {"result": [{"GROUP_ID": i["GROUP_ID"], "GROUP_NAME": i["GROUP_NAME"]} for i in self.state.groups.values()]}
+
+    def stages_get(self, params: dict) -> dict:
+        stages = self.state.stages.get(int(params.get("entityId") or 0))
+        return {"result": {str(k): v for k, v in stages.items()} if stages else []}
+
+    def get_task_or_error(self, params: dict) -> dict:
+        task = self.state.tasks.get(int(params.get("taskId") or 0))
+        if not task:
+            raise FakeError("ERROR_CORE", "Задача не найдена или доступ запрещён")
+        return task
+
+    @staticmethod
+    def select(task: dict, select: list | None) -> dict:
+        if not select or "*" in select:
+            return task
+        keys = {camel(i) for i in select}
+        return {k: v for k, v in task.items() if k in keys}
+
+    def task_get(self, params: dict) -> dict:
+        return {"result": {"task": self.select(self.get_task_or_error(params), params.get("select"))}}
+
+    def task_list(self, params: dict) -> dict:
+        tasks = list(self.state.tasks.values())
+        for key, value in (params.get("filter") or {}).items():
+            operator, name = re.match(r"([<>=!]*)(\w+)", key).groups()
+            name = camel(name)
+            values = {str(i) for i in value} if isinstance(value, list) else {str(value)}
+            if name in ("changedDate", "createdDate") or (name == "id" and operator.strip("=") in ("<", ">")):
+                parse = parse_date if name != "id" else int
+                border = parse(value)
+                compare = {
+                    ">": lambda x: x > border, ">=": lambda x: x >= border,
+                    "<": lambda x: x < border, "<=": lambda x: x <= border,
+                }.get(operator, lambda x: x == border)
+                tasks = [i for i in tasks if compare(parse(i[name]))]
+            else:
+                tasks = [i for i in tasks if (str(i.get(name)) in values) != (operator == "!")]
+
+        for key, direction in (params.get("order") or {}).items():
+            name = camel(key)
+            reverse = str(direction).lower() == "desc"
+            tasks.sort(key=lambda i: int(i[name]) if name == "id" else str(i.get(name)), reverse=reverse)
+
+        result = self.page([self.select(i, params.get("select")) for i in tasks], params)
+        result["result"] = {"tasks": result["result"]}
+        return result
+
+    def task_add(self, params: dict) -> dict:
+        return {"result": {"task": self.state.add_task(params.get("fields") or {})}}
+
+    def task_update(self, params: dict) -> dict:
+        task = self.get_task_or_error(params)
+        for key, value in (params.get("fields") or {}).items():
+            name = camel(key)
+            task[name] = [str(i) for i in value] if isinstance(value, list) else str(value)
+        self.state.touch_task(int(task["id"]))
+        return {"result": {"task": task}}
+
+    def task_delete(self, params: dict) -> dict:
+        task = self.get_task_or_error(params)
+        del self.state.tasks[int(task["id"])]
+        return {"result": {"task": True}}
+
+    def task_history(self, params: dict) -> dict:
+        self.get_task_or_error(params)
+        return {"result": {"list": []}}
+
+    def task_files(self, params: dict) -> dict:
+        task = self.get_task_or_error(params)
+        files = []
+        for file_id in task.get("ufTaskWebdavFiles", []):
+            file = self.state.files.get(int(str(file_id).lstrip("n")))
+            if file:
+                files.append({
+                    "FILE_ID": file["ID"], "NAME": file["NAME"], "SIZE": file["SIZE"],
+                    "DOWNLOAD_URL": file["DOWNLOAD_URL"],
+                })
+        return {"result": files}
+
+    def add_message(self, chat_id: int, author_id: int, text: str, file_ids: list[int] = None) -> int:
+        message_id = next(self.state.ids)
+        self.state.messages.setdefault(chat_id, []).append({
+            "id": message_id, "chat_id": chat_id, "author_id": author_id, "date": now_iso(), "text": text,
+            "params": {"FILE_ID": file_ids} if file_ids else [],
+        })
+        return message_id
+
+    def comment_add(self, params: dict) -> dict:
+        task = self.state.tasks.get(int(params.get("TASKID") or 0))
+        if not task:
+            raise FakeError("ERROR_CORE", "Task not found")
+        fields = params.get("FIELDS") or {}
+        message_id = self.add_message(
+            task["chatId"], int(fields.get("AUTHOR_ID") or self.state.current_id), fields.get("POST_MESSAGE", "")
+        )
+        return {"result": message_id}
+
+    def messages_get(self, params: dict) -> dict:
+        chat_id = int(str(params.get("DIALOG_ID", "chat0")).removeprefix("chat"))
+        messages = self.state.messages.get(chat_id, [])
+        first_id, last_id = int(params.get("FIRST_ID") or 0), int(params.get("LAST_ID") or 0)
+        if first_id:
+            messages = [i for i in messages if i["id"] >= first_id]
+        if last_id:
+            messages = [i for i in messages if i["id"] <= last_id]
+
+        file_ids = {file_id for i in messages for file_id in (i["params"] or {}).get("FILE_ID", [])}
+        files = [
+            {"id": i["ID"], "name": i["NAME"], "urlDownload": i["DOWNLOAD_URL"]}
+            for i in self.state.files.values() if i["ID"] in file_ids
+        ]
+        return {"result": {"chat_id": chat_id, "messages": messages[-50:], "users": [], "files": files}}
+
+    def file_commit(self, params: dict) -> dict:
+        chat_id = int(params.get("CHAT_ID") or 0)
+        file_ids = [int(i) for i in params.get("DISK_ID") or []]
+        message_id = self.add_message(chat_id, self.state.current_id, params.get("MESSAGE", ""), file_ids)
+        return {"result": {"MESSAGE_ID": message_id, "FILES": file_ids}}
+
+    def storage_list(self, params: dict) -> dict:
+        current = self.state.users[self.state.current_id]
+        name = f"{current['NAME']} {current['LAST_NAME']}".strip()
+        return self.page([{"ID": str(self.state.storage_id), "NAME": name, "ENTITY_TYPE": "user"}], params)
+
+    def folder_children(self, params: dict) -> dict:
+        parent_id = int(params.get("id") or 0)
+        if parent_id not in self.state.folders:
+            raise FakeError("ERROR_NOT_FOUND", "Could not find entity with id")
+        children = [i for i in self.state.folders.values() if i["PARENT_ID"] == parent_id]
+        children += [i for i in self.state.files.values() if i["PARENT_ID"] == parent_id]
+        child_type = ((params.get("filter") or {}).get("TYPE"))
+        if child_type:
+            children = [i for i in children if i["TYPE"] == child_type]
+        return self.page(children, params)
+
+    def add_folder(self, params: dict) -> dict:
+        parent_id = int(params.get("id") or 0)
+        name = (params.get("data") or {}).get("NAME", "")
+        if parent_id not in self.state.folders:
+            raise FakeError("ERROR_NOT_FOUND", "Could not find entity with id")
+        for folder in self.state.folders.values():
+            if folder["PARENT_ID"] == parent_id and folder["NAME"].lower() == name.lower():
+                raise FakeError("DISK_OBJ_22000", "A folder with the same name already exists")
+        return {"result": self.state.add_folder(parent_id, name)}
+
+    def upload_url(self, params: dict) -> dict:
+        folder_id = int(params.get("id") or 0)
+        if folder_id not in self.state.folders:
+            raise FakeError("ERROR_NOT_FOUND", "Could not find entity with id")
+        return {"result": {"field": "file", "uploadUrl": f"{self.base_url}/upload/{folder_id}"}}
+
+    def file_get(self, params: dict) -> dict:
+        file = self.state.files.get(int(params.get("id") or 0))
+        if not file:
+            raise FakeError("ERROR_NOT_FOUND", "Could not find entity with id")
+        return {"result": file}
+
+    # ------------------------------------------------------------------ disk transfers
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        folder_id = int(request.match_info["folder_id"])
+        await self.delay()
+        reader = await request.multipart()
+        part = await reader.next()
+        if part is None:
+            return web.json_response({"error": "ERROR_NO_FILE"}, status=400)
+
+        content = await part.read()
+        file_id = next(self.state.ids)
+        file = {
+            "ID": file_id, "NAME": part.filename, "TYPE": "file", "PARENT_ID": folder_id, "SIZE": len(content),
+            "CREATE_TIME": now_iso(), "DOWNLOAD_URL": f"{self.base_url}/download/{file_id}",
+        }
+        self.state.files[file_id] = file
+        self.state.file_content[file_id] = content
+        return web.json_response({"result": file})
+
+    async def handle_download(self, request: web.Request) -> web.Response:
+        file_id = int(request.match_info["file_id"])
+        await self.delay()
+        if file_id not in self.state.file_content:
+            return web.Response(status=404)
+        return web.Response(body=self.state.file_content[file_id], content_type="application/octet-stream")
+
+    # ------------------------------------------------------------------ webhooks
+    def event_data(self, event: str, task_id: int, token: str) -> dict:
+        task = self.state.tasks.get(task_id)
+        data = {"event": event, "auth[application_token]": token, "ts": str(int(time()))}
+        if event == "ONTASKADD":
+            data["data[FIELDS_AFTER][ID]"] = str(task_id)
+        elif event == "ONTASKCOMMENTADD":
+            messages = self.state.messages.get(task["chatId"]) if task else None
+            if not messages:
+                message_id = self.add_message(task["chatId"], self.state.current_id, "Comment") if task else 0
+            else:
+                message_id = messages[-1]["id"]
+            data["data[FIELDS_AFTER][TASK_ID]"] = str(task_id)
+            data["data[FIELDS_AFTER][MESSAGE_ID]"] = str(message_id)
+        else:
+            data["data[FIELDS_BEFORE][ID]"] = str(task_id)
+            if event == "ONTASKUPDATE" and task:
+                self.state.touch_task(task_id)
+        return data
+
+    async def emit_events(
+            self, url: str, token: str, event: str = "ONTASKUPDATE", rate: float = 10, total: int = 100,
+            task_ids: list[int] = None, duplicates: float = 0.0
+    ) -> dict:
+        """
+        Sends webhook events to the bot like Bitrix does (form data)
+        :param rate: events per second
+        :param total: number of events
+        :param task_ids: tasks of the events, random tasks by default
+        :param duplicates: share of events sent twice (Bitrix sends two hooks when a task is dragged in Kanban)
+        :return: {"sent": ..., "failed": ..., "seconds": ...}
+        """
+        task_ids = task_ids or list(self.state.tasks)
+        sent, failed, started = 0, 0, monotonic()
+        async with aiohttp.ClientSession() as session:
+            async def send(data: dict) -> None:
+                nonlocal sent, failed
+                try:
+                    async with session.post(url, data=data) as response:
+                        await response.read()
+                        sent += 1 if response.status < 400 else 0
+                        failed += 1 if response.status >= 400 else 0
+                except aiohttp.ClientError:
+                    failed += 1
+
+            requests = []
+            for i in range(total):
+                data = self.event_data(event, choice(task_ids), token)
+                requests.append(asyncio.create_task(send(data)))
+                if uniform(0, 1) < duplicates:
+                    requests.append(asyncio.create_task(send(data)))
+                await asyncio.sleep(1 / rate if rate else 0)
+            await asyncio.gather(*requests)
+
+        self.stats["events"] += sent
+        return {"sent": sent, "failed": failed, "seconds": round(monotonic() - started, 3)}
+
+    async def handle_events(self, request: web.Request) -> web.Response:
+        """POST /fake/events {"url": ..., "token": ..., "event": ..., "rate": ..., "total": ..., "duplicates": ...}"""
+        params = await request.json()
+        return web.json_response(await self.emit_events(**params))
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            **self.stats,
+            "tokens": round(self.tokens, 2),
+            "operating": {k: round(v[0], 4) for k, v in self.operating.items()},
+            "tasks": len(self.state.tasks), "folders": len(self.state.folders), "files": len(self.state.files),
+        })
+
+
+async def run(args: argparse.Namespace) -> None:
+    state = FakeState.generate(
+        users=args.users, departments=args.departments, groups=args.groups, stages=args.stages, tasks=args.tasks
+    )
+    fake = FakeBitrix(
+        state, latency=args.latency, jitter=args.jitter, rate=args.rate, burst=args.burst,
+        operating_limit=args.operating_limit, base_url=f"http://{args.host}:{args.port}"
+    )
+    runner = await fake.start(args.host, args.port)
+    print(f"Fake Bitrix: http://{args.host}:{args.port}/rest/1/token/")
+
+    try:
+        if args.webhook_url:
+            await asyncio.sleep(args.webhook_delay)
+            result = await fake.emit_events(
+                args.webhook_url, args.webhook_token, event=args.webhook_event,
+                rate=args.webhook_rate, total=args.webhook_total, duplicates=args.webhook_duplicates
+            )
+            print(f"Webhook events: {result}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in of the Bitrix24 REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random seconds added to latency")
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second, 0 - without limit")
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--operating-limit", type=float, default=480.0)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--departments", type=int, default=5)
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--stages", type=int, default=5)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--webhook-url", help="bot /bitrix url, events are sent after start")
+    parser.add_argument("--webhook-token", default="token", help="BIT_HOOK_TOKEN of the bot")
+    parser.add_argument("--webhook-event", default="ONTASKUPDATE")
+    parser.add_argument("--webhook-rate", type=float, default=10.0, help="events per second")
+    parser.add_argument("--webhook-total", type=int, default=100)
+    parser.add_argument("--webhook-duplicates", type=float, default=0.0, help="share of duplicated events")
+    parser.add_argument("--webhook-delay", type=float, default=5.0, help="seconds before sending events")
+
+    try:
+        asyncio.run(run(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
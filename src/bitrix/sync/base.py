@@ -1,60 +1,73 @@
+import asyncio
 from logging import ERROR
+from collections import deque
 
 from src.bitrix import BitrixAPI
+from src.bitrix.api.structs import BitDepartment, BitUser, BitStage
 from src.db.database import BitrixDB
-from src.db.models import TaskGroup, Stage, Department, DepartmentUser
+from src.db.models import TaskGroup, Stage, DepartmentUser
 from src.classes.cls_const import AccessLevelConst
+from src.classes.data_classes import SyncSummary
 from src.classes.models.logger import LogWriter
 
 
 class BaseBitSync:
+    bitrix_concurrency = 5  # groups synced at the same time (stages, folder index)
+
     def __init__(
             self, bitrix_api: BitrixAPI, db: BitrixDB, loger: LogWriter
     ) -> None:
         self.bitrix = bitrix_api
         self.db = db
         self.logger = loger
-
-    async def sync_users(self):
+        self.bitrix_semaphore = asyncio.Semaphore(self.bitrix_concurrency)
+
+    async def sync_users(self, bit_users: list[BitUser] = None) -> SyncSummary | None:
+        """
+        Adds new Bitrix users, renames changed ones and blocks fired ones.
+        The changes are found in memory and saved with one upsert and one update.
+        :param bit_users: all Bitrix users, requested if not passed
+        """
         try:
-            bit_users = await self.bitrix.get_users()
+            if bit_users is None:
+                bit_users = await self.bitrix.get_users()
             bit_users_in_db = {user.bit_user_id: user for user in await self.db.get_user() if user.bit_user_id}
 
         except Exception as e:
             await self.logger.send_log(ERROR, "BitSync -> sync_users", e, msg="error getting users from bitrix")
             return
-        print(f"\n\n\n\n\n\n\n\n\n\n{bit_users}\n\n\n\n\n\n\n\n\n\n")
 
+        summary = SyncSummary()
+        upsert: dict[int, dict] = {}
+        block_bit_ids: list[int] = []
         for user in bit_users:
-            try:
-                if user.get("ACTIVE") is False:   # skip fired employees
-                    print(f"\n\n\n\n\n\n\n\n\n\nuser active false {user.get('LAST_NAME')} {user.get('NAME')} {user.get('SECOND_NAME', '')}\n\n\n\n\n\n\n\n\n\n")
-                    
-                    continue
+            user_in_db = bit_users_in_db.get(user.id)
 
-                user_bit_id = int(user.get("ID"))
-                full_name = f"{user.get('LAST_NAME')} {user.get('NAME')} {user.get('SECOND_NAME', '')}"
-                print(f"{full_name}, {AccessLevelConst.BITRIX}, {user_bit_id}")
-                if user_bit_id not in bit_users_in_db:
-                    await self.db.add_user(full_name, AccessLevelConst.BITRIX, bit_user_id=user_bit_id)
-
-                else:
-                    change = False
-                    user_in_db = bit_users_in_db[user_bit_id]
+            if not user.active:  # fired employees are not added, existing ones are blocked
+                if user_in_db and user_in_db.access_level != AccessLevelConst.BLOCKED:
+                    block_bit_ids.append(user.id)
+                    summary.blocked += 1
+                continue
 
-                    if user_in_db.full_name != full_name:
-                        user_in_db.full_name = full_name
-                        change = True
+            if not user_in_db:
+                summary.added += 1
+            elif user_in_db.full_name != user.full_name:
+                summary.updated += 1
+            else:
+                summary.unchanged += 1
+                continue
 
-                    if user.get("ACTIVE") is False:
-                        change = True
-                        user_in_db.access_level = AccessLevelConst.BLOCKED
+            upsert[user.id] = {
+                "bit_user_id": user.id, "full_name": user.full_name, "access_level": AccessLevelConst.BITRIX
+            }
 
-                    if change:
-                        await self.db.update_user(update_to=user_in_db)
+        if summary.changed and not await self.db.sync_bitrix_users(
+                list(upsert.values()), block_bit_ids, blocked_level=AccessLevelConst.BLOCKED
+        ):
+            await self.logger.send_log(ERROR, "BitSync -> sync_users", msg=f"error saving users {summary}")
+            return
 
-            except Exception as e:
-                await self.logger.send_log(ERROR, "BitSync -> sync_users", e, msg=f"sync {user=}")
+        return summary
 
     async def sync_groups(self):
         try:
@@ -85,209 +98,219 @@ class BaseBitSync:
             await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg="error getting groups from db")
             return
 
-        for group in groups_in_db:
-            try:
-                bit_stages = await self.bitrix.get_stages(group_id=group.bit_group_id)
-                stages_in_db = {stage.bit_stage_id: stage for stage in await self.db.get_task_stage(group_id=group.id)}
-            except Exception as e:
-                await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg="error getting stages from bitrix")
-                continue
+        try:
+            async with self.bitrix_semaphore:
+                bit_stages = await self.bitrix.get_groups_stages([group.bit_group_id for group in groups_in_db])
+        except Exception as e:
+            await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg="error getting stages from bitrix")
+            return
+
+        await asyncio.gather(
+            *(self.sync_group_stages(group, bit_stages.get(group.bit_group_id)) for group in groups_in_db)
+        )
+
+    async def sync_group_stages(self, group: TaskGroup, bit_stages: dict[int, BitStage] | None):
+        if bit_stages is None:
+            await self.logger.send_log(ERROR, "BitSync -> sync_stages", msg=f"no stages from bitrix, {group.id=}")
+            return
 
-            for stage_id, stage_info in bit_stages.items():
-                stage_id = int(stage_id)
-                try:
-                    if stage_id in stages_in_db.keys():
-                        update = False
-                        s = stages_in_db.get(stage_id)
-                        if s.sort != int(stage_info["SORT"]):
-                            s.sort = int(stage_info["SORT"])
-                            update = True
-
-                        if s.title != stage_info["TITLE"]:
-                            s.title = stage_info["TITLE"]
-                            update = True
-
-                        if update:
-                            await self.db.update_task_stage(s)
-
-                        del stages_in_db[stage_id]
-
-                    else:
-                        await self.db.add_task_stage(
-                            group_id=group.id,
-                            bit_stage_id=stage_id,
-                            bit_sort=int(stage_info["SORT"]),
-                            title=stage_info["TITLE"]
-                        )
-                except Exception as e:
-                    await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg=f"sync {stage_info=}")
-
-            # delete stages that are not in bitrix but are in the DB
-            for stage_bit_id_del, stage_info_del in stages_in_db.items():
-                try:
-                    await self.db.delete_info(selected_model=Stage, id_=stage_info_del.id)
-                except Exception as e:
-                    await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg=f"del {stage_info_del=}")
-
-    async def sync_departments(self):
         try:
-            departments_in_bit = await self.bitrix.get_departments()
-            departments_in_db = {d.bit_dep_id: d for d in await self.db.get_department(bit_filter=True)}
-            checked_departments = set()
+            stages_in_db = {stage.bit_stage_id: stage for stage in await self.db.get_task_stage(group_id=group.id)}
         except Exception as e:
-            await self.logger.send_log(ERROR, "BitSync -> sync_departments", e, msg="error getting departments_in_bit")
+            await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg="error getting stages from db")
             return
 
-        for bit_dep in departments_in_bit:
+        for stage_id, stage_info in bit_stages.items():
             try:
-                bit_dep_id = int(bit_dep.get("ID"))
-                checked_departments.add(bit_dep_id)
-
-                # Check new departments
-                if bit_dep_id not in departments_in_db:
-                    """Create new department if it doesn't exist"""
-                    parent_bit_id = int(bit_dep["PARENT"]) if bit_dep.get("PARENT") else None
-                    if parent_bit_id in departments_in_db:
-                        parent_id = departments_in_db.get(int(parent_bit_id)).id
-                    else:
-                        parent_id = None
-
-                    department_in_db = await self.db.add_department(
-                        bit_dep_id=int(bit_dep.get("ID")),
-                        name=bit_dep.get("NAME"),
-                        parent_id=parent_id
-                    )
-                    departments_in_db[bit_dep_id] = department_in_db
+                if stage_id in stages_in_db.keys():
+                    update = False
+                    s = stages_in_db.get(stage_id)
+                    if s.sort != stage_info.sort:
+                        s.sort = stage_info.sort
+                        update = True
+
+                    if s.title != stage_info.title:
+                        s.title = stage_info.title
+                        update = True
+
+                    if update:
+                        await self.db.update_task_stage(s)
+
+                    del stages_in_db[stage_id]
 
-                # Check existing
                 else:
-                    department_in_db = departments_in_db[bit_dep_id]
-                    change = False
-
-                    if department_in_db.name != bit_dep.get("NAME"):
-                        change = True
-                        department_in_db.name = bit_dep.get("NAME")
-
-                    if bit_dep.get("PARENT"):
-                        parent_in_db = departments_in_db.get(int(bit_dep["PARENT"]))
-                        parent_id = departments_in_db[parent_in_db.bit_dep_id].id if parent_in_db else None
-                    else:
-                        parent_id = None
-
-                    if department_in_db.parent_id != parent_id:
-                        change = True
-                        department_in_db.parent_id = parent_id
-
-                    if change:
-                        await self.db.update_department(department=department_in_db)
-
-                await self.check_head(
-                    department_db_id=department_in_db.id,
-                    head_bit_user_id=int(bit_dep.get("UF_HEAD", 0)) or None,
-                    parent_department_db_id=parent_id
-                )
+                    await self.db.add_task_stage(
+                        group_id=group.id,
+                        bit_stage_id=stage_id,
+                        bit_sort=stage_info.sort,
+                        title=stage_info.title
+                    )
             except Exception as e:
-                await self.logger.send_log(ERROR, "BitSync -> sync_departments", e, msg=f"sync {bit_dep=}")
+                await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg=f"sync {stage_info=}")
 
-        # Delete
-        for dep_bit_id, dep_info in departments_in_db.items():
+        # delete stages that are not in bitrix but are in the DB
+        for stage_bit_id_del, stage_info_del in stages_in_db.items():
             try:
-                if dep_bit_id not in checked_departments:
-                    await self.db.delete_info(selected_model=Department, id_=dep_info.id)
+                await self.db.delete_info(selected_model=Stage, id_=stage_info_del.id)
             except Exception as e:
-                await self.logger.send_log(ERROR, "BitSync -> sync_departments", e, msg=f"del {dep_info=}")
-
-    async def check_head(
-            self, department_db_id: int, head_bit_user_id: int = None, parent_department_db_id: int = None
-    ):
+                await self.logger.send_log(ERROR, "BitSync -> sync_stages", e, msg=f"del {stage_info_del=}")
+
+    @staticmethod
+    def department_order(departments: dict[int, BitDepartment]) -> list[BitDepartment]:
+        """Departments sorted so that parents come before children (departments of a cycle are roots)"""
+        children: dict[int | None, list[BitDepartment]] = {}
+        for department in departments.values():
+            parent_id = department.parent_id if department.parent_id in departments else None
+            children.setdefault(parent_id, []).append(department)
+
+        order = []
+        queue = deque(children.get(None, []))
+        while queue:
+            department = queue.popleft()
+            order.append(department)
+            queue.extend(children.get(department.id, []))
+
+        if len(order) < len(departments):
+            ordered = {i.id for i in order}
+            order += [i for i in departments.values() if i.id not in ordered]
+        return order
+
+    async def sync_departments(self) -> SyncSummary | None:
+        """
+        Syncs the department tree and the department heads.
+        The tree is built and compared with the DB in memory, the changes are saved in one transaction.
+        A department without a head gets the head of its parent.
+        """
         try:
-            # get all managers with bit_id
-            managers: dict[int, DepartmentUser] = {
-                dep_user.user.bit_user_id: dep_user
-                for dep_user in await self.db.get_dep_users(department_id=department_db_id, head=True)
-                if dep_user.user.bit_user_id
-            }
+            departments_in_bit = {i.id: i for i in await self.bitrix.get_departments()}
+            departments_in_db = {d.bit_dep_id: d for d in await self.db.get_department(bit_filter=True)}
+            users = {user.bit_user_id: user.id for user in await self.db.get_users(with_bit_id=True)}
+            heads_in_db: dict[int, list[DepartmentUser]] = {}  # {department id: heads with bitrix id}
+            for dep_user in await self.db.get_dep_users(head=True):
+                if dep_user.user.bit_user_id:
+                    heads_in_db.setdefault(dep_user.department_id, []).append(dep_user)
+        except Exception as e:
+            await self.logger.send_log(ERROR, "BitSync -> sync_departments", e, msg="error getting departments_in_bit")
+            return
 
-            # if department not have head/manager
-            if ((head_bit_user_id is None) or (head_bit_user_id == 0)) and parent_department_db_id:
-                parent_head = await self.db.get_dep_users(department_id=parent_department_db_id, head=True)
-                if parent_head[0].user.bit_user_id in managers:
-                    del managers[parent_head[0].user.bit_user_id]
-                else:
-                    await self.db.add_dep_user(user_id=parent_head[0].user_id, head=True, department_id=department_db_id)
+        summary = SyncSummary()
+        departments: list[dict] = []
+        parents: dict[int, int | None] = {}
+        add_heads: list[tuple[int, int]] = []
+        delete_head_ids: list[int] = []
+        head_users: dict[int, int | None] = {}  # {bit_dep_id: user id of the head}
+
+        for bit_dep in self.department_order(departments_in_bit):
+            parent_bit_id = bit_dep.parent_id if bit_dep.parent_id in departments_in_bit else None
+            department_in_db = departments_in_db.get(bit_dep.id)
+
+            if not department_in_db:
+                summary.added += 1
+                departments.append({"bit_dep_id": bit_dep.id, "name": bit_dep.name})
+                if parent_bit_id:
+                    parents[bit_dep.id] = parent_bit_id
+            else:
+                changed = False
+                if department_in_db.name != bit_dep.name:
+                    changed = True
+                    departments.append({"bit_dep_id": bit_dep.id, "name": bit_dep.name})
+
+                parent_in_db = departments_in_db.get(parent_bit_id)
+                if department_in_db.parent_id != (parent_in_db.id if parent_in_db else None) \
+                        or (parent_bit_id and not parent_in_db):
+                    changed = True
+                    parents[bit_dep.id] = parent_bit_id
+
+                summary.updated += changed
+                summary.unchanged += not changed
+
+            # head
+            if bit_dep.head_id:
+                head_user_id = users.get(bit_dep.head_id)
+            else:
+                head_user_id = head_users.get(parent_bit_id)
+            head_users[bit_dep.id] = head_user_id
 
-            # if in db, check him
-            elif head_bit_user_id in managers:
-                del managers[head_bit_user_id]
+            heads = heads_in_db.get(department_in_db.id, []) if department_in_db else []
+            if head_user_id and head_user_id not in {i.user_id for i in heads}:
+                add_heads.append((bit_dep.id, head_user_id))
+            delete_head_ids += [i.id for i in heads if i.user_id != head_user_id]
 
-            # else add him
-            else:
-                head = await self.db.get_user(bit_id=head_bit_user_id)
-                await self.db.add_dep_user(user_id=head[0].id, head=True, department_id=department_db_id)
+        delete_ids = [i.id for bit_id, i in departments_in_db.items() if bit_id not in departments_in_bit]
+        summary.deleted = len(delete_ids)
+
+        if (summary.changed or add_heads or delete_head_ids) and not await self.db.sync_bitrix_departments(
+                departments, parents, add_heads, delete_head_ids, delete_ids
+        ):
+            await self.logger.send_log(ERROR, "BitSync -> sync_departments", msg=f"error saving departments {summary}")
+            return
 
-            for del_manager in managers.values():
-                await self.db.delete_info(selected_model=DepartmentUser, id_=del_manager.id)
+        return summary
+
+    async def sync_departments_users(self, bit_users: list[BitUser] = None) -> SyncSummary | None:
+        """
+        Syncs the employees of the departments with "UF_DEPARTMENT" of the Bitrix users.
+        Heads are synced by sync_departments and are not removed here.
+        :param bit_users: all Bitrix users, requested if not passed
+        """
+        try:
+            if bit_users is None:
+                bit_users = await self.bitrix.get_users()
+            users = {user.bit_user_id: user.id for user in await self.db.get_users(with_bit_id=True)}
+            departments = {d.bit_dep_id: d.id for d in await self.db.get_department(bit_filter=True)}
+            department_ids = set(departments.values())
+            dep_users_in_db: dict[tuple[int, int], DepartmentUser] = {}  # {(department id, user id): dep user}
+            for dep_user in await self.db.get_dep_users():
+                if dep_user.user.bit_user_id and dep_user.department_id in department_ids:
+                    dep_users_in_db[(dep_user.department_id, dep_user.user_id)] = dep_user
 
         except Exception as e:
+            await self.logger.send_log(ERROR, "BitSync -> sync_departments_users", e, msg="getting from bitrix/db")
+            return
+
+        summary = SyncSummary()
+        add: set[tuple[int, int]] = set()
+        for employee in bit_users:
+            user_id = users.get(employee.id)
+            if not user_id:
+                continue
+
+            for bit_dep_id in employee.departments:
+                department_id = departments.get(bit_dep_id)
+                if not department_id:
+                    continue
+
+                # existing ones are removed from dep_users_in_db, what remains is irrelevant
+                if dep_users_in_db.pop((department_id, user_id), None):
+                    summary.unchanged += 1
+                elif employee.active:  # skip users with ACTIVE == False
+                    add.add((department_id, user_id))
+
+        summary.added = len(add)
+        delete_ids = [i.id for i in dep_users_in_db.values() if not i.head]
+        summary.deleted = len(delete_ids)
+
+        if summary.changed and not await self.db.sync_department_users(list(add), delete_ids):
             await self.logger.send_log(
-                ERROR,
-                "BitSync -> check_head",
-                e,
-                msg=f"sync {department_db_id=}, {head_bit_user_id=}, {parent_department_db_id=}"
+                ERROR, "BitSync -> sync_departments_users", msg=f"error saving department users {summary}"
             )
+            return
 
-    async def sync_departments_users(self):
-        try:
-            all_bit_users = {user.bit_user_id: user for user in await self.db.get_users(with_bit_id=True)}
-            dep_in_db = await self.db.get_department()
-            dep_users_in_db: dict[int, dict[int, DepartmentUser]] = {i.id: {} for i in dep_in_db}
-            print(all_bit_users)
-            for dep_user in await self.db.get_dep_users():  # Get all department users in db with bit_id
-                if dep_user.user.bit_user_id:
-                    dep_users_in_db[dep_user.department_id][dep_user.user.bit_user_id] = dep_user
+        return summary
 
+    async def sync_folder_index(self):
+        """Rebuilds the folder index of the group folders (task folders can be renamed or deleted in Bitrix)"""
+        try:
+            groups_in_db = await self.db.get_task_group()
         except Exception as e:
-            await self.logger.send_log(ERROR, "BitSync -> sync_departments_users", e, msg="getting from bitrix/db")
+            await self.logger.send_log(ERROR, "BitSync -> sync_folder_index", e, msg="error getting groups from db")
             return
 
-        for department in dep_in_db:
+        async def rebuild(group: TaskGroup) -> None:
             try:
-                department_employees_bit = await self.bitrix.employees_departments(department.bit_dep_id)
+                async with self.bitrix_semaphore:
+                    await self.bitrix.rebuild_folder_index(group.bit_folder_id)
             except Exception as e:
-                await self.logger.send_log(
-                    ERROR, "BitSync -> sync_departments_users", e, msg=f"get from db {department=}"
-                )
-                return
-
-            for employee in department_employees_bit:
-                try:
-                    employee_bit_id = int(employee.get("ID"))
-                    employee_status = employee.get("ACTIVE")
-                    print(employee_bit_id)
-                    print(employee_status)
-
-                    if employee_bit_id not in dep_users_in_db[department.id]:
-                        if employee_status is False:  # Skip users with ACTIVE == False
-                            continue
-                        print(f"\ng\ng\ng\ng, {department.id}, {employee_bit_id}")
-                        await self.db.add_dep_user(
-                            user_id=all_bit_users[employee_bit_id].id, head=False, department_id=department.id
-                        )
-
-                    else:
-                        # delete existing to delete irrelevant
-                        del dep_users_in_db[department.id][employee_bit_id]
-
-                except Exception as e:
-                    await self.logger.send_log(
-                        ERROR, "BitSync -> sync_departments_users", e, msg=f"sync {employee=}"
-                    )
+                await self.logger.send_log(ERROR, "BitSync -> sync_folder_index", e, msg=f"rebuild {group.id=}")
 
-            for deleting_dep_user in dep_users_in_db[department.id].values():
-                try:
-                    if not deleting_dep_user.head:
-                        await self.db.delete_info(selected_model=DepartmentUser, id_=deleting_dep_user.id)
-                except Exception as e:
-                    await self.logger.send_log(
-                        ERROR, "BitSync -> sync_departments_users", e, msg=f"del {deleting_dep_user=}"
-                    )
+        await asyncio.gather(*(rebuild(group) for group in groups_in_db))
@@ -1,13 +1,17 @@
 import asyncio
-from logging import ERROR
+from logging import ERROR, WARNING
 from datetime import datetime, timedelta
 
 from .base import BaseBitSync
 from .task_check import TaskSync
+from .phases import SyncPhase, PhaseResult, run_phases, format_phases
 from .utils import calc_work_hours
 from .status_checks import StatusCheck
 from src.static.message_answers import TaskNFY
 from src.bot.structures.keyboards import test_answer_ikb
+from src.bitrix.api.limiter import Priority, request_priority
+from src.bitrix.api.metrics import Subsystem, request_subsystem
+from src.bitrix.api.breaker import BitrixUnavailable
 
 from src.classes.cls_const import StageType
 
@@ -28,14 +32,18 @@ class BitSync(TaskSync, BaseBitSync):
         await asyncio.sleep(sleep_duration)
 
     async def schedule_sync(self, run_hour: int, run_minute: int = 0, chat_id: int | str = None):
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.SYNC)
         while True:
-            await self.sync_all()
+            results = await self.sync_all()
             if chat_id:
-                await self.notify_manager.notify(TaskNFY.BIT_SYNC, tg_ids=[chat_id])
+                await self.notify_manager.notify(f"{TaskNFY.BIT_SYNC}\n{format_phases(results)}", tg_ids=[chat_id])
 
             await self.sleep_until(run_hour, run_minute)
 
     async def notify_testing(self, test_before, periodicity):
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.SYNC)
         while True:
             now = datetime.now()
             if now.hour > 18:
@@ -81,6 +89,8 @@ class BitSync(TaskSync, BaseBitSync):
         :param check_time: time (seconds) for which the tasks will be checked
         :param error_sleep: time (seconds) sleep if check error
         """
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.SYNC)
         while True:
             try:
                 groups = await self.db.get_task_group()
@@ -103,6 +113,9 @@ class BitSync(TaskSync, BaseBitSync):
                         if sleep_now > 0:
                             await asyncio.sleep(sleep_now)
 
+                    except BitrixUnavailable as e:  # already logged when the breaker opened
+                        await asyncio.sleep(max(e.retry_after, error_sleep))
+
                     except Exception as e:
                         await self.logger.send_log(
                             ERROR, f"BitSync -> sync_tasks task: {task.id} bit_id={task.bit_task_id}", e=e
@@ -112,8 +125,90 @@ class BitSync(TaskSync, BaseBitSync):
             except Exception as e:
                 await self.logger.send_log(ERROR, "BitSync -> sync_tasks", e=e)
 
+    async def sync_changed_tasks(self, period: int = 60, look_back: int = 3600, error_sleep: int = 30):
+        """
+        Background incremental recheck: only the tasks changed in Bitrix since the last check
+        :param period: time (seconds) between checks
+        :param look_back: time (seconds) checked on the first start (when there is no saved "changed_since")
+        :param error_sleep: time (seconds) sleep if check error
+        """
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.SYNC)
+        while True:
+            try:
+                await self.check_changed_tasks(look_back)
+                await asyncio.sleep(period)
+
+            except BitrixUnavailable as e:  # already logged when the breaker opened
+                await asyncio.sleep(max(e.retry_after, error_sleep))
+
+            except Exception as e:
+                await self.logger.send_log(ERROR, "BitSync -> sync_changed_tasks", e=e)
+                await asyncio.sleep(error_sleep)
+
+    async def check_changed_tasks(self, look_back: int = 3600) -> int:
+        """
+        Runs on_task_update for the tasks of the DB changed since "sync_state.changed_since",
+        then moves "changed_since" to the last change, or to the earliest change of a failed task
+        (it is checked again by the next poll). BitrixUnavailable stops the poll and is raised.
+        :return: number of checked tasks
+        """
+        groups = await self.db.get_task_group()
+        if not groups:
+            return 0
+
+        changed_since = self.sync_state.changed_since if self.sync_state else None
+        if not changed_since:
+            changed_since = (datetime.now().astimezone() - timedelta(seconds=look_back)).isoformat(timespec="seconds")
+        checked_ids = self.sync_state.task_ids if self.sync_state else set()
+
+        changed: dict[int, str] = {}
+        async for tasks in self.bitrix.iter_changed_tasks(changed_since, group_ids=[i.bit_group_id for i in groups]):
+            for task in tasks:
+                task_bit_id = int(task["id"])
+                if not (task["changedDate"] == changed_since and task_bit_id in checked_ids):
+                    changed[task_bit_id] = task["changedDate"]
+
+        if not changed:
+            return 0
+
+        checked = 0
+        done: set[int] = set()  # checked tasks and tasks that are not in the DB
+        try:
+            for task_bit_id, _ in sorted(changed.items(), key=lambda x: datetime.fromisoformat(x[1])):
+                try:
+                    if await self.db.get_task(task_bit_id=task_bit_id):
+                        await self.on_task_update(task_bit_id)
+                        checked += 1
+                    # else: new tasks are added by the ONTASKADD webhook
+                    done.add(task_bit_id)
+
+                except BitrixUnavailable:
+                    raise
+
+                except Exception as e:
+                    await self.logger.send_log(ERROR, f"BitSync -> check_changed_tasks bit_id={task_bit_id}", e=e)
+
+        finally:
+            # the mark stops at the earliest failed (or not reached) change, the tasks after it are checked again
+            not_done = [changed_date for i, changed_date in changed.items() if i not in done]
+            if not_done:
+                last_change = min(not_done, key=datetime.fromisoformat)
+            else:
+                last_change = max(changed.values(), key=datetime.fromisoformat)
+            last_ids = {i for i in done if changed[i] == last_change}
+            if last_change == changed_since:
+                last_ids |= checked_ids
+
+            if self.sync_state:
+                self.sync_state.set_changed(last_change, last_ids)
+
+        return checked
+
     async def auto_acceptance_tasks(self, weekends: list[int], start_wh, end_wh, periodicity: int = 3600) -> None:
         """Auto-acceptance of tasks that are in testing"""
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.SYNC)
         while True:
             try:
                 groups = await self.db.get_task_group()
@@ -165,9 +260,43 @@ class BitSync(TaskSync, BaseBitSync):
             finally:
                 await asyncio.sleep(periodicity)
 
-    async def sync_all(self):
-        await self.sync_users()
-        await self.sync_departments()
-        await self.sync_departments_users()
-        await self.sync_groups()
-        await self.sync_stages()
+    async def sync_all(self) -> list[PhaseResult]:
+        """
+        Users and departments are synced in parallel with groups and stages.
+        :return: time and result of every phase
+        """
+        bit_users = None
+
+        async def get_bit_users():
+            nonlocal bit_users
+            bit_users = await self.bitrix.get_users()  # one listing for users and department employees
+            return len(bit_users)
+
+        async def rebuild_counters():
+            if not await self.db.rebuild_counters():
+                raise Exception("Can't rebuild the queue counters")
+            if self.db.counters.drift:  # the applied writes missed something
+                await self.logger.send_log(
+                    WARNING, "BitSync -> sync_all counters", msg=f"{self.db.counters.drift} queue counts fixed"
+                )
+            if self.fifo:
+                self.fifo.invalidate()
+
+        results = await run_phases([
+            SyncPhase("bitrix_users", get_bit_users),
+            SyncPhase("users", lambda: self.sync_users(bit_users), after=("bitrix_users",), none_is_error=True),
+            SyncPhase("departments", self.sync_departments, after=("users",), none_is_error=True),
+            SyncPhase(
+                "departments_users", lambda: self.sync_departments_users(bit_users),
+                after=("bitrix_users", "departments"), none_is_error=True
+            ),
+            SyncPhase("groups", self.sync_groups),
+            SyncPhase("stages", self.sync_stages, after=("groups",)),
+            SyncPhase("folder_index", self.sync_folder_index, after=("groups",)),
+            SyncPhase("counters", rebuild_counters, after=("users", "stages")),  # recounts after the synced deletes
+        ])
+
+        for result in results:
+            if result.error:
+                await self.logger.send_log(ERROR, f"BitSync -> sync_all {result.name}", result.error)
+        return results
@@ -0,0 +1,218 @@
+import asyncio
+from logging import ERROR
+from bisect import bisect_left, insort
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from src.db.models import Task, TaskGroup, Stage
+from src.classes.cls_const import StageType
+from src.static.message_answers import TaskNFY
+from src.utils.task_report import TaskExport
+from src.bitrix.api.breaker import BitrixUnavailable
+
+from .base import BaseBitSync
+
+
+@dataclass()
+class FifoMove:
+    stage: Stage  # the stage to save
+    promote: bool = False  # the head of the queue passes to the next stage, see FifoQueue.after_move
+
+
+@dataclass()
+class _GroupQueue:
+    stage_id: int  # FIFO stage of the group
+    keys: list[tuple[datetime, int]] = field(default_factory=list)  # (queue_date, task id) in the queue order
+
+
+class FifoQueue:
+    """
+    FIFO stage of a group: tasks wait in the order of "queue_date" and the head passes to the next stage
+    when a task leaves the queue stages.
+    Every group queue is kept in memory as a sorted list loaded by the index (stage_id, queue_date):
+    the head is O(1), the position of a task is O(log n).
+    A queue is reloaded when its length differs from the stage counter (QueueCounters) or after "invalidate".
+    """
+
+    def __init__(self, bit_sync: BaseBitSync):
+        self.bit_sync = bit_sync
+        self._queues: dict[int, _GroupQueue] = {}  # {group_id: queue}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._retries: set[asyncio.Task] = set()  # promotions waiting for Bitrix
+
+    @staticmethod
+    def key(task: Task) -> tuple[datetime, int]:
+        return task.queue_date or datetime.max, task.id
+
+    @staticmethod
+    def fifo_stage(stages: Sequence[Stage]) -> Stage | None:
+        return next((s for s in stages if s.stage_type == StageType.FIFO), None)
+
+    @staticmethod
+    def next_stage(stages: Sequence[Stage], stage: Stage) -> Stage | None:
+        """:param stages: stages of the group ordered by "sort" """
+        return next((s for s in stages if stage.sort < s.sort), None)
+
+    def invalidate(self, group_id: int = None) -> None:
+        """The queues are loaded again on the next use (after the sync and admin panel edits)"""
+        if group_id is None:
+            self._queues.clear()
+        else:
+            self._queues.pop(group_id, None)
+
+    def _lock(self, group_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(group_id, asyncio.Lock())
+
+    async def _queue(self, group_id: int, stage_id: int) -> _GroupQueue:
+        queue = self._queues.get(group_id)
+        counters = self.bit_sync.db.counters
+        if (
+                queue is None or queue.stage_id != stage_id
+                or (counters.ready and counters.stage_count([stage_id]) != len(queue.keys))
+        ):
+            queue = _GroupQueue(stage_id, await self.bit_sync.db.get_fifo_keys(stage_id) or [])
+            self._queues[group_id] = queue
+        return queue
+
+    async def head(self, group_id: int, stages: Sequence[Stage]) -> int | None:
+        """:return: id of the first task in the queue"""
+        stage = self.fifo_stage(stages)
+        if not stage:
+            return None
+
+        queue = await self._queue(group_id, stage.id)
+        return queue.keys[0][1] if queue.keys else None
+
+    async def position(self, task: Task) -> tuple[int, int] | None:
+        """:return: (position from 1, queue length) if the task is in the FIFO stage of its group"""
+        if not (task.stage and task.stage.stage_type == StageType.FIFO):
+            return None
+
+        key = self.key(task)
+        for _ in range(2):  # the second time with the reloaded queue
+            queue = await self._queue(task.group_id, task.stage_id)
+            index = bisect_left(queue.keys, key)
+            if index < len(queue.keys) and queue.keys[index] == key:
+                return index + 1, len(queue.keys)
+            self.invalidate(task.group_id)
+
+        return None
+
+    async def on_stage_change(self, task: Task, to_stage: Stage, stages: Sequence[Stage]) -> FifoMove:
+        """
+        Call when the move of the task (still in its old stage) to "to_stage" is accepted and before it is saved.
+        A task moved to the FIFO stage of an empty queue goes to the next stage if the group queue is not full.
+        When the task leaves the queue stages the head of the FIFO queue has to pass to the next stage:
+        "after_move" does it when the move is saved.
+        """
+        from_stage = task.stage
+        exit_queue = bool(from_stage and from_stage.in_queue and not to_stage.in_queue)
+        fifo_stage = self.fifo_stage(stages)
+
+        if fifo_stage and from_stage and from_stage.id == fifo_stage.id:
+            async with self._lock(task.group_id):
+                queue = await self._queue(task.group_id, fifo_stage.id)
+                index = bisect_left(queue.keys, self.key(task))
+                if index < len(queue.keys) and queue.keys[index] == self.key(task):
+                    del queue.keys[index]
+
+        if fifo_stage and to_stage.id == fifo_stage.id:
+            to_stage = await self._enter(task, fifo_stage, stages)
+
+        return FifoMove(to_stage, promote=exit_queue and bool(task.group.fifo_queue))
+
+    async def after_move(self, move: FifoMove, group: TaskGroup, stages: Sequence[Stage]) -> None:
+        """Promotes the head of the queue after the move from "on_stage_change" is saved"""
+        if not move.promote:
+            return
+
+        try:
+            promoted = await self.pop_and_promote(group, stages)
+        except BitrixUnavailable as e:  # the head is back in the queue, try again when Bitrix is up
+            retry = asyncio.create_task(self._retry_promote(group, stages, e.retry_after))
+            self._retries.add(retry)
+            retry.add_done_callback(self._retries.discard)
+            return
+
+        if promoted:
+            await self.notify_promoted(promoted, group)
+
+    async def _retry_promote(self, group: TaskGroup, stages: Sequence[Stage], delay: float) -> None:
+        await asyncio.sleep(max(delay, 1))
+        try:
+            await self.after_move(FifoMove(self.fifo_stage(stages), promote=True), group, stages)
+        except Exception as e:
+            await self.bit_sync.logger.send_log(ERROR, "FifoQueue -> after_move", e, msg=f"retry {group.id=}")
+
+    async def _enter(self, task: Task, fifo_stage: Stage, stages: Sequence[Stage]) -> Stage:
+        async with self._lock(task.group_id):
+            queue = await self._queue(task.group_id, fifo_stage.id)
+            if not queue.keys:
+                in_queue = await self.bit_sync.db.get_stage_task_counts(stage_ids=[s.id for s in stages if s.in_queue])
+                next_stage = self.next_stage(stages, fifo_stage)
+                if next_stage and in_queue < (task.group.max_tasks or 0):
+                    return next_stage
+
+            insort(queue.keys, self.key(task))
+            return fifo_stage
+
+    async def pop_and_promote(self, group: TaskGroup, stages: Sequence[Stage]) -> Task | None:
+        """
+        Moves the head of the queue to the stage after the FIFO stage in the DB and in Bitrix.
+        The DB update is conditional, a task that already left the stage is skipped.
+        The Bitrix call runs without the lock, if it fails the task goes back to the head of the queue.
+        :return: the moved task
+        """
+        fifo_stage = self.fifo_stage(stages)
+        next_stage = self.next_stage(stages, fifo_stage) if fifo_stage else None
+        if not next_stage:
+            return None
+
+        task = None
+        async with self._lock(group.id):
+            queue = await self._queue(group.id, fifo_stage.id)
+            while queue.keys and not task:
+                _, task_id = queue.keys.pop(0)
+                task = await self.bit_sync.db.promote_fifo_task(task_id, fifo_stage.id, next_stage.id)
+
+        if not task:
+            return None
+
+        try:
+            result = await self.bit_sync.bitrix.update_task(task.bit_task_id, bit_stage_id=next_stage.bit_stage_id)
+        except BitrixUnavailable:
+            await self._revert(task, group, fifo_stage, next_stage)
+            raise
+        except Exception as e:
+            await self.bit_sync.logger.send_log(ERROR, "FifoQueue -> pop_and_promote", e, msg=f"{task.bit_task_id=}")
+            result = None
+
+        if not result:
+            await self._revert(task, group, fifo_stage, next_stage)
+            return None
+
+        return task
+
+    async def _revert(self, task: Task, group: TaskGroup, fifo_stage: Stage, next_stage: Stage) -> None:
+        """Returns the promoted task to the FIFO stage, it keeps its "queue_date" and is the head again"""
+        if not await self.bit_sync.db.promote_fifo_task(task.id, next_stage.id, fifo_stage.id):
+            await self.bit_sync.logger.send_log(
+                ERROR, "FifoQueue -> pop_and_promote", msg=f"the promotion of {task.bit_task_id=} is not reverted"
+            )
+        self.invalidate(group.id)
+
+    async def notify_promoted(self, task: Task, group: TaskGroup) -> None:
+        msg = TaskNFY.PASSED_QUEUE.format(bit_id=task.bit_task_id, task_name=task.title)
+        await self.bit_sync.notify_task_users(msg, task, title=False)
+
+        if group.notify:
+            file = await TaskExport.s_queue_png(self.bit_sync.db, group.id)
+            if file:
+                users_notify = []
+                for r in await self.bit_sync.db.get_roles(notify_queue=True, join_users=True):
+                    users_notify += r.users
+
+                await self.bit_sync.notify_manager.send_photo(
+                    file, msg, tg_ids={m.tg_id for m in users_notify if m.tg_id}
+                )
@@ -0,0 +1,97 @@
+import asyncio
+from html import escape
+from time import monotonic
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Sequence
+
+
+@dataclass()
+class SyncPhase:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    after: tuple[str, ...] = ()  # phases that must finish first (successfully or not)
+    none_is_error: bool = False  # the method logs its errors and returns None on failure
+
+
+@dataclass()
+class PhaseResult:
+    name: str
+    seconds: float = 0.0
+    result: Any = None
+    error: Exception | None = None
+    failed: bool = False
+    waited: float = 0.0  # seconds spent waiting for the dependencies
+    failed_after: list[str] = field(default_factory=list)  # failed dependencies
+
+
+async def run_phases(phases: Sequence[SyncPhase]) -> list[PhaseResult]:
+    """
+    Runs the phases concurrently, each phase starts when the phases from "after" are finished.
+    A failed phase does not stop the others, the failure is recorded in its result.
+    :return: results in the order of phases
+    """
+    names = {phase.name for phase in phases}
+    for phase in phases:
+        unknown = set(phase.after) - names
+        if unknown:
+            raise ValueError(f"Phase {phase.name} depends on unknown phases {unknown}")
+
+    # a cycle would wait forever
+    visiting, checked = set(), set()
+    after = {phase.name: phase.after for phase in phases}
+
+    def check_cycle(name: str) -> None:
+        if name in checked:
+            return
+        if name in visiting:
+            raise ValueError(f"Phase {name} depends on itself")
+        visiting.add(name)
+        for dependency in after[name]:
+            check_cycle(dependency)
+        visiting.discard(name)
+        checked.add(name)
+
+    for phase in phases:
+        check_cycle(phase.name)
+
+    results = {phase.name: PhaseResult(name=phase.name) for phase in phases}
+    done = {phase.name: asyncio.Event() for phase in phases}
+
+    async def run(phase: SyncPhase) -> None:
+        result = results[phase.name]
+        started = monotonic()
+        try:
+            for name in phase.after:
+                await done[name].wait()
+            result.failed_after = [name for name in phase.after if results[name].failed]
+            result.waited = monotonic() - started
+
+            started = monotonic()
+            result.result = await phase.run()
+            result.failed = phase.none_is_error and result.result is None
+
+        except Exception as e:
+            result.error = e
+            result.failed = True
+
+        finally:
+            result.seconds = monotonic() - started
+            done[phase.name].set()
+
+    await asyncio.gather(*(run(phase) for phase in phases))
+    return [results[phase.name] for phase in phases]
+
+
+def format_phases(results: Sequence[PhaseResult]) -> str:
+    """Report for the bot: time of every phase and the failed phases"""
+    lines = []
+    for result in results:
+        line = f"{'❌' if result.failed else '✅'} {result.name} - {result.seconds:.1f} с."
+        if result.error:
+            line += f" ({type(result.error).__name__}: {escape(str(result.error))})"
+        elif result.result is not None and not isinstance(result.result, (list, dict)):
+            line += f" ({escape(str(result.result))})"
+        if result.failed_after:
+            line += f", после ошибки в {', '.join(result.failed_after)}"
+        lines.append(line)
+    return "\n".join(lines)
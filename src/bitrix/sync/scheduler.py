@@ -0,0 +1,97 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable
+
+
+@dataclass()
+class _Batch:
+    first: float  # loop time of the first event of the batch
+    last: float  # loop time of the last event
+    waiters: list[asyncio.Future] = field(default_factory=list)
+    task: asyncio.Task | None = None
+
+
+class KeyedDebouncer:
+    """
+    Coalesces the events of one key (task id): the handler runs once after "quiet" seconds without new events
+    for the key, but no later than "max_delay" seconds after the first event.
+    Runs of one key never overlap, events received during a run start the next run. Different keys run in parallel.
+    """
+
+    def __init__(self, handler: Callable[[Hashable], Awaitable], quiet: float = 2.0, max_delay: float = 10.0):
+        self.handler = handler
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self._batches: dict[Hashable, _Batch] = {}
+
+        self.events = 0
+        self.runs = 0
+
+    @property
+    def ratio(self) -> float:
+        """Events per run"""
+        return self.events / self.runs if self.runs else 0.0
+
+    def is_pending(self, key: Hashable) -> bool:
+        """True if the key has waiting events or is being handled"""
+        return key in self._batches
+
+    def submit(self, key: Hashable) -> asyncio.Future:
+        """:return: future that is done when the run that covers this event is finished"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        future = loop.create_future()
+        self.events += 1
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = _Batch(first=now, last=now)
+            self._batches[key] = batch
+            batch.task = asyncio.create_task(self._run(key, batch))
+        elif not batch.waiters:  # the first event after the start of a run
+            batch.first = batch.last = now
+        else:
+            batch.last = now
+
+        batch.waiters.append(future)
+        return future
+
+    async def _run(self, key: Hashable, batch: _Batch) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while batch.waiters:
+                delay = min(batch.last + self.quiet, batch.first + self.max_delay) - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                waiters, batch.waiters = batch.waiters, []
+                self.runs += 1
+                try:
+                    await self.handler(key)
+                except Exception as e:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+
+        finally:
+            for waiter in batch.waiters:  # cancelled
+                waiter.cancel()
+            self._batches.pop(key, None)
+
+    def prometheus(self, name: str) -> str:
+        return (
+            f"# HELP {name}_events_total Events submitted to the debouncer\n"
+            f"# TYPE {name}_events_total counter\n"
+            f"{name}_events_total {self.events}\n"
+            f"# HELP {name}_runs_total Handler runs after coalescing\n"
+            f"# TYPE {name}_runs_total counter\n"
+            f"{name}_runs_total {self.runs}\n"
+            f"# HELP {name}_pending Keys waiting for the quiet window or running\n"
+            f"# TYPE {name}_pending gauge\n"
+            f"{name}_pending {len(self._batches)}\n"
+        )
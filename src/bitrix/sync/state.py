@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from src.classes.base.data_save import BaseDataSave
+
+
+class SyncState(BaseDataSave):
+    """
+    State of the incremental task sync, saved between restarts.
+    changed_since - "CHANGED_DATE" of the last checked change (high-water mark),
+    task_ids - tasks already checked with exactly this "CHANGED_DATE".
+    """
+    _config: dict
+
+    def __init__(self, config_path: Path) -> None:
+        BaseDataSave.init(self=self, config_path=config_path)
+
+    @property
+    def changed_since(self) -> str | None:
+        return self._config.get("changed_since")
+
+    @property
+    def task_ids(self) -> set[int]:
+        return set(self._config.get("task_ids", []))
+
+    def set_changed(self, changed_since: str, task_ids: set[int]) -> None:
+        self._config = {"changed_since": changed_since, "task_ids": sorted(task_ids)}
+        self.save_config()
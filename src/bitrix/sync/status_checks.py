@@ -5,16 +5,18 @@ from .utils import calc_work_hours
 
 from src.classes.cls_const import TaskRole, StageType
 from src.db.models import User, Task, Stage, TaskUser, RoleAccess, Role
-from src.db.database import BitrixDB, TaskUserRoles
+from src.db.database import BitrixDB, TaskUserRoles, TaskUnitOfWork
 from src.static.message_answers import StageNotify
 
 
 class StatusCheck:
     def __init__(
             self, db: BitrixDB, task: Task, change_by: User, roles: TaskUserRoles,
-            stages: Sequence[Stage], to_stage: Stage, self_bitrix_id: int
+            stages: Sequence[Stage], to_stage: Stage, self_bitrix_id: int, uow: TaskUnitOfWork = None
     ):
+        """:param uow: the writes go to the unit of work of the task update instead of the DB"""
         self.db = db
+        self.uow = uow
 
         self.task = task
         self.roles = roles
@@ -37,6 +39,18 @@ class StatusCheck:
                 return error_msg
         return None
 
+    async def save_task(self) -> None:
+        if self.uow:
+            self.uow.update_task(self.task)
+        else:
+            await self.db.update_task(self.task)
+
+    async def save_user(self, user: User) -> None:
+        if self.uow:
+            self.uow.update_user(user)
+        else:
+            await self.db.update_user(update_to=user)
+
     async def closed_task(self) -> str | None:
         """Checks if the given user can close the task. checks if the stage changes to all_stage[-1]"""
         if self.task.stage_id == self.stages[-1].id:
@@ -46,7 +60,7 @@ class StatusCheck:
             changer_role = await self.db.get_role(id_=self.change_by.role_id)  # noqa role_id: int | None
             if changer_role.access_all_stage:
                 self.task.closed_date = None
-                await self.db.update_task(self.task)
+                await self.save_task()
                 return None
 
             return StageNotify.CLOSE_ERR
@@ -148,24 +162,24 @@ class StatusCheck:
         if self.task.group.max_user_tasks and self.to_stage.id in stages_in_queue:
             check_user = self.roles.manager or self.roles.creator
 
-            user_tasks_in_queue = await self.db.get_tasks_with(
+            user_tasks_in_queue = await self.db.count_tasks_with(
                 stage_ids=stages_in_queue,
                 user_id=check_user.user_id,
                 role=TaskRole.MANAGER if self.roles.manager else TaskRole.CREATOR
             )
-            if len(user_tasks_in_queue) >= self.task.group.max_user_tasks:
+            if user_tasks_in_queue >= self.task.group.max_user_tasks:
                 return StageNotify.CREATOR_FULL.format(name=check_user.user.full_name)
 
         if (
                 self.task.group.max_executor_task and (not self.task.stage.in_queue) and self.to_stage.in_queue
                 and self.roles.executor and self.roles.executor.user.bit_user_id != self.self_bitrix_id
         ):
-            user_tasks_in_queue = await self.db.get_tasks_with(
+            user_tasks_in_queue = await self.db.count_tasks_with(
                 stage_ids=stages_in_queue,
                 user_id=self.roles.executor.user_id,
                 role=TaskRole.EXECUTOR
             )
-            if len(user_tasks_in_queue) >= self.task.group.max_executor_task:
+            if user_tasks_in_queue >= self.task.group.max_executor_task:
                 return StageNotify.RESPONSIBLE_MAX
 
     async def ban_accept(self) -> str | None:
@@ -189,7 +203,7 @@ class StatusCheck:
                         user.ban_time += ban_time
                     else:
                         user.ban_time = now + ban_time
-                    await self.db.update_user(update_to=user)
+                    await self.save_user(user)
 
             return None
 
@@ -238,13 +252,13 @@ class StatusCheck:
         if self.task.group.max_active_tasks:
             check_user = self.roles.manager or self.roles.creator
 
-            user_tasks_in_queue = await self.db.get_tasks_with(
+            user_tasks_in_queue = await self.db.count_tasks_with(
                 stage_ids=[self.to_stage.id],
                 user_id=check_user.user_id,
                 role=TaskRole.MANAGER if self.roles.manager else TaskRole.CREATOR
             )
-            if len(user_tasks_in_queue) >= self.task.group.max_active_tasks:
+            if user_tasks_in_queue >= self.task.group.max_active_tasks:
                 return StageNotify.CREATOR_FULL.format(name=check_user.user.full_name)
 
         self.task.queue_date = datetime.now()
-        await self.db.update_task(self.task)
+        await self.save_task()
@@ -8,7 +8,11 @@ from aiogram import Bot
 
 from .base import BaseBitSync
 from .task_update import UpdateTask
+from .state import SyncState
+from .scheduler import KeyedDebouncer
+from .fifo import FifoQueue
 
+from src.bitrix.api.structs import BitTask
 from src.db.database import TaskUserRoles
 from src.db.models import File, Task, TaskGroup, User, Stage
 from src.utils.utils import get_file_id, send_documents
@@ -22,18 +26,20 @@ from src.bot.structures.keyboards import comment_answer_ikb
 from src.i18n.i18n import translator
 
 
-def keyed_lock(get_key: Callable[..., int | str]):
+def keyed_lock(get_key: Callable[..., int | str], locks: str = "locks"):
+    """:param locks: name of the dict attribute with the locks (one dict per method, the lock is not reentrant)"""
     def decorator(func):
         @wraps(func)
         async def wrapper(self, *args, **kwargs):
             key = get_key(self, *args, **kwargs)
-            lock = self.locks.setdefault(key, asyncio.Lock())
+            all_locks = getattr(self, locks)
+            lock = all_locks.setdefault(key, asyncio.Lock())
             try:
                 async with lock:
                     return await func(self, *args, **kwargs)
             finally:
-                if not lock.locked() and self.locks.get(key) is lock:
-                    self.locks.pop(key, None)
+                if not lock.locked() and all_locks.get(key) is lock:
+                    all_locks.pop(key, None)
 
         return wrapper
     return decorator
@@ -43,9 +49,14 @@ class TaskSync(BaseBitSync):
     notify_manager: NotifyManager = None
     bot: Bot = None
     log_chat_id:  str | int = None
+    sync_state: SyncState = None
     skip_tasks: dict[int, int] = {}
     check_through = 5
+    file_mirror_concurrency = 4  # files of a new task downloaded and sent to Telegram at a time
     locks = {}
+    update_locks = {}
+    update_debouncer: KeyedDebouncer = None
+    fifo: FifoQueue = None
 
     def add_skip_task(self, task_bit_id) -> None:
         if len(self.skip_tasks) > 100:
@@ -67,10 +78,33 @@ class TaskSync(BaseBitSync):
             self.skip_tasks[task_bit_id] = 0
         return False
 
-    def setup_task_sync(self, notify_manager: NotifyManager,  bot: Bot, log_chat_id: str | int):
+    def setup_task_sync(
+            self, notify_manager: NotifyManager,  bot: Bot, log_chat_id: str | int, sync_state: SyncState = None,
+            update_quiet: float = 2.0, update_max_delay: float = 10.0
+    ):
+        """
+        :param update_quiet: ONTASKUPDATE hooks of one task are handled once after this many seconds without new hooks
+        :param update_max_delay: but no later than this many seconds after the first hook
+        """
         self.notify_manager = notify_manager
         self.bot = bot
         self.log_chat_id = log_chat_id
+        self.sync_state = sync_state
+        self.update_debouncer = KeyedDebouncer(self._debounced_update, quiet=update_quiet, max_delay=update_max_delay)
+        self.fifo = FifoQueue(self)
+
+    def schedule_task_update(self, task_bit_id: int) -> asyncio.Future:
+        """
+        on_task_update for a Bitrix hook: hooks of one task that come within "update_quiet" seconds
+        (Bitrix sends several hooks when a task is dragged in Kanban) are handled by one run.
+        :return: future that is done when the run is finished, it has the exception of a failed run
+        """
+        return self.update_debouncer.submit(task_bit_id)
+
+    async def _debounced_update(self, task_bit_id: int) -> None:
+        if self.bitrix.cache:
+            self.bitrix.cache.invalidate_task(task_bit_id)  # may be cached while the hooks were coming
+        await self.on_task_update(task_bit_id=task_bit_id)
 
     async def notify_task_users(
             self, message: str, task: Task,
@@ -109,14 +143,25 @@ class TaskSync(BaseBitSync):
             if self.notify_manager:
                 await self.notify_manager.notify(msg=notify, tg_ids=tg_ids, kb=kb)
 
-    async def on_task_update(self, task_bit_id: int) -> None:
+    async def on_task_update(self, task_bit_id: int, task_in_bitrix: BitTask = None) -> None:
+        """:param task_in_bitrix: already received task (with at least UpdateTask.bit_select fields)"""
         task_in_db = await self.db.get_task(task_bit_id=task_bit_id)
         if not task_in_db:
             await self.on_task_add(task_bit_id=task_bit_id)
             return
 
+        await self._update_task(task_bit_id, task_in_bitrix)
+
+    @keyed_lock(lambda self, task_bit_id, task_in_bitrix=None: task_bit_id, locks="update_locks")
+    async def _update_task(self, task_bit_id: int, task_in_bitrix: BitTask = None) -> None:
+        """Checks for changes of the task, one check of a task at a time"""
+        task_in_db = await self.db.get_task(task_bit_id=task_bit_id)  # may be changed while waiting for the lock
+        if not task_in_db:
+            return
+
         task_in_db = task_in_db[0]
-        task_in_bitrix = await self.bitrix.get_task(task_id=task_bit_id)
+        if task_in_bitrix is None:
+            task_in_bitrix = await self.bitrix.get_task(task_id=task_bit_id, select=UpdateTask.bit_select)
 
         if not task_in_bitrix:
             raise Exception(f"Can't get task {task_bit_id} from bitrix")
@@ -135,12 +180,20 @@ class TaskSync(BaseBitSync):
 
     @keyed_lock(lambda self, task_bit_id: task_bit_id)
     async def on_task_add(self, task_bit_id: int):
+        """
+        Adds the task in stages, independent steps of a stage run concurrently:
+        1. the task in the DB and in Bitrix (the task and its files in one batch request); 2. the group; 3. stages, creator and executor;
+        4. folder, task users (with observers in Bitrix) and files; 5. notify and check of the other fields
+        with the already received Bitrix task.
+        """
         if self.get_skip_task(task_bit_id):
             return
 
-        task_exist = await self.db.get_task(task_bit_id=task_bit_id)
-        task_in_bitrix = await self.bitrix.get_task(task_id=task_bit_id)  # if access denied we not get task
-        task_bit_group_id = int(task_in_bitrix.get("groupId", 0)) if task_in_bitrix else 0
+        task_exist, (task_in_bitrix, task_files) = await asyncio.gather(
+            self.db.get_task(task_bit_id=task_bit_id),
+            self.bitrix.get_task_with_files(task_id=task_bit_id)  # if access denied we not get task
+        )
+        task_bit_group_id = task_in_bitrix.group_id if task_in_bitrix else 0
         task_group_db = await self.db.get_task_group(bit_group_id=task_bit_group_id) if task_bit_group_id else 0
         if task_exist or (not task_in_bitrix) or (not task_bit_group_id) or (not task_group_db):
             self.add_skip_task(task_bit_id)
@@ -149,26 +202,32 @@ class TaskSync(BaseBitSync):
             del self.skip_tasks[task_bit_id]
 
         task_group_db = task_group_db[0]
-        stages = await self.db.get_task_stage(group_id=task_group_db.id)
 
-        # find creator
-        task_creator_bit_id = int(task_in_bitrix.get("createdBy"))
-        task_creator_db = await self.db.get_user(bit_id=task_creator_bit_id)
-        if not task_creator_db:
+        # find creator and responsible/developer/executor
+        stages, task_creator_db, task_executor_db = await asyncio.gather(
+            self.db.get_task_stage(group_id=task_group_db.id),
+            self.db.get_user(bit_id=task_in_bitrix.created_by),
+            self.db.get_user(bit_id=task_in_bitrix.responsible_id)
+        )
+        if not task_creator_db or not task_executor_db:
             await self.sync_users()
-            task_creator_db = await self.db.get_user(bit_id=task_creator_bit_id)
+            task_creator_db, task_executor_db = await asyncio.gather(
+                self.db.get_user(bit_id=task_in_bitrix.created_by),
+                self.db.get_user(bit_id=task_in_bitrix.responsible_id)
+            )
 
         task_creator_db = task_creator_db[0]
+        task_executor_db = task_executor_db[0]
 
-        if not await self.can_crate(task_bit_id, task_group_db, stages, task_creator_db, task_in_bitrix.get("title")):
+        if not await self.can_crate(task_bit_id, task_group_db, stages, task_creator_db, task_in_bitrix.title):
             return
 
         # Take a place in the database to get Task id
         task_in_db = Task(
             bit_task_id=task_bit_id,
-            bit_chat_id=int(task_in_bitrix.get("chatId")),
-            title=task_in_bitrix.get("title"),
-            description=task_in_bitrix.get("description", "None"),
+            bit_chat_id=task_in_bitrix.chat_id,
+            title=task_in_bitrix.title,
+            description=task_in_bitrix.description if task_in_bitrix.description is not None else "None",
             created_date=datetime.now(),
             group_id=task_group_db.id,
             stage_id=stages[0].id  # set first stage
@@ -179,25 +238,32 @@ class TaskSync(BaseBitSync):
         if not task_in_db:
             return
 
-        # create folder
-        project_folder = await self.bitrix.create_folder(
-            target_id=task_group_db.bit_folder_id, name=f"{task_in_db.id}_{task_in_db.title}"
+        project_folder, _, _ = await asyncio.gather(
+            self.bitrix.create_folder(
+                target_id=task_group_db.bit_folder_id, name=f"{task_in_db.id}_{task_in_db.title}"
+            ),
+            self._add_new_task_users(task_in_db, task_in_bitrix, task_creator_db, task_executor_db),
+            self._mirror_task_files(task_in_db, task_creator_db, task_files)
         )
 
-        await self.db.add_task_user(user_id=task_creator_db.id, task_id=task_in_db.id, role=TaskRole.CREATOR)
+        task_in_db.bit_folder_id = project_folder
+        task_in_db = await self.db.update_task(task_in_db)
 
-        # find responsible/developer/executor
-        task_executor_bit_id = int(task_in_bitrix.get("responsibleId"))
-        task_executor_db = await self.db.get_user(bit_id=task_executor_bit_id)
-        if not task_creator_db:
-            await self.sync_users()
-            task_executor_db = await self.db.get_user(bit_id=task_executor_bit_id)
+        # check other updates (check stages)
+        await self.notify_task_users(TaskNFY.NEW_TASK, task_in_db)
+        await self.on_task_update(task_bit_id=task_bit_id, task_in_bitrix=task_in_bitrix)
 
-        task_executor_db = task_executor_db[0]
-        await self.db.add_task_user(user_id=task_executor_db.id, task_id=task_in_db.id, role=TaskRole.EXECUTOR)
+    async def _add_new_task_users(
+            self, task_in_db: Task, task_in_bitrix: BitTask, creator: User, executor: User
+    ) -> None:
+        """Roles of the new task, observers are also added to the Bitrix task (and to "task_in_bitrix")"""
+        await asyncio.gather(
+            self.db.add_task_user(user_id=creator.id, task_id=task_in_db.id, role=TaskRole.CREATOR),
+            self.db.add_task_user(user_id=executor.id, task_id=task_in_db.id, role=TaskRole.EXECUTOR)
+        )
 
         bit_id_observers = set()
-        manager, observers, _ = await self.get_manager_and_observers(task_in_db, task_creator_db)
+        manager, observers, _ = await self.get_manager_and_observers(task_in_db, creator)
         await self.db.add_task_user(user_id=manager.id, task_id=task_in_db.id, role=TaskRole.MANAGER)
 
         for observer in observers.values():
@@ -206,27 +272,35 @@ class TaskSync(BaseBitSync):
                 bit_id_observers.add(observer.bit_user_id)
 
         if bit_id_observers:
-            await self.bitrix.update_task(
-                task_id=task_bit_id,
-                description=f"{MANAGER_TEXT}{manager.full_name}\n{task_in_bitrix.get('description', '')}",
-                auditors=list(bit_id_observers)
-            )
+            description = f"{MANAGER_TEXT}{manager.full_name}\n{task_in_bitrix.description or ''}"
+            if await self.bitrix.update_task(
+                    task_id=task_in_db.bit_task_id, description=description, auditors=list(bit_id_observers)
+            ):
+                # the update check gets this task instead of requesting it again
+                task_in_bitrix.description = description
+                task_in_bitrix.auditors = list(bit_id_observers)
+
+    async def _mirror_task_files(self, task_in_db: Task, creator: User, files: list[dict] | None) -> None:
+        """Files of the new task are sent to "log_chat_id", "file_mirror_concurrency" files at a time"""
+        if not (self.bot and self.log_chat_id and files):
+            return
 
-        task_in_db.bit_folder_id = project_folder
-        task_in_db = await self.db.update_task(task_in_db)
+        semaphore = asyncio.Semaphore(self.file_mirror_concurrency)
 
-        # sync files
-        files = await self.bitrix.get_task_files(task_id=task_bit_id)
-        if self.bot and files and self.log_chat_id:
-            for file_in_bit in files:
+        async def mirror(file_in_bit: dict) -> None:
+            async with semaphore:
                 try:
-                    file = await self.bitrix.download_file(download_url=file_in_bit.get("DOWNLOAD_URL"))
-                    file_in_tg = await get_file_id(
-                        bot=self.bot, chat_id=self.log_chat_id, file=file, file_name=file_in_bit.get("NAME")
-                    )
+                    file = await self.bitrix.download_file_stream(download_url=file_in_bit.get("DOWNLOAD_URL"))
+                    if not file:
+                        return
+
+                    with file:
+                        file_in_tg = await get_file_id(
+                            bot=self.bot, chat_id=self.log_chat_id, file=file, file_name=file_in_bit.get("NAME")
+                        )
                     file_in_db = File(
                         task_id=task_in_db.id,
-                        user_id=task_creator_db.id,
+                        user_id=creator.id,
                         tg_file_id=file_in_tg,
                         bit_file_id=int(file_in_bit.get("FILE_ID")),
                         name=file_in_bit.get("NAME"),
@@ -236,9 +310,7 @@ class TaskSync(BaseBitSync):
                 except Exception as e:
                     await self.logger.send_log(ERROR, "TaskSync -> on_task_add", e=e, msg="Add file error")
 
-        # check other updates (check stages)
-        await self.notify_task_users(TaskNFY.NEW_TASK, task_in_db)
-        await self.on_task_update(task_bit_id=task_bit_id)
+        await asyncio.gather(*(mirror(file_in_bit) for file_in_bit in files))
 
     async def on_task_comment_add(self, task_bit_id: int, message_bit_id: int) -> None:
         """return: if comment have file return {file_name: file_id}"""
@@ -255,26 +327,24 @@ class TaskSync(BaseBitSync):
                 return
 
         comment_info = await self.bitrix.get_comment_fix(chat_id=task_in_db[0].bit_chat_id, message_id=message_bit_id)
-        if not comment_info and comment_info.get("messages"):
+        if not comment_info or not comment_info.messages:
             return
 
-        all_files = comment_info["files"]
-        comment_msg = comment_info["messages"][0]
-        message_files = comment_msg["params"].get("FILE_ID", []) if comment_msg["params"] else []
+        comment_msg = comment_info.messages[0]
         for filter_msg in task_comment_filter:  # skip if comment have filtered message
-            if filter_msg.lower() in comment_msg["text"].lower():
+            if filter_msg.lower() in comment_msg.text.lower():
                 return
 
-        user = await self.db.get_user(bit_id=int(comment_msg["author_id"]))
+        user = await self.db.get_user(bit_id=comment_msg.author_id)
         if not user:
             await self.sync_users()
-            user = await self.db.get_user(bit_id=int(comment_msg["author_id"]))
+            user = await self.db.get_user(bit_id=comment_msg.author_id)
 
         files = {}
-        if message_files:
-            for file_info in all_files:
-                if file_info["id"] in message_files:
-                    files[file_info.get("name")] = [file_info.get("id"), file_info.get("urlDownload")]
+        if comment_msg.file_ids:
+            for file_info in comment_info.files:
+                if file_info.id in comment_msg.file_ids:
+                    files[file_info.name] = [file_info.id, file_info.url_download]
 
         comment_in_db = await self.db.get_comment(bit_comment_id=message_bit_id)
         if comment_in_db:
@@ -284,7 +354,7 @@ class TaskSync(BaseBitSync):
             task_id=task_in_db[0].id,
             user_id=user[0].id,
             bit_comment_id=message_bit_id,
-            text=MyTaskANS.COMMENT_FILE_TXT + comment_msg["text"] if files else comment_msg["text"],
+            text=MyTaskANS.COMMENT_FILE_TXT + comment_msg.text if files else comment_msg.text,
         )
 
         tg_ids = []
@@ -314,17 +384,22 @@ class TaskSync(BaseBitSync):
 
         comment_bot_msg = TaskNFY.ADD_COMMENT.format(
             author=user[0].full_name,
-            text=comment_msg["text"].translate(change_tag)
+            text=comment_msg.text.translate(change_tag)
         )
         notify += f"{comment_bot_msg}\n{MyTaskANS.COMMENT_FILE_TXT if files else ''}"
 
         tg_document_ids = []
         for file_name, file_bit_info in files.items():
             try:
-                file = await self.bitrix.download_file(file_bit_id=file_bit_info[0])  # urlDownload is not working properly
-                tg_file_id = await get_file_id(
-                    bot=self.bot, chat_id=self.log_chat_id, file=file, file_name=file_name
-                )
+                # urlDownload is not working properly
+                file = await self.bitrix.download_file_stream(file_bit_id=file_bit_info[0])
+                if not file:
+                    continue
+
+                with file:
+                    tg_file_id = await get_file_id(
+                        bot=self.bot, chat_id=self.log_chat_id, file=file, file_name=file_name
+                    )
                 tg_document_ids.append(tg_file_id)
 
                 description = MyTaskANS.COMMENT_LIST_INFO.format(
@@ -369,13 +444,13 @@ class TaskSync(BaseBitSync):
         if not group.max_active_tasks:
             return True
 
-        tasks = await self.db.get_tasks_with(
+        tasks = await self.db.count_tasks_with(
             [i.id for i in stages[:-1]],
             user_id=creator.id,
             role=TaskRole.CREATOR,
         )
         max_tasks = creator.max_active_tasks or group.max_active_tasks
-        if len(tasks) < max_tasks:
+        if tasks < max_tasks:
             return True
 
         else:
@@ -0,0 +1,218 @@
+import asyncio
+from typing import Awaitable
+from logging import ERROR, WARNING
+from datetime import datetime, timedelta
+
+from src.db.models import Task, WebhookEvent
+from src.classes.cls_const import WebhookStatus
+from src.bitrix.api.breaker import BitrixUnavailable
+from src.bitrix.api.limiter import backoff_delay
+
+from .bit_sync import BitSync
+
+
+# fields with the task id in the webhook form data
+TASK_ID_FIELDS = {
+    "ONTASKUPDATE": "data[FIELDS_BEFORE][ID]",
+    "ONTASKDELETE": "data[FIELDS_BEFORE][ID]",
+    "ONTASKADD": "data[FIELDS_AFTER][ID]",
+    "ONTASKCOMMENTADD": "data[FIELDS_AFTER][TASK_ID]",
+}
+
+
+def get_task_bit_id(event: str, data: dict) -> int:
+    try:
+        return int(data.get(TASK_ID_FIELDS.get(event, ""), 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class WebhookQueue:
+    """
+    Bitrix webhooks are saved to the "webhook_events" table and the request is answered at once,
+    the events are processed by "workers" in the order they were received.
+    A failed event is retried with a growing delay, after "max_attempts" it is kept as dead (WebhookStatus.DEAD).
+    Events taken by the workers before a restart are returned to the queue on start.
+    ONTASKUPDATE events do not hold a worker during the debounce window: the event stays taken
+    until the debounced run is finished and is completed by a separate asyncio task.
+    """
+    def __init__(
+            self, bit_sync: BitSync, workers: int = 4, max_attempts: int = 5, retry_delay: float = 30,
+            poll_interval: float = 5
+    ):
+        """
+        :param retry_delay: delay before the second attempt in seconds, doubled for each next attempt
+        :param poll_interval: seconds between checks of the table when there are no new events
+        """
+        self.bit_sync = bit_sync
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+
+        self._new_event = asyncio.Event()
+        self._waiting: set[asyncio.Task] = set()  # ONTASKUPDATE events waiting for the debounced run
+
+        # metrics since the start
+        self.received = 0
+        self.processed = 0
+        self.retried = 0
+        self.dead = 0
+        self.lag_sum = 0.0  # seconds from receiving to processing of the processed events
+        self.lag_max = 0.0
+
+    @property
+    def db(self):
+        return self.bit_sync.db
+
+    async def put(self, event: str, data: dict) -> bool:
+        """Saves the webhook, returns False if the event is not supported or was not saved"""
+        if event not in TASK_ID_FIELDS:
+            return False
+
+        webhook_event = await self.db.add_webhook_event(event, data, task_bit_id=get_task_bit_id(event, data))
+        if not webhook_event:
+            return False
+
+        self.received += 1
+        self.invalidate_task_cache(webhook_event.task_bit_id)  # Bitrix reported a change of the task
+        self._new_event.set()
+        return True
+
+    def invalidate_task_cache(self, task_bit_id: int) -> None:
+        """Drops the cached responses of the changed task"""
+        if task_bit_id and self.bit_sync.bitrix.cache:
+            self.bit_sync.bitrix.cache.invalidate_task(task_bit_id)
+
+    async def run(self) -> None:
+        returned = await self.db.reset_webhook_events()
+        if returned:
+            await self.bit_sync.logger.send_log(WARNING, "WebhookQueue -> run", msg=f"{returned} events returned")
+
+        try:
+            await asyncio.gather(*(self.worker() for _ in range(self.workers)))
+        finally:
+            for waiting in self._waiting:  # the events stay taken and are returned on the next start
+                waiting.cancel()
+
+    async def worker(self) -> None:
+        while True:
+            try:
+                events = await self.db.claim_webhook_events(limit=1)
+                if not events:
+                    self._new_event.clear()
+                    try:
+                        await asyncio.wait_for(self._new_event.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self.process(events[0])
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                await self.bit_sync.logger.send_log(ERROR, "WebhookQueue -> worker", e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, event: WebhookEvent) -> None:
+        if event.event == "ONTASKUPDATE" and event.task_bit_id:
+            waiting = asyncio.create_task(self.complete(event, self.bit_sync.schedule_task_update(event.task_bit_id)))
+            self._waiting.add(waiting)
+            waiting.add_done_callback(self._waiting.discard)
+            return
+
+        await self.complete(event, self.handle(event.event, event.task_bit_id, event.data))
+
+    async def complete(self, event: WebhookEvent, handling: Awaitable) -> None:
+        """Waits for the handling of the event, then deletes the event or returns it to the queue"""
+        try:
+            await handling
+
+        except BitrixUnavailable as e:  # not counted as an attempt, already logged when the breaker opened
+            await self.db.release_webhook_event(
+                event.id, WebhookStatus.NEW, error=str(e), attempts=event.attempts - 1,
+                available_at=datetime.now() + timedelta(seconds=max(e.retry_after, 1))
+            )
+            self.retried += 1
+            return
+
+        except Exception as e:
+            if event.attempts >= self.max_attempts:
+                await self.db.release_webhook_event(event.id, WebhookStatus.DEAD, error=repr(e))
+                self.dead += 1
+                await self.bit_sync.logger.send_log(
+                    ERROR, "WebhookQueue -> process", e, msg=f"dead event {event.id=}, {event.data=}"
+                )
+            else:
+                delay = backoff_delay(event.attempts - 1, self.retry_delay, max_delay=3600)
+                await self.db.release_webhook_event(
+                    event.id, WebhookStatus.NEW, error=repr(e), available_at=datetime.now() + timedelta(seconds=delay)
+                )
+                self.retried += 1
+            return
+
+        await self.db.delete_webhook_event(event.id)
+        lag = (datetime.now() - event.received_at).total_seconds()
+        self.processed += 1
+        self.lag_sum += lag
+        self.lag_max = max(self.lag_max, lag)
+
+    async def handle(self, event: str, task_bit_id: int, data: dict) -> None:
+        bit_sync = self.bit_sync
+        match event:
+            # Bitrix sometimes sends two hooks to the same event (namely when manually dragging a task in Kanban),
+            # hooks of one task are handled by one run
+            case "ONTASKUPDATE":
+                if task_bit_id:
+                    await bit_sync.schedule_task_update(task_bit_id)
+
+            case "ONTASKADD":
+                # the update run adds the task if it's not in the DB yet
+                if task_bit_id and not bit_sync.update_debouncer.is_pending(task_bit_id):
+                    await bit_sync.on_task_add(task_bit_id=task_bit_id)
+
+            case "ONTASKDELETE":
+                await asyncio.sleep(1)  # when task deleted from bot
+                if not task_bit_id:
+                    return
+
+                task_in_db = await bit_sync.db.get_task(task_bit_id=task_bit_id)
+                if task_in_db:
+                    await bit_sync.db.delete_info(selected_model=Task, id_=task_in_db[0].id)
+
+            case "ONTASKCOMMENTADD":
+                await bit_sync.on_task_comment_add(
+                    task_bit_id=task_bit_id,
+                    message_bit_id=int(data.get("data[FIELDS_AFTER][MESSAGE_ID]"))
+                )
+
+    async def prometheus(self) -> str:
+        """Queue metrics in Prometheus text format"""
+        info = await self.db.get_webhook_queue_info()
+        now = datetime.now()
+        oldest = info.get(WebhookStatus.NEW, (0, None))[1]
+        lines = [
+            "# HELP webhook_queue_events Events in the queue by status",
+            "# TYPE webhook_queue_events gauge",
+            *(f'webhook_queue_events{{status="{status}"}} {info.get(status, (0, None))[0]}'
+              for status in sorted(WebhookStatus.ALL)),
+            "# HELP webhook_queue_oldest_seconds Age of the oldest waiting event",
+            "# TYPE webhook_queue_oldest_seconds gauge",
+            f"webhook_queue_oldest_seconds {(now - oldest).total_seconds() if oldest else 0:.3f}",
+            "# HELP webhook_events_total Events since the start",
+            "# TYPE webhook_events_total counter",
+            f'webhook_events_total{{result="received"}} {self.received}',
+            f'webhook_events_total{{result="processed"}} {self.processed}',
+            f'webhook_events_total{{result="retried"}} {self.retried}',
+            f'webhook_events_total{{result="dead"}} {self.dead}',
+            "# HELP webhook_lag_seconds Seconds from receiving to processing of the processed events",
+            "# TYPE webhook_lag_seconds summary",
+            f"webhook_lag_seconds_sum {self.lag_sum:.3f}",
+            f"webhook_lag_seconds_count {self.processed}",
+            "# HELP webhook_lag_max_seconds Max seconds from receiving to processing",
+            "# TYPE webhook_lag_max_seconds gauge",
+            f"webhook_lag_max_seconds {self.lag_max:.3f}",
+        ]
+        return "\n".join(lines) + "\n" + self.bit_sync.update_debouncer.prometheus("task_update_debounce")
@@ -11,6 +11,8 @@ from src.i18n.i18n import translate as _
 from src.i18n.locales import BLOCKED_MESSAGES, TO_REGISTRATION, START_MESSAGE
 
 from src.classes.cls_const import AccessLevelConst
+from src.bitrix.api.limiter import Priority, request_priority
+from src.bitrix.api.metrics import Subsystem, request_subsystem
 
 def inline_results(language: str) -> list[types.InlineQueryResultArticle]:
     return [
@@ -65,6 +67,10 @@ class AccessMiddleware(BaseMiddleware):
                     await to_registration(event.event.from_user.id, state)
                     return None
 
+        # Bitrix requests from bot handlers get quota before background sync
+        request_priority.set(Priority.INTERACTIVE)
+        request_subsystem.set(Subsystem.BOT)
+
         # Pass control to the next handler
         data["language"] = language
         data["access"] = user_access
@@ -12,6 +12,7 @@ from src.utils.utils import mark_as_paid
 from src.classes.cls_const import AccessLevelConst
 from src.bot.util.templates import to_user_main_menu, to_registration, check_file, send_file
 from src.static.message_answers import TaskNFY
+from src.bitrix.sync.phases import format_phases
 
 from src.configuration import conf
 
@@ -62,8 +63,8 @@ async def change_language(message: Message, state: FSMContext) -> None:
 @check_admin_access
 async def sync_bitrix(message: Message, state: FSMContext, access: str, language: str) -> None:
     await message.answer(TaskNFY.BIT_START_SYNC)
-    await conf.bit_sync.sync_all()
-    await message.answer(TaskNFY.BIT_SYNC)
+    results = await conf.bit_sync.sync_all()
+    await message.answer(f"{TaskNFY.BIT_SYNC}\n{format_phases(results)}")
 
 
 @commands_router.message(Command("mailing"))
@@ -241,3 +242,16 @@ async def task_stage(message: Message, state: FSMContext, access: str, language:
     except Exception as e:
         await conf.logger.send_log(ERROR, "task_stage", e=e)
         await message.answer("Ошибка!")
+
+
+@commands_router.message(Command("bitrix_stat"))
+@check_admin_access
+async def bitrix_stat(message: Message, state: FSMContext, access: str, language: str) -> None:
+    """/bitrix_stat [prev] - Bitrix requests by method for the current (or previous) period"""
+    try:
+        previous = "prev" in message.text.split()[1:]
+        await message.answer(conf.bitrix.metrics.summary(previous=previous))
+
+    except Exception as e:
+        await conf.logger.send_log(ERROR, "bitrix_stat command", e=e)
+        await message.answer("Ошибка!")
@@ -1,14 +1,16 @@
 from datetime import datetime
 
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, ErrorEvent
 from aiogram.fsm.context import FSMContext
+from aiogram.filters import ExceptionTypeFilter
 from aiogram import Router, Bot
 
 from src.bitrix.sync.status_checks import StatusCheck
 from src.bitrix.sync.utils import format_stage_changing
+from src.bitrix.api.breaker import BitrixUnavailable
 from src.bot.structures.keyboards import back_rkb, task_info_rkb, RegCallback, CompleteTaskCallback, comment_answer_ikb
 from src.bot.routers.commands import start_command
-from src.bot.util.templates import can_delete
+from src.bot.util.templates import can_delete, format_task_stage
 from src.bot.structures.fsm import User
 
 from src.classes.data_classes import TaskInfo
@@ -18,11 +20,21 @@ from src.configuration import conf
 from src.classes.cls_const import AccessLevelConst
 from src.static.message_answers import MyTaskANS, DONT_CHOOSE_ANS, change_tag
 
-from src.i18n.i18n import translate as _
+from src.i18n.i18n import translator, translate as _
 
 other_routers = Router(name="other_routers")
 
 
+@other_routers.errors(ExceptionTypeFilter(BitrixUnavailable))
+async def bitrix_unavailable(event: ErrorEvent, language: str = None) -> None:
+    """Bitrix is down (circuit breaker is open): answer at once instead of a generic error"""
+    text = _("bitrix_unavailable", language or translator.default_language)
+    if event.update.message:
+        await event.update.message.answer(text)
+    elif event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+
+
 @other_routers.message()
 async def empty_fsm(message: Message, state: FSMContext, access: str, language: str) -> None:
     await start_command(message, state, access, language)
@@ -135,14 +147,15 @@ async def format_task_info(task_db_id: int) -> dict:
         developer=developer_name,
         manager=manager_name,
         observers=observers,
-        can_delete=can_delete(task_in_db)
+        can_delete=can_delete(task_in_db),
+        queue=await conf.bit_sync.fifo.position(task_in_db)
     )
     msg = MyTaskANS.TASK_INFO.format(
         bit_id=task.bit_id,
         task_name=task.title.translate(change_tag), description=task.description[0:2048].translate(change_tag),
         creator=task.creator, developer=task.developer, manager=task.manager,
         observers=MyTaskANS.OBSERVERS_JOIN.join(task.observers or []),
-        group=task.group, region=task.region, stage=task.stage
+        group=task.group, region=task.region, stage=format_task_stage(task)
     )
 
     return {"selected_task": task, "task_message": msg}
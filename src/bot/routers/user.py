@@ -311,7 +311,7 @@ async def user_my_tasks(message: Message, state: FSMContext, language: str):
                 description=task_info.description[0:2048].translate(change_tag),
                 creator=task_info.creator, developer=task_info.developer, manager=task_info.manager,
                 observers=MyTaskANS.OBSERVERS_JOIN.join(task_info.observers or []),
-                group=task_info.group, region=task_info.region, stage=task_info.stage
+                group=task_info.group, region=task_info.region, stage=format_task_stage(task_info)
             )
 
             await message.answer(
@@ -522,67 +522,15 @@ async def user_my_task_change_stage(message: Message, state: FSMContext, languag
                 await conf.bit_sync.notify_task_users(editor + stage_msg, task, roles=roles, kb=kb)
                 await to_user_main_menu(message, state, language)
 
-                task_exit_queue = task.stage.in_queue and not to_stage.in_queue
-                task.stage_id = to_stage.id
-
                 if stages[-1].id == to_stage.id:
                     task.closed_date = datetime.now()
 
-                if to_stage.stage_type == StageType.FIFO:
-                    task_fifo = await conf.bit_sync.db.get_fifo_queue(group_id=task.group.id)
-                    if not task_fifo:
-                        stages_in_queue = [s.id for s in stages if s.in_queue]
-                        number_of_tasks = await conf.bitrix_db.get_stage_task_counts(stage_ids=stages_in_queue)
-
-                    else:
-                        number_of_tasks = 0
-                        task_fifo = [task]
-
-                    if not task_fifo and (number_of_tasks < task.group.max_tasks):
-
-                        next_stage = None
-
-                        for st in stages:
-                            if to_stage.sort < st.sort:
-                                next_stage = st
-                                break
-
-                        if next_stage:
-                            task.stage_id = next_stage.id
-                            to_stage = next_stage
-
-                await conf.bitrix_db.update_task(task=task)
-                await conf.bitrix.update_task(task_id=task.bit_task_id, bit_stage_id=to_stage.bit_stage_id)
-
-                if task_exit_queue and task.group.fifo_queue:
-                    task_fifo = await conf.bitrix_db.get_fifo_queue()
-                    if task_fifo:
-                        task_fifo = task_fifo[0]
-                        next_stage = None
-
-                        for st in stages:
-                            if task_fifo.stage.sort < st.sort:
-                                next_stage = st
-                                break
-
-                        if next_stage:
-                            task_fifo.stage_id = next_stage.id
-                            await conf.bitrix_db.update_task(task_fifo)
-                            await conf.bitrix.update_task(task_fifo.bit_task_id, bit_stage_id=next_stage.bit_stage_id)
-
-                            msg = TaskNFY.PASSED_QUEUE.format(bit_id=task_fifo.bit_task_id, task_name=task_fifo.title)
-                            await conf.bit_sync.notify_task_users(msg, task_fifo, title=False)
-
-                            if task.group.notify:
-                                file = await conf.task_export.queue_png("", "", task.group.id)
-                                if file:
-                                    users_notify = []
-                                    for r in await conf.bitrix_db.get_roles(notify_queue=True, join_users=True):
-                                        users_notify += r.users
-
-                                    await conf.notify_manager.send_photo(
-                                        file, "", tg_ids={m.tg_id for m in users_notify if m.tg_id}
-                                    )
+                fifo_move = await conf.bit_sync.fifo.on_stage_change(task, to_stage, stages)
+                task.stage_id = fifo_move.stage.id
+
+                if await conf.bitrix_db.update_task(task=task):
+                    await conf.bitrix.update_task(task_id=task.bit_task_id, bit_stage_id=fifo_move.stage.bit_stage_id)
+                    await conf.bit_sync.fifo.after_move(fifo_move, task.group, stages)
         else:
             await message.answer(MyTaskANS.STAGE_NONE)
 
@@ -17,6 +17,8 @@ from src.classes.data_classes import TaskInfo
 from src.classes.cls_const import TaskRole, FileTypeConst, StageType
 
 from src.configuration import conf
+from src.utils.utils import telegram_file_stream
+from src.bitrix.api.breaker import BitrixUnavailable
 
 from src.i18n.locales import START_MESSAGE
 from src.i18n.i18n import translator, translate as _
@@ -30,6 +32,8 @@ async def create_task(
         deadline: datetime = None,
         executor_id: int = None
 ) -> bool:
+    """:raise BitrixUnavailable: if Bitrix is not responding"""
+    conf.bitrix.breaker.check()  # do not create the task in the DB if Bitrix is down
     try:
         # Get info task_group_db, task_user_db
         task_group_db = await conf.bitrix_db.get_task_group(title=group)
@@ -80,25 +84,33 @@ async def create_task(
             target_id=task_group_db.bit_folder_id, name=f"{task_in_db.id}_{title}"
         )
 
-        # Download the file and upload the file to Bitrix.
-        bitrix_files = []
-        uploaded_files = set()
+        # Stream the files from Telegram to Bitrix (several at once).
+        files_info, file_names = [], set()
         for file_info in files:
-            try:
-                if file_info[1] in uploaded_files:  # skip duplicates
-                    continue
-                uploaded_files.add(file_info[1])
+            if file_info[1] not in file_names:  # skip duplicates
+                file_names.add(file_info[1])
+                files_info.append(file_info)
+
+        uploads = await conf.bitrix.upload_files(
+            folder_id=project_folder,
+            files=[(file_info[1], telegram_file_stream(bot, file_info[0])) for file_info in files_info]
+        )
 
-                file = await bot.download(file_info[0])
-                bit_file = await conf.bitrix.upload_file(
-                    folder_id=project_folder, file_name=file_info[1], file=file
+        bitrix_files = []
+        for file_info, upload in zip(files_info, uploads):
+            if upload.error or not upload.file:
+                await conf.logger.send_log(
+                    ERROR, "templates.py -> create_task -> uploading files", e=upload.error, msg=f"{file_info}"
                 )
-                bitrix_files.append(bit_file["ID"])
+                continue
+
+            try:
+                bitrix_files.append(upload.file["ID"])
                 file_in_db = File(
                     task_id=task_in_db.id,
                     user_id=task_user_db.id,
                     tg_file_id=file_info[0],
-                    bit_file_id=int(bit_file["ID"]),
+                    bit_file_id=int(upload.file["ID"]),
                     name=file_info[1],
                     description=file_info[3],
                     type=file_info[2]
@@ -156,6 +168,9 @@ async def create_task(
 
         return True
 
+    except BitrixUnavailable:
+        raise
+
     except Exception as e:
         await conf.logger.send_log(ERROR, "templates.py -> create_task", e=e)
         return False
@@ -202,7 +217,8 @@ async def get_tasks_list(tg_id: int, roles: list[str]) -> list[TaskInfo]:
                     developer=developer_name,
                     manager=manager_name,
                     observers=observers,
-                    can_delete=can_delete(task_user.task)
+                    can_delete=can_delete(task_user.task),
+                    queue=await conf.bit_sync.fifo.position(task_user.task)
                 )
             )
 
@@ -296,6 +312,8 @@ def format_task_comments(
 async def write_comment(
         task_db_id: int, user_tg_id: int, text: str, file_info: list = None, bot: Bot = None
 ) -> bool | str:
+    """:raise BitrixUnavailable: if Bitrix is not responding"""
+    conf.bitrix.breaker.check()
     try:
         user = await conf.bitrix_db.get_user(tg_id=user_tg_id)
         user = user[0]
@@ -329,8 +347,9 @@ async def write_comment(
                 author=user.full_name,
                 text=f"{file_info[3] or ''}\n{MyTaskANS.COMMENT_FILE_TXT}".translate(change_tag)
             )
-            file = await bot.download(file_info[0])
-            bit_file = await conf.bitrix.upload_file(folder_id=task.bit_folder_id, file_name=file_info[1], file=file)
+            bit_file = await conf.bitrix.upload_file(
+                folder_id=task.bit_folder_id, file_name=file_info[1], file=telegram_file_stream(bot, file_info[0])
+            )
             bit_file_id = int(bit_file.get("ID"))
 
             comment_id = await conf.bitrix.add_file_comment(
@@ -406,6 +425,9 @@ async def write_comment(
 
         return True
 
+    except BitrixUnavailable:
+        raise
+
     except Exception as e:
         await conf.logger.send_log(ERROR, "templates -> write_comment", e=e)
         return False
@@ -609,16 +631,25 @@ async def can_crate(tg_id: int, group_name: str) -> int | bool:
 
     user = await conf.bitrix_db.get_user(tg_id=tg_id)
     stages = await conf.bitrix_db.get_task_stage(group_id=group[0].id)
-    tasks = await conf.bitrix_db.get_tasks_with([i.id for i in stages[:-1]], user_id=user[0].id, role=TaskRole.CREATOR)
+    tasks = await conf.bitrix_db.count_tasks_with(
+        [i.id for i in stages[:-1]], user_id=user[0].id, role=TaskRole.CREATOR
+    )
 
     max_tasks = user[0].max_active_tasks or group[0].max_active_tasks
-    if len(tasks) < max_tasks:
+    if tasks < max_tasks:
         return True
 
     else:
         return max_tasks
 
 
+def format_task_stage(task: TaskInfo) -> str:
+    """Stage title, with the place in the queue for the FIFO stage"""
+    if task.queue:
+        return MyTaskANS.QUEUE_POSITION.format(stage=task.stage, position=task.queue[0], total=task.queue[1])
+    return task.stage
+
+
 def can_delete(task: Task) -> bool:
     if task.stage and (task.stage.in_queue or task.test_date or task.closed_date):
         return False
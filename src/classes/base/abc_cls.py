@@ -19,3 +19,25 @@ class LoggerABC(ABC):
 
     def write_log(self, log_level: int, name: str, e: Exception = None, msg: str = "Not message") -> None:
         pass
+
+
+class FolderIndexABC(ABC):
+    """Local index of Bitrix disk folders: (parent folder id, normalized name) -> folder id"""
+
+    @abstractmethod
+    async def get_folder_id(self, parent_id: int, name: str) -> int | None:
+        pass
+
+    @abstractmethod
+    async def has_folder_index(self, parent_id: int) -> bool:
+        """True if the children of the folder are already in the index"""
+        pass
+
+    @abstractmethod
+    async def add_folder(self, parent_id: int, name: str, folder_id: int) -> None:
+        pass
+
+    @abstractmethod
+    async def replace_folders(self, parent_id: int, folders: dict[str, int]) -> None:
+        """Replaces all children of the folder in the index: {normalized name: folder id}"""
+        pass
@@ -41,3 +41,11 @@ class UserGroupRole:
     NEWER = "newer"
 
     ALL = {ALLWAYS, NEWER}
+
+
+class WebhookStatus:
+    NEW = "new"  # waiting for a worker (or for the next attempt)
+    PROCESSING = "processing"
+    DEAD = "dead"  # failed "max_attempts" times, kept for investigation
+
+    ALL = {NEW, PROCESSING, DEAD}
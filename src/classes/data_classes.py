@@ -26,3 +26,18 @@ class TaskInfo:
     manager: str | None
     observers: list[str] | None
     can_delete: bool
+    queue: tuple[int, int] | None = None  # (position, length) in the FIFO queue
+
+
+@dataclass()
+class SyncSummary:
+    """Changes made by a sync with Bitrix"""
+    added: int = 0
+    updated: int = 0
+    blocked: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.blocked or self.deleted)
@@ -11,6 +11,10 @@ from aiogram.client.default import DefaultBotProperties
 # Import models
 from src.classes.base import Singleton
 from src.bitrix import BitrixAPI, BitSync
+from src.bitrix.api.pool import HttpPool
+from src.bitrix.api.cache import ResponseCache
+from src.bitrix.sync.state import SyncState
+from src.bitrix.sync.webhook_queue import WebhookQueue
 from src.db.database import BitrixDB
 from src.classes.models import LogWriter, NotifyManager
 
@@ -66,14 +70,24 @@ class Config(Singleton):
             config_path=(self.configs_dir / "bitrix_conf.json"),
             logger=self.logger,
             max_retries=3,
-            retry_delay=5
+            retry_delay=5,
+            rate_limit=2.0,
+            rate_burst=50,
+            pool=HttpPool(limit_per_host=20, keepalive_timeout=30, dns_cache_ttl=300, timeout=60),
+            cache=ResponseCache(max_size=1000),
+            folder_index=self.bitrix_db
         )
         self.bit_sync = BitSync(
             bitrix_api=self.bitrix,
             db=self.bitrix_db,
             loger=self.logger
         )
-        self.bit_sync.setup_task_sync(notify_manager=self.notify_manager, bot=self.bot, log_chat_id=self.log_chat_id)
+        self.bit_sync.setup_task_sync(
+            notify_manager=self.notify_manager, bot=self.bot, log_chat_id=self.log_chat_id,
+            sync_state=SyncState(self.configs_dir / "sync_state.json"), update_quiet=2.0, update_max_delay=10.0
+        )
+        # ONTASKUPDATE events wait for the debounce window outside the workers, Bitrix calls are rate limited
+        self.webhook_queue = WebhookQueue(self.bit_sync, workers=4, max_attempts=5, retry_delay=30)
         self.task_export = TaskExport(self.bitrix_db)
 
     async def setup(self):
@@ -88,14 +102,20 @@ class Config(Singleton):
             print("\n\n---------------\nNo tables found. Run 'alembic upgrade head'\n---------------\n\n")
             sys.exit("No tables found. Run 'alembic upgrade head'")
 
+        await self.bitrix_db.rebuild_counters()
         await self.bitrix.create_session()
 
         bit_sync = asyncio.create_task(self.bit_sync.schedule_sync(run_hour=0, run_minute=0, chat_id=self.log_chat_id))
-        task_sync = asyncio.create_task(self.bit_sync.sync_tasks(check_time=3600))
+        task_sync = asyncio.create_task(self.bit_sync.sync_changed_tasks(period=60, look_back=3600))
+        # backstop for the incremental check: every open task is checked once a day
+        task_reconcile = asyncio.create_task(self.bit_sync.sync_tasks(check_time=86400))
+        webhook_queue = asyncio.create_task(self.webhook_queue.run())
         task_test_nfy = asyncio.create_task(self.bit_sync.notify_testing(10800, 10800))
         task_auto_acceptance = asyncio.create_task(self.bit_sync.auto_acceptance_tasks([5, 6], 9, 17, 3600))
         task_export = asyncio.create_task(self.task_export.schedule_send(self.notify_chat_id, self.bot, 18))
-        self.tasks += [bit_sync, task_sync, task_export, task_test_nfy, task_auto_acceptance]
+        self.tasks += [
+            bit_sync, task_sync, task_reconcile, webhook_queue, task_export, task_test_nfy, task_auto_acceptance
+        ]
 
     async def cleanup(self):
         for task in self.tasks:
@@ -0,0 +1,149 @@
+import asyncio
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from typing import Iterable, AsyncIterator
+
+from sqlalchemy import select, func, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Task, TaskUser
+
+
+@dataclass(frozen=True, slots=True)
+class TaskCount:
+    """What one task adds to the counters"""
+    stage_id: int | None
+    users: frozenset[tuple[int, str]] = frozenset()  # {(user_id, role)}
+
+    @classmethod
+    def of(cls, task: Task) -> "TaskCount":
+        """From a task with loaded "task_users" """
+        return cls(task.stage_id, frozenset((i.user_id, i.role) for i in task.task_users))
+
+
+class QueueCounters:
+    """
+    Live task counts per stage and per (user, role, stage), the limit checks read them instead of loading tasks.
+    A group queue is the sum of its "in_queue" stages.
+    BitrixDB applies its writes to the counters (the changed tasks before and after the write).
+    The snapshots lock the task rows, so concurrent writes of one task are counted one after another.
+    A write runs inside "writing" from the first snapshot to "apply", "rebuild" waits for the running writes
+    and holds new ones, so a write is either seen by the recount or applied after it, never both.
+    "rebuild" recounts everything from the DB: on start, after the sync, after cascade deletes and admin panel edits,
+    "drift" is the number of counts it had to fix (0 if the applied writes were right).
+    Until the first rebuild the counters are not "ready" and BitrixDB counts in the DB.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.stages: dict[int, int] = {}  # {stage_id: tasks}
+        self.users: dict[tuple[int, str, int], int] = {}  # {(user_id, role, stage_id): tasks}
+        self.drift = 0  # counts fixed by the last rebuild
+
+        self._writes = 0  # writes between the first snapshot and "apply"
+        self._no_writes = asyncio.Event()
+        self._no_writes.set()
+        self._rebuild_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def writing(self) -> AsyncIterator[None]:
+        """Wraps a write from the "before" snapshot to "apply" """
+        async with self._rebuild_lock:  # a running rebuild is finished first
+            self._writes += 1
+            self._no_writes.clear()
+        try:
+            yield
+        finally:
+            self._writes -= 1
+            if not self._writes:
+                self._no_writes.set()
+
+    @staticmethod
+    async def snapshot(session: AsyncSession, task_ids: Iterable[int]) -> list[TaskCount]:
+        """
+        Current counts of the tasks in the transaction of "session".
+        The task rows stay locked (FOR UPDATE) until the end of the transaction.
+        """
+        task_ids = {i for i in task_ids if i}
+        if not task_ids:
+            return []
+
+        result = await session.execute(
+            select(Task.id, Task.stage_id, TaskUser.user_id, TaskUser.role)
+            .outerjoin(TaskUser, TaskUser.task_id == Task.id)
+            .where(Task.id.in_(task_ids))
+            .with_for_update(of=Task)
+        )
+        tasks: dict[int, tuple[int | None, set]] = {}
+        for task_id, stage_id, user_id, role in result.all():
+            _, users = tasks.setdefault(task_id, (stage_id, set()))
+            if user_id:
+                users.add((user_id, role))
+
+        return [TaskCount(stage_id, frozenset(users)) for stage_id, users in tasks.values()]
+
+    def apply(self, before: Iterable[TaskCount] = (), after: Iterable[TaskCount] = ()) -> None:
+        if not self.ready:
+            return
+
+        for tasks, delta in ((before, -1), (after, 1)):
+            for task in tasks:
+                if task.stage_id is None:
+                    continue
+
+                self._add(self.stages, task.stage_id, delta)
+                for user_id, role in task.users:
+                    self._add(self.users, (user_id, role, task.stage_id), delta)
+
+    @classmethod
+    def of_tasks(cls, tasks: Iterable[TaskCount]) -> "QueueCounters":
+        """Counters of all "tasks", the same as "rebuild" counts in the DB"""
+        counters = cls()
+        counters.ready = True
+        counters.apply(after=tasks)
+        return counters
+
+    @staticmethod
+    def _add(counts: dict, key, delta: int) -> None:
+        value = counts.get(key, 0) + delta
+        if value > 0:
+            counts[key] = value
+        else:
+            counts.pop(key, None)
+
+    async def rebuild(self, session: AsyncSession) -> None:
+        async with self._rebuild_lock:
+            await self._no_writes.wait()
+
+            stages = await session.execute(
+                select(Task.stage_id, func.count(Task.id)).where(Task.stage_id.isnot(None)).group_by(Task.stage_id)
+            )
+            users = await session.execute(
+                select(TaskUser.user_id, TaskUser.role, Task.stage_id, func.count(distinct(Task.id)))
+                .join(Task, TaskUser.task_id == Task.id)
+                .where(Task.stage_id.isnot(None))
+                .group_by(TaskUser.user_id, TaskUser.role, Task.stage_id)
+            )
+            self.load(
+                {stage_id: count for stage_id, count in stages.all()},
+                {(user_id, role, stage_id): count for user_id, role, stage_id, count in users.all()}
+            )
+
+    def load(self, stages: dict[int, int], users: dict[tuple[int, str, int], int]) -> None:
+        """Replaces the counts with the recounted ones"""
+        if self.ready:
+            self.drift = self._diff(self.stages, stages) + self._diff(self.users, users)
+        self.stages = stages
+        self.users = users
+        self.ready = True
+
+    @staticmethod
+    def _diff(old: dict, new: dict) -> int:
+        return sum(1 for key in old.keys() | new.keys() if old.get(key, 0) != new.get(key, 0))
+
+    def stage_count(self, stage_ids: Iterable[int]) -> int:
+        return sum(self.stages.get(i, 0) for i in stage_ids)
+
+    def user_count(self, stage_ids: Iterable[int], user_id: int, role: str) -> int:
+        """Tasks in "stage_ids" where the user has the role"""
+        return sum(self.users.get((user_id, role, i), 0) for i in stage_ids)
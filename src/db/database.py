@@ -1,16 +1,21 @@
 import logging
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Sequence, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, Sequence, Optional
 
-from sqlalchemy import inspect, select, update, func, and_
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import inspect, select, update, delete, func, and_, distinct
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.sql import ColumnElement
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from .models import Base, User, Task, TaskUser, File, TaskGroup, Stage, Comment, Department, DepartmentUser, Role, \
-    UserRole, UserGroupRules, Region
-from src.classes.cls_const import TaskRole, StageType
+    UserRole, UserGroupRules, Region, FolderIndex, WebhookEvent
+from .counters import QueueCounters, TaskCount
+from src.classes.cls_const import TaskRole, StageType, WebhookStatus
+from src.classes.base.abc_cls import FolderIndexABC
 
 
 @dataclass()
@@ -22,7 +27,139 @@ class TaskUserRoles:
     observers: list[TaskUser] = None
 
 
-class BitrixDB:
+class TaskUnitOfWork:
+    """
+    Reads and writes of one task reconciliation in one session and one transaction (see BitrixDB.unit_of_work).
+    Writes are collected and applied by "commit": updates of the changed tasks and task users,
+    bulk delete and insert of task users and a single commit. Not for concurrent use.
+    """
+    # columns of Task written by "update_task" (the same as BitrixDB.update_task)
+    task_fields = (
+        "bit_task_id", "bit_chat_id", "bit_folder_id", "title", "description", "created_date", "queue_date",
+        "deadline", "test_date", "group_id", "stage_id", "closed_date", "allocated_time", "unlimited_test", "paid"
+    )
+
+    # columns of User written by "update_user" (a reconciliation only changes the ban)
+    user_fields = ("ban_time",)
+
+    def __init__(self, session: AsyncSession, counters: QueueCounters):
+        self.session = session
+        self.counters = counters
+        self.committed = False
+
+        self._users: dict[int, User | None] = {}  # {bit_user_id: user or None if not found}
+        self._tasks: dict[int, Task] = {}
+        self._update_users: dict[int, User] = {}
+        self._update_task_users: dict[int, TaskUser] = {}
+        self._delete_task_users: dict[int, TaskUser] = {}
+        self._add_task_users: list[TaskUser] = []
+
+    async def load_users(self, bit_ids: Iterable[int]) -> None:
+        """Loads the users that are not loaded yet in one query"""
+        bit_ids = {i for i in bit_ids if i and i not in self._users}
+        if not bit_ids:
+            return
+
+        result = await self.session.execute(select(User).filter(User.bit_user_id.in_(bit_ids)))
+        users = {user.bit_user_id: user for user in result.scalars().unique().all()}
+        for bit_id in bit_ids:
+            self._users[bit_id] = users.get(bit_id)
+
+    async def get_user(self, bit_id: int) -> User | None:
+        await self.load_users((bit_id,))
+        return self._users.get(bit_id)
+
+    async def get_task_stage(self, group_id: int = None, bit_stage_id: int = None) -> Sequence[Stage]:
+        query = select(Stage)
+        if bit_stage_id:
+            query = query.filter(Stage.bit_stage_id == bit_stage_id)
+        elif group_id:
+            query = query.filter(Stage.group_id == group_id)
+
+        result = await self.session.execute(query.order_by(Stage.sort))
+        return result.scalars().unique().all()
+
+    async def get_task_group(self, bit_group_id: int) -> TaskGroup | None:
+        result = await self.session.execute(select(TaskGroup).filter(TaskGroup.bit_group_id == bit_group_id))
+        return result.scalars().unique().first()
+
+    def update_task(self, task: Task) -> None:
+        self._tasks[task.id] = task
+
+    def update_user(self, user: User) -> None:
+        self._update_users[user.id] = user
+
+    def add_task_user(self, user: User, task_id: int, role: str) -> TaskUser:
+        """:return: task user with "user" set, it gets "id" on commit"""
+        task_user = TaskUser(user_id=user.id, task_id=task_id, role=role)
+        set_committed_value(task_user, "user", user)
+        self._add_task_users.append(task_user)
+        return task_user
+
+    def update_task_user(self, task_user: TaskUser, user: User) -> None:
+        """Gives the role of "task_user" to another user"""
+        task_user.user_id = user.id
+        set_committed_value(task_user, "user", user)
+        self._update_task_users[task_user.id] = task_user
+
+    def delete_task_user(self, task_user: TaskUser) -> None:
+        self._delete_task_users[task_user.id] = task_user
+
+    async def commit(self) -> bool:
+        task_ids = {
+            *self._tasks,
+            *(i.task_id for i in self._update_task_users.values()),
+            *(i.task_id for i in self._delete_task_users.values()),
+            *(i.task_id for i in self._add_task_users)
+        }
+        async with self.counters.writing():
+            await self._commit(task_ids)
+
+        return self.committed
+
+    async def _commit(self, task_ids: set[int]) -> None:
+        try:
+            before = await self.counters.snapshot(self.session, task_ids)
+
+            if self._tasks:
+                await self.session.execute(
+                    update(Task),
+                    [{"id": task.id, **{f: getattr(task, f) for f in self.task_fields}} for task in self._tasks.values()]
+                )
+
+            if self._update_users:
+                await self.session.execute(
+                    update(User),
+                    [
+                        {"id": user.id, **{f: getattr(user, f) for f in self.user_fields}}
+                        for user in self._update_users.values()
+                    ]
+                )
+
+            if self._update_task_users:
+                await self.session.execute(
+                    update(TaskUser),
+                    [{"id": i.id, "user_id": i.user_id, "role": i.role} for i in self._update_task_users.values()]
+                )
+
+            if self._delete_task_users:
+                await self.session.execute(delete(TaskUser).where(TaskUser.id.in_(self._delete_task_users)))
+
+            if self._add_task_users:
+                self.session.add_all(self._add_task_users)
+                await self.session.flush()
+
+            after = await self.counters.snapshot(self.session, task_ids)
+            await self.session.commit()
+            self.committed = True
+            self.counters.apply(before, after)
+
+        except Exception as e:
+            await self.session.rollback()
+            print(e)  # LOG
+
+
+class BitrixDB(FolderIndexABC):
     def __init__(self, url: str, echo: bool = False, logger: logging.Logger = None) -> None:
         self.engine = create_async_engine(url=url, echo=echo)
         self.session_factory = async_sessionmaker(
@@ -34,6 +171,8 @@ class BitrixDB:
         if logger:
             self.add_sqlalchemy_logging(logger)
 
+        self.counters = QueueCounters()
+
     @staticmethod
     def add_sqlalchemy_logging(logger: logging.Logger):
         logging.getLogger('sqlalchemy.engine').handlers.clear()  # Clear existing handlers
@@ -53,6 +192,28 @@ class BitrixDB:
 
             return await connection.run_sync(sync_check_tables)
 
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[TaskUnitOfWork]:
+        """
+        async with db.unit_of_work() as uow: ... - the collected writes are committed on exit,
+        nothing is written if the block raises. Check "uow.committed" after the block.
+        """
+        async with self.session_factory() as session:
+            uow = TaskUnitOfWork(session, self.counters)
+            yield uow
+            await uow.commit()
+
+    async def rebuild_counters(self) -> bool:
+        """Recounts QueueCounters from the DB"""
+        async with self.session_factory() as session:
+            try:
+                await self.counters.rebuild(session)
+                return True
+
+            except Exception as e:
+                print(e)  # LOG
+                return False
+
     async def select_info(self, info: Base | ColumnElement):
         async with self.session_factory() as session:
             query = select(info)
@@ -63,24 +224,32 @@ class BitrixDB:
                 print(e)  # LOG
 
     async def delete_info(self, selected_model, id_: int) -> bool:
-        async with self.session_factory() as session:
+        async with self.counters.writing(), self.session_factory() as session:
             try:
                 async with session.begin():
                     result = await session.execute(select(selected_model).filter(selected_model.id == id_))
                     ex = result.unique().scalar_one_or_none()
 
                     if ex:
+                        task_ids = [ex.id] if isinstance(ex, Task) else [ex.task_id] if isinstance(ex, TaskUser) else []
+                        before = await self.counters.snapshot(session, task_ids)
                         await session.delete(ex)
+                        await session.flush()
+                        after = await self.counters.snapshot(session, task_ids)
                     else:
                         return False
 
                 await session.commit()
-                return True
+                self.counters.apply(before, after)
 
             except Exception as e:
                 print(e)  # LOG
                 return False
 
+        if selected_model in (User, Stage, TaskGroup):  # tasks and task users are deleted or changed by cascade
+            await self.rebuild_counters()
+        return True
+
     async def add_user(self, full_name: str, access_level: str, tg_id: int = None, bit_user_id: int = None,
                        job_title: str = None, phone: str = None, language: str = None) -> Optional[User]:
         async with self.session_factory() as session:
@@ -133,6 +302,7 @@ class BitrixDB:
 
                 await session.commit()
                 await session.refresh(to_user)
+                await self.rebuild_counters()
                 return to_user
 
             except Exception as e:
@@ -184,6 +354,16 @@ class BitrixDB:
             except Exception as e:
                 print(e)  # LOG
 
+    async def get_users_by_bit_ids(self, bit_ids: Iterable[int]) -> Sequence[User] | None:
+        async with self.session_factory() as session:
+            query = select(User).where(User.bit_user_id.in_(set(bit_ids)))
+
+            try:
+                result = await session.execute(query)
+                return result.scalars().unique().all()  # noqa
+            except Exception as e:
+                print(e)  # LOG
+
     async def update_user(self, update_to: User, tg_id: int = None) -> Optional[User]:
         """Updates a user with the given user_id or tg_id"""
         async with self.session_factory() as session:
@@ -521,6 +701,9 @@ class BitrixDB:
                 return None
 
     async def get_stage_task_counts(self, stage_ids: list[int]) -> int:
+        if self.counters.ready:
+            return self.counters.stage_count(stage_ids)
+
         async with self.session_factory() as session:
             query = select(func.count(Task.id)).where(Task.stage_id.in_(stage_ids))
 
@@ -560,6 +743,25 @@ class BitrixDB:
                 print(e)  # LOG
                 return []
 
+    async def count_tasks_with(self, stage_ids: list[int], user_id: int, role: str) -> int:
+        """Number of tasks in "stage_ids" where the user has the role (for the limit checks)"""
+        if self.counters.ready:
+            return self.counters.user_count(stage_ids, user_id, role)
+
+        async with self.session_factory() as session:
+            query = (
+                select(func.count(distinct(Task.id)))
+                .join(Task.task_users)
+                .where(Task.stage_id.in_(stage_ids), TaskUser.user_id == user_id, TaskUser.role == role)
+            )
+
+            try:
+                result = await session.execute(query)
+                return result.scalar()
+            except Exception as e:
+                print(e)  # LOG
+                return 0
+
     async def get_tasks_for_report(
             self, user_id: Optional[int] = None, group_id: Optional[int] = None, stage_title: Optional[str] = None,
             created_from_dt: Optional[datetime] = None, created_to_dt: Optional[datetime] = None,
@@ -594,11 +796,12 @@ class BitrixDB:
                 return []
 
     async def add_task(self, task: Task) -> Optional[Task]:
-        async with self.session_factory() as session:
+        async with self.counters.writing(), self.session_factory() as session:
             try:
                 async with session.begin():
                     session.add(task)
                 await session.commit()
+                self.counters.apply(after=[TaskCount(task.stage_id)])  # before anything else can fail
                 await session.refresh(task)
                 return task
 
@@ -621,13 +824,14 @@ class BitrixDB:
                 print(e)  # LOG
 
     async def update_task(self, task: Task) -> Optional[Task]:
-        async with self.session_factory() as session:
+        async with self.counters.writing(), self.session_factory() as session:
             try:
                 async with session.begin():
-                    result = await session.execute(select(Task).filter_by(id=task.id))
+                    result = await session.execute(select(Task).filter_by(id=task.id).with_for_update(of=Task))
                     existing_task: Task = result.unique().scalar_one_or_none()
 
                     if existing_task:
+                        before = TaskCount.of(existing_task)
                         existing_task.bit_task_id = task.bit_task_id
                         existing_task.bit_chat_id = task.bit_chat_id
                         existing_task.bit_folder_id = task.bit_folder_id
@@ -643,11 +847,13 @@ class BitrixDB:
                         existing_task.allocated_time = task.allocated_time
                         existing_task.unlimited_test = task.unlimited_test
                         existing_task.paid = task.paid
+                        after = TaskCount(existing_task.stage_id, before.users)  # the task users are not changed
                     else:
                         print(f"Task with id {task.id} not found")  # LOG
                         return None
 
                 await session.commit()
+                self.counters.apply([before], [after])
                 await session.refresh(existing_task)
                 return existing_task
 
@@ -656,7 +862,7 @@ class BitrixDB:
                 return None
 
     async def add_task_user(self, user_id: int, task_id: int, role: str) -> Optional[TaskUser]:
-        async with self.session_factory() as session:
+        async with self.counters.writing(), self.session_factory() as session:
             task_user = TaskUser(
                 user_id=user_id,
                 task_id=task_id,
@@ -664,8 +870,12 @@ class BitrixDB:
             )
             try:
                 async with session.begin():
+                    before = await self.counters.snapshot(session, [task_id])
                     session.add(task_user)
+                    await session.flush()
+                    after = await self.counters.snapshot(session, [task_id])
                 await session.commit()
+                self.counters.apply(before, after)
                 await session.refresh(task_user)
                 return task_user
 
@@ -727,20 +937,24 @@ class BitrixDB:
         )
 
     async def update_task_user(self, task_user: TaskUser) -> Optional[TaskUser]:
-        async with self.session_factory() as session:
+        async with self.counters.writing(), self.session_factory() as session:
             try:
                 async with session.begin():
                     result = await session.execute(select(TaskUser).filter_by(id=task_user.id))
                     ex: TaskUser = result.unique().scalar_one_or_none()
 
                     if ex:
+                        before = await self.counters.snapshot(session, [ex.task_id])
                         ex.user_id = task_user.user_id
                         ex.role = task_user.role
+                        await session.flush()
+                        after = await self.counters.snapshot(session, [ex.task_id])
 
                     else:
                         return None
 
                 await session.commit()
+                self.counters.apply(before, after)
                 await session.refresh(ex)
                 return ex
 
@@ -905,7 +1119,7 @@ class BitrixDB:
             query = (
                 select(Task)
                 .where(Task.stage_id == stage[0].id)
-                .order_by(Task.queue_date)
+                .order_by(Task.queue_date, Task.id)
                 .limit(limit)
             )
 
@@ -915,6 +1129,47 @@ class BitrixDB:
             except Exception as e:
                 print(e)  # LOG
 
+    async def get_fifo_keys(self, stage_id: int) -> list[tuple[datetime, int]] | None:
+        """[(queue_date, task id), ...] of the FIFO stage in the queue order, no "queue_date" is the end of the queue"""
+        async with self.session_factory() as session:
+            query = (
+                select(Task.queue_date, Task.id)
+                .where(Task.stage_id == stage_id)
+                .order_by(Task.queue_date, Task.id)
+            )
+
+            try:
+                result = await session.execute(query)
+                return [(queue_date or datetime.max, id_) for queue_date, id_ in result.all()]
+            except Exception as e:
+                print(e)  # LOG
+
+    async def promote_fifo_task(self, task_id: int, from_stage_id: int, to_stage_id: int) -> Task | None:
+        """Moves the task to "to_stage_id" only if it is still in "from_stage_id" (not taken by another process)"""
+        async with self.counters.writing(), self.session_factory() as session:
+            try:
+                async with session.begin():
+                    before = await self.counters.snapshot(session, [task_id])
+                    result = await session.execute(
+                        update(Task)
+                        .where(Task.id == task_id, Task.stage_id == from_stage_id)
+                        .values(stage_id=to_stage_id)
+                        .returning(Task.id)
+                    )
+                    if result.scalar_one_or_none() is None:
+                        return None
+                    after = await self.counters.snapshot(session, [task_id])
+
+                await session.commit()
+                self.counters.apply(before, after)
+
+            except Exception as e:
+                print(e)  # LOG
+                return None
+
+        task = await self.get_task(id_=task_id)
+        return task[0] if task else None
+
     async def get_user_group_rules(
             self, user_id: int = None, group_id: int = None, observer: str = None, manager: str = None
     ) -> Sequence[UserGroupRules] | None:
@@ -938,3 +1193,255 @@ class BitrixDB:
                 return result.scalars().unique().all()
             except Exception as e:
                 print(e)  # LOG
+
+    async def get_folder_id(self, parent_id: int, name: str) -> int | None:
+        async with self.session_factory() as session:
+            query = select(FolderIndex.folder_id).filter(FolderIndex.parent_id == parent_id, FolderIndex.name == name)
+
+            try:
+                result = await session.execute(query)
+                return result.scalar_one_or_none()
+            except Exception as e:
+                print(e)  # LOG
+
+    async def has_folder_index(self, parent_id: int) -> bool:
+        async with self.session_factory() as session:
+            query = select(FolderIndex.id).filter(FolderIndex.parent_id == parent_id).limit(1)
+
+            try:
+                result = await session.execute(query)
+                return result.scalar_one_or_none() is not None
+            except Exception as e:
+                print(e)  # LOG
+                return False
+
+    async def add_folder(self, parent_id: int, name: str, folder_id: int) -> None:
+        async with self.session_factory() as session:
+            query = insert(FolderIndex).values(parent_id=parent_id, name=name, folder_id=folder_id)
+            query = query.on_conflict_do_update(
+                index_elements=[FolderIndex.parent_id, FolderIndex.name], set_={"folder_id": folder_id}
+            )
+
+            try:
+                async with session.begin():
+                    await session.execute(query)
+            except Exception as e:
+                print(e)  # LOG
+
+    async def replace_folders(self, parent_id: int, folders: dict[str, int]) -> None:
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    await session.execute(delete(FolderIndex).where(FolderIndex.parent_id == parent_id))
+                    if folders:
+                        await session.execute(
+                            insert(FolderIndex),
+                            [
+                                {"parent_id": parent_id, "name": name, "folder_id": folder_id}
+                                for name, folder_id in folders.items()
+                            ]
+                        )
+            except Exception as e:
+                print(e)  # LOG
+
+    async def sync_bitrix_users(self, users: list[dict], block_bit_ids: list[int], blocked_level: str) -> bool:
+        """
+        Adds and renames Bitrix users and blocks fired ones in one transaction
+        :param users: [{"bit_user_id": ..., "full_name": ..., "access_level": ...}, ...], "access_level" is set only
+        for new users, existing users get the new "full_name"
+        :param block_bit_ids: bit_user_id of the users to block
+        :param blocked_level: access level of the blocked users
+        """
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    if users:
+                        query = insert(User).values(users)
+                        query = query.on_conflict_do_update(
+                            index_elements=[User.bit_user_id], set_={"full_name": query.excluded.full_name}
+                        )
+                        await session.execute(query)
+
+                    if block_bit_ids:
+                        await session.execute(
+                            update(User).where(User.bit_user_id.in_(block_bit_ids)).values(access_level=blocked_level)
+                        )
+                return True
+
+            except Exception as e:
+                print(e)  # LOG
+                return False
+
+    async def sync_bitrix_departments(
+            self, departments: list[dict], parents: dict[int, int | None], add_heads: list[tuple[int, int]],
+            delete_head_ids: list[int], delete_ids: list[int]
+    ) -> bool:
+        """
+        Applies the department tree changes in one transaction, departments are referred to by bit_dep_id
+        because new departments get their id here.
+        :param departments: [{"bit_dep_id": ..., "name": ...}, ...] new and renamed departments
+        :param parents: {bit_dep_id: parent bit_dep_id or None} departments with a new parent
+        :param add_heads: [(bit_dep_id, user_id), ...]
+        :param delete_head_ids: DepartmentUser.id of the removed heads
+        :param delete_ids: Department.id of the removed departments
+        """
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    if departments:
+                        query = insert(Department).values(departments)
+                        query = query.on_conflict_do_update(
+                            index_elements=[Department.bit_dep_id], set_={"name": query.excluded.name}
+                        )
+                        await session.execute(query)
+
+                    bit_ids = set(parents) | {i for i in parents.values() if i} | {i[0] for i in add_heads}
+                    ids: dict[int, int] = {}
+                    if bit_ids:
+                        result = await session.execute(
+                            select(Department.bit_dep_id, Department.id).where(Department.bit_dep_id.in_(bit_ids))
+                        )
+                        ids = dict(result.tuples().all())
+
+                    if parents:
+                        await session.execute(
+                            update(Department),
+                            [
+                                {"id": ids[bit_id], "parent_id": ids.get(parent_bit_id)}
+                                for bit_id, parent_bit_id in parents.items()
+                            ]
+                        )
+
+                    if delete_head_ids:
+                        await session.execute(delete(DepartmentUser).where(DepartmentUser.id.in_(delete_head_ids)))
+
+                    if add_heads:
+                        await session.execute(
+                            insert(DepartmentUser),
+                            [
+                                {"department_id": ids[bit_id], "user_id": user_id, "head": True}
+                                for bit_id, user_id in add_heads
+                            ]
+                        )
+
+                    if delete_ids:
+                        await session.execute(delete(Department).where(Department.id.in_(delete_ids)))
+                return True
+
+            except Exception as e:
+                print(e)  # LOG
+                return False
+
+    async def sync_department_users(self, add: list[tuple[int, int]], delete_ids: list[int]) -> bool:
+        """
+        Adds and removes department employees (not heads) in one transaction
+        :param add: [(department_id, user_id), ...]
+        :param delete_ids: DepartmentUser.id of the removed employees
+        """
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    if delete_ids:
+                        await session.execute(delete(DepartmentUser).where(DepartmentUser.id.in_(delete_ids)))
+
+                    if add:
+                        await session.execute(
+                            insert(DepartmentUser),
+                            [
+                                {"department_id": department_id, "user_id": user_id, "head": False}
+                                for department_id, user_id in add
+                            ]
+                        )
+                return True
+
+            except Exception as e:
+                print(e)  # LOG
+                return False
+
+    async def add_webhook_event(self, event: str, data: dict, task_bit_id: int = None) -> WebhookEvent | None:
+        async with self.session_factory() as session:
+            now = datetime.now()
+            webhook_event = WebhookEvent(
+                event=event, task_bit_id=task_bit_id, data=data, status=WebhookStatus.NEW,
+                attempts=0, received_at=now, available_at=now
+            )
+            try:
+                async with session.begin():
+                    session.add(webhook_event)
+                return webhook_event
+
+            except Exception as e:
+                print(e)  # LOG
+
+    async def claim_webhook_events(self, limit: int = 1) -> Sequence[WebhookEvent]:
+        """Marks the oldest available events as processing and returns them (locked rows of other workers are skipped)"""
+        async with self.session_factory() as session:
+            query = select(WebhookEvent).where(
+                WebhookEvent.status == WebhookStatus.NEW, WebhookEvent.available_at <= datetime.now()
+            ).order_by(WebhookEvent.id).limit(limit).with_for_update(skip_locked=True)
+
+            try:
+                async with session.begin():
+                    events = (await session.execute(query)).scalars().all()
+                    for event in events:
+                        event.status = WebhookStatus.PROCESSING
+                        event.attempts += 1
+                return events
+
+            except Exception as e:
+                print(e)  # LOG
+                return []
+
+    async def delete_webhook_event(self, id_: int) -> None:
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    await session.execute(delete(WebhookEvent).where(WebhookEvent.id == id_))
+            except Exception as e:
+                print(e)  # LOG
+
+    async def release_webhook_event(
+            self, id_: int, status: str, error: str = None, available_at: datetime = None, attempts: int = None
+    ) -> None:
+        """Returns the event to the queue (WebhookStatus.NEW) or moves it to the dead events (WebhookStatus.DEAD)"""
+        async with self.session_factory() as session:
+            values = {"status": status, "error": error}
+            if available_at:
+                values["available_at"] = available_at
+            if attempts is not None:
+                values["attempts"] = attempts
+
+            try:
+                async with session.begin():
+                    await session.execute(update(WebhookEvent).where(WebhookEvent.id == id_).values(**values))
+            except Exception as e:
+                print(e)  # LOG
+
+    async def reset_webhook_events(self) -> int:
+        """Returns the events of the stopped workers (status "processing") to the queue"""
+        async with self.session_factory() as session:
+            try:
+                async with session.begin():
+                    result = await session.execute(
+                        update(WebhookEvent).where(WebhookEvent.status == WebhookStatus.PROCESSING)
+                        .values(status=WebhookStatus.NEW)
+                    )
+                return result.rowcount
+
+            except Exception as e:
+                print(e)  # LOG
+                return 0
+
+    async def get_webhook_queue_info(self) -> dict[str, tuple[int, datetime | None]]:
+        """{status: (events, received_at of the oldest event)}"""
+        async with self.session_factory() as session:
+            query = select(
+                WebhookEvent.status, func.count(WebhookEvent.id), func.min(WebhookEvent.received_at)
+            ).group_by(WebhookEvent.status)
+
+            try:
+                result = await session.execute(query)
+                return {status: (count, oldest) for status, count, oldest in result.all()}
+            except Exception as e:
+                print(e)  # LOG
+                return {}
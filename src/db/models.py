@@ -62,7 +62,7 @@ class User(Base):
     __tablename__ = "users"
 
     tg_id: Mapped[int] = mapped_column(sa.BigInteger, unique=True, nullable=True)
-    bit_user_id: Mapped[int] = mapped_column(unique=False, nullable=True)
+    bit_user_id: Mapped[int] = mapped_column(unique=True, nullable=True)
     full_name: Mapped[str] = mapped_column(unique=False, nullable=False)
     job_title: Mapped[str] = mapped_column(unique=False, nullable=True)
     phone: Mapped[str] = mapped_column(unique=False, nullable=True)
@@ -196,6 +196,7 @@ class Stage(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (sa.Index("ix_tasks_stage_id_queue_date", "stage_id", "queue_date"),)  # FIFO queue order
 
     bit_task_id: Mapped[int] = mapped_column(unique=True, nullable=True)
     bit_chat_id: Mapped[int] = mapped_column(unique=True, nullable=True)
@@ -329,4 +330,35 @@ class Region(Base):
 
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class FolderIndex(Base):
+    """Bitrix disk folders by name, so Storage.create_folder does not have to list the parent folder"""
+    __tablename__ = "folder_index"
+    __table_args__ = (sa.UniqueConstraint("parent_id", "name"),)
+
+    parent_id: Mapped[int] = mapped_column(sa.Integer, unique=False, nullable=False)
+    name: Mapped[str] = mapped_column(sa.String, unique=False, nullable=False)  # Storage.normalize_folder_name
+    folder_id: Mapped[int] = mapped_column(sa.Integer, unique=False, nullable=False)
+
+    def __str__(self):
+        return self.name
+
+
+class WebhookEvent(Base):
+    """Bitrix webhook waiting to be processed (processed events are deleted)"""
+    __tablename__ = "webhook_events"
+    __table_args__ = (sa.Index("ix_webhook_events_status_available_at", "status", "available_at"),)
+
+    event: Mapped[str] = mapped_column(sa.String, unique=False, nullable=False)
+    task_bit_id: Mapped[int] = mapped_column(sa.Integer, unique=False, nullable=True)
+    data: Mapped[dict] = mapped_column(sa.JSON, unique=False, nullable=False)
+    status: Mapped[str] = mapped_column(sa.String, unique=False, nullable=False)  # WebhookStatus
+    attempts: Mapped[int] = mapped_column(sa.Integer, default=0, unique=False, nullable=False)
+    received_at: Mapped[datetime] = mapped_column(sa.DateTime, unique=False, nullable=False)
+    available_at: Mapped[datetime] = mapped_column(sa.DateTime, unique=False, nullable=False)  # next attempt
+    error: Mapped[str | None] = mapped_column(sa.Text, unique=False, nullable=True)
+
+    def __str__(self):
+        return f"{self.event} {self.task_bit_id}"
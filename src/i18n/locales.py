@@ -70,7 +70,8 @@ translations = {
         "task.file_err": "❗️Ошибка загрузки файла",
         "task.upload": "🚀Загрузка...",
         "task.done": "✅Задача успешно создана.",
-        "task.err": "❌Ошибка загрузки задачи."
+        "task.err": "❌Ошибка загрузки задачи.",
+        "bitrix_unavailable": "⚠️Битрикс сейчас недоступен, попробуйте позже."
 
     },
 
@@ -138,6 +139,7 @@ translations = {
         "task.file_err": "❗️Fayl yuklashda xatolik",
         "task.upload": "🚀Yuklanmoqda...",
         "task.done": "✅Vazifa/Taklif muvaffaqiyatli yaratildi.",
-        "task.err": "❌Vazifa/Taklif yuklashda xatolik."
+        "task.err": "❌Vazifa/Taklif yuklashda xatolik.",
+        "bitrix_unavailable": "⚠️Bitrix hozir ishlamayapti, keyinroq urinib ko'ring."
     }
 }
\ No newline at end of file
@@ -46,6 +46,7 @@ class MyTaskANS:
 📍 Регион: <b>{region}</b>
 🔍 Текущий статус: <b>{stage}</b>
 """
+    QUEUE_POSITION = "{stage} (место в очереди: {position} из {total})"
     LIST_INFO = """--------------- <b>{id}</b> ---------------
 📋 {name}
 👤 Заказчик: <b>{creator}</b>
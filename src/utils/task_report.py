@@ -14,6 +14,8 @@ from aiogram import Bot
 from aiogram.types import BufferedInputFile
 
 from src.bitrix.api.bitrix import BitrixAPI
+from src.bitrix.api.limiter import Priority, request_priority
+from src.bitrix.api.metrics import Subsystem, request_subsystem
 from src.classes.cls_const import TaskRole, StageType
 from src.db.database import BitrixDB
 from src.db.models import TaskUser, Stage
@@ -46,6 +48,8 @@ class TaskExport:
             sleep_duration = (target_time - now).total_seconds()
             await asyncio.sleep(sleep_duration)
 
+        request_priority.set(Priority.BACKGROUND)
+        request_subsystem.set(Subsystem.REPORT)
         while True:
             await sleep_until(run_hour, run_minute)
             await self.send_stat(chat_id, bot)
@@ -1,18 +1,45 @@
 import asyncio
-from typing import Sequence
+from typing import Sequence, IO, AsyncGenerator
 from logging import ERROR
 
 from aiogram import Bot
-from aiogram.types import InputMediaDocument, BufferedInputFile
+from aiogram.types import InputMediaDocument, BufferedInputFile, InputFile
 
 from src.db.models import Stage, Task
 
 from src.i18n.i18n import translate as _
 
 
-async def get_file_id(bot: Bot, chat_id: int | str, file: bytes, file_name: str, delete=True) -> str:
-    """delete: if True, delete the file from chat"""
-    file = BufferedInputFile(file=file, filename=file_name)
+class FileObjectInputFile(InputFile):
+    """Sends an open binary file (e.g. from Storage.download_file_stream) in chunks, without copying it to bytes"""
+
+    def __init__(self, file: IO[bytes], filename: str, **kwargs):
+        super().__init__(filename=filename, **kwargs)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+async def telegram_file_stream(bot: Bot, file_id: str, chunk_size: int = 64 * 1024) -> AsyncGenerator[bytes, None]:
+    """Downloads the file from telegram in chunks, the download starts on the first iteration"""
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url=url, timeout=300, chunk_size=chunk_size):
+        yield chunk
+
+
+async def get_file_id(bot: Bot, chat_id: int | str, file: bytes | IO[bytes], file_name: str, delete=True) -> str:
+    """
+    file: bytes or an open binary file
+    delete: if True, delete the file from chat
+    """
+    if isinstance(file, bytes):
+        file = BufferedInputFile(file=file, filename=file_name)
+    else:
+        file = FileObjectInputFile(file=file, filename=file_name)
     message = await bot.send_document(chat_id=chat_id, document=file)
     file_id = message.document.file_id
 
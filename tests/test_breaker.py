@@ -0,0 +1,68 @@
+"""
+CircuitBreaker: closed -> open after the failures in a row, half-open probe, closed again after a success.
+Run from the project root: python -m pytest tests
+"""
+import pytest
+
+from src.bitrix.api import breaker as breaker_module
+from src.bitrix.api.breaker import BitrixUnavailable, BreakerState, CircuitBreaker
+
+
+@pytest.fixture()
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(breaker_module, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_failures_in_a_row(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    assert not breaker.on_failure()
+    assert not breaker.on_failure()
+    breaker.on_success()  # the count starts again
+    assert not breaker.on_failure()
+    assert not breaker.on_failure()
+    assert breaker.state == BreakerState.CLOSED and breaker.is_available
+    breaker.before_request()
+
+    assert breaker.on_failure()
+    assert breaker.state == BreakerState.OPEN and not breaker.is_available
+    with pytest.raises(BitrixUnavailable) as e:
+        breaker.before_request()
+    assert e.value.retry_after == 30
+    with pytest.raises(BitrixUnavailable):
+        breaker.check()
+
+
+def test_half_open_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.on_failure()
+
+    clock[0] += 30
+    assert breaker.state == BreakerState.HALF_OPEN
+    breaker.check()  # does not raise, a probe may be sent
+    breaker.before_request()  # the probe
+    with pytest.raises(BitrixUnavailable):
+        breaker.before_request()  # only one probe at a time
+
+    clock[0] += 30  # the probe hangs, it is replaced
+    breaker.before_request()
+
+
+def test_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.on_failure()
+
+    clock[0] += 30
+    breaker.before_request()
+    assert not breaker.on_failure()  # opened again, not by this failure
+    assert breaker.state == BreakerState.OPEN
+    with pytest.raises(BitrixUnavailable):
+        breaker.before_request()
+
+    clock[0] += 30
+    breaker.before_request()
+    breaker.on_success()
+    assert breaker.state == BreakerState.CLOSED and breaker.failures == 0
+    breaker.before_request()
@@ -0,0 +1,97 @@
+"""
+ResponseCache: TTL, LRU eviction and invalidation by tags.
+Run from the project root: python -m pytest tests
+"""
+import pytest
+
+from src.bitrix.api import cache as cache_module
+from src.bitrix.api.cache import ResponseCache, canonical_params
+
+
+@pytest.fixture()
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "monotonic", lambda: now[0])
+    return now
+
+
+def task_response(task_id: int) -> dict:
+    return {"result": {"task": {"id": str(task_id)}}}
+
+
+def test_params_key_does_not_depend_on_order():
+    assert canonical_params({"a": 1, "b": 2}) == canonical_params({"b": 2, "a": 1})
+    assert canonical_params(None) == canonical_params({})
+
+
+def test_only_listed_methods_are_cached(clock):
+    cache = ResponseCache(ttls={"task.stages.get": 0})
+    assert cache.is_cached("tasks.task.get")
+    assert not cache.is_cached("user.get")
+    assert not cache.is_cached("task.stages.get")
+
+    cache.set("user.get", None, {"result": []})
+    cache.set("task.stages.get", {"entityId": 1}, {"result": {}})
+    cache.set("tasks.task.get", {"taskId": 1}, {"error": "ACCESS_DENIED"})
+    assert cache.stats().size == 0
+
+
+def test_ttl(clock):
+    cache = ResponseCache()
+    cache.set("tasks.task.get", {"taskId": 1}, task_response(1))
+
+    clock[0] += ResponseCache.ttls["tasks.task.get"] - 1
+    assert cache.get("tasks.task.get", {"taskId": 1}) == task_response(1)
+
+    clock[0] += 2
+    assert cache.get("tasks.task.get", {"taskId": 1}) is None
+    stats = cache.stats()
+    assert (stats.size, stats.hits, stats.misses) == (0, 1, 1)
+    assert stats.hit_ratio == 0.5
+
+
+def test_response_is_copied(clock):
+    cache = ResponseCache()
+    cache.set("tasks.task.get", {"taskId": 1}, task_response(1))
+    cache.get("tasks.task.get", {"taskId": 1})["result"]["task"]["id"] = "2"
+    assert cache.get("tasks.task.get", {"taskId": 1}) == task_response(1)
+
+
+def test_lru_eviction(clock):
+    cache = ResponseCache(max_size=2)
+    cache.set("tasks.task.get", {"taskId": 1}, task_response(1))
+    cache.set("tasks.task.get", {"taskId": 2}, task_response(2))
+    assert cache.get("tasks.task.get", {"taskId": 1})  # 2 is the least recently used now
+
+    cache.set("tasks.task.get", {"taskId": 3}, task_response(3))
+    assert cache.stats().size == 2
+    assert cache.get("tasks.task.get", {"taskId": 2}) is None
+    assert cache.get("tasks.task.get", {"taskId": 1}) == task_response(1)
+    assert cache.get("tasks.task.get", {"taskId": 3}) == task_response(3)
+
+    cache.invalidate_task(2)  # the tag of the evicted response is removed too
+    assert cache.stats().invalidations == 0
+
+
+def test_invalidation(clock):
+    cache = ResponseCache()
+    cache.set("tasks.task.get", {"taskId": 1, "select": ["ID"]}, task_response(1))
+    cache.set("tasks.task.get", {"taskId": 1, "select": ["*"]}, task_response(1))
+    cache.set("tasks.task.get", {"taskId": 2}, task_response(2))
+    cache.set("disk.folder.getchildren", {"id": 7}, {"result": []})
+
+    cache.on_call("tasks.task.update", {"taskId": "1", "fields": {}})
+    assert cache.get("tasks.task.get", {"taskId": 1, "select": ["ID"]}) is None
+    assert cache.get("tasks.task.get", {"taskId": 1, "select": ["*"]}) is None
+    assert cache.get("tasks.task.get", {"taskId": 2}) == task_response(2)
+    assert cache.stats().invalidations == 2
+
+    cache.on_call("user.get", {"id": 7})  # not a write method
+    cache.on_call("disk.folder.uploadfile", {"name": "a.txt"})  # no object id
+    assert cache.get("disk.folder.getchildren", {"id": 7}) == {"result": []}
+
+    cache.on_call("disk.folder.uploadfile", {"id": 7})
+    assert cache.get("disk.folder.getchildren", {"id": 7}) is None
+
+    cache.clear()
+    assert cache.stats().size == 0
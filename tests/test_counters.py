@@ -0,0 +1,170 @@
+"""
+QueueCounters: sequences of writes applied to the counters must give the same counts as a recount.
+Run from the project root: python -m pytest tests
+"""
+import random
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from src.db.counters import QueueCounters, TaskCount  # noqa: E402
+
+ROLES = ("creator", "executor", "manager", "observer")
+
+
+class FakeResult:
+    def __init__(self, rows: list):
+        self.rows = rows
+
+    def all(self) -> list:
+        return self.rows
+
+
+class FakeSession:
+    """Returns the rows of the two "rebuild" queries"""
+
+    def __init__(self, stages: list, users: list):
+        self.results = [stages, users]
+
+    async def execute(self, query) -> FakeResult:
+        return FakeResult(self.results.pop(0))
+
+
+class FakeTasks:
+    """Tasks in the DB, every write is applied to "counters" like BitrixDB does (before and after snapshots)"""
+
+    def __init__(self, counters: QueueCounters):
+        self.counters = counters
+        self.tasks: dict[int, TaskCount] = {}
+        self.next_id = 1
+
+    def write(self, task_id: int, task: TaskCount | None) -> None:
+        before = [self.tasks[task_id]] if task_id in self.tasks else []
+        if task is None:
+            self.tasks.pop(task_id, None)
+        else:
+            self.tasks[task_id] = task
+        self.counters.apply(before, [task] if task else [])
+
+    def add(self, stage_id: int) -> int:
+        task_id, self.next_id = self.next_id, self.next_id + 1
+        self.write(task_id, TaskCount(stage_id))
+        return task_id
+
+    def move(self, task_id: int, stage_id: int | None) -> None:
+        self.write(task_id, TaskCount(stage_id, self.tasks[task_id].users))
+
+    def add_user(self, task_id: int, user_id: int, role: str) -> None:
+        task = self.tasks[task_id]
+        self.write(task_id, TaskCount(task.stage_id, task.users | {(user_id, role)}))
+
+    def delete_user(self, task_id: int, user_id: int, role: str) -> None:
+        task = self.tasks[task_id]
+        self.write(task_id, TaskCount(task.stage_id, task.users - {(user_id, role)}))
+
+    def delete(self, task_id: int) -> None:
+        self.write(task_id, None)
+
+    def assert_recounted(self) -> None:
+        recount = QueueCounters.of_tasks(self.tasks.values())
+        assert self.counters.stages == recount.stages
+        assert self.counters.users == recount.users
+
+
+def ready_counters() -> QueueCounters:
+    counters = QueueCounters()
+    counters.load({}, {})
+    return counters
+
+
+def test_add_move_delete():
+    db = FakeTasks(ready_counters())
+    first = db.add(stage_id=1)
+    second = db.add(stage_id=1)
+    db.add_user(first, user_id=10, role="creator")
+    db.add_user(second, user_id=10, role="creator")
+    db.add_user(second, user_id=11, role="executor")
+    db.assert_recounted()
+    assert db.counters.stage_count([1]) == 2
+    assert db.counters.user_count([1], 10, "creator") == 2
+
+    db.move(first, stage_id=2)
+    db.assert_recounted()
+    assert db.counters.stage_count([1]) == 1
+    assert db.counters.stage_count([1, 2]) == 2
+    assert db.counters.user_count([2], 10, "creator") == 1
+
+    db.move(second, stage_id=None)  # tasks without a stage are not counted
+    db.delete_user(first, user_id=10, role="creator")
+    db.delete(first)
+    db.assert_recounted()
+    assert db.counters.stages == {}
+    assert db.counters.users == {}
+
+
+def test_random_sequences():
+    rnd = random.Random(24)
+    db = FakeTasks(ready_counters())
+    for _ in range(2000):
+        action = rnd.random()
+        if not db.tasks or action < 0.2:
+            db.add(stage_id=rnd.randint(1, 5))
+            continue
+
+        task_id = rnd.choice(list(db.tasks))
+        if action < 0.5:
+            db.move(task_id, stage_id=rnd.choice([None, 1, 2, 3, 4, 5]))
+        elif action < 0.7:
+            db.add_user(task_id, user_id=rnd.randint(1, 8), role=rnd.choice(ROLES))
+        elif action < 0.85 and db.tasks[task_id].users:
+            db.delete_user(task_id, *rnd.choice(sorted(db.tasks[task_id].users)))
+        else:
+            db.delete(task_id)
+
+    db.assert_recounted()
+
+
+def test_not_ready_counters_are_not_changed():
+    counters = QueueCounters()
+    counters.apply(after=[TaskCount(1, frozenset({(10, "creator")}))])
+    assert not counters.ready
+    assert counters.stages == {} and counters.users == {}
+
+
+def test_rebuild_reports_drift():
+    counters = QueueCounters()
+    asyncio.run(counters.rebuild(FakeSession([(1, 2)], [(10, "creator", 1, 2)])))
+    assert counters.ready and counters.drift == 0
+    assert counters.stage_count([1]) == 2
+
+    counters.apply(after=[TaskCount(1)])  # a write the recount does not find
+    asyncio.run(counters.rebuild(FakeSession([(1, 2)], [(10, "creator", 1, 2)])))
+    assert counters.drift == 1
+    assert counters.stage_count([1]) == 2
+
+
+def test_rebuild_waits_for_running_writes():
+    async def run() -> None:
+        counters = ready_counters()
+        async with counters.writing():
+            rebuild = asyncio.create_task(counters.rebuild(FakeSession([(1, 1)], [])))
+            await asyncio.sleep(0.01)
+            assert not rebuild.done()  # the write is not applied yet
+
+            counters.apply(after=[TaskCount(1)])
+
+        await rebuild
+        assert counters.stage_count([1]) == 1
+        assert counters.drift == 0
+
+        # a write started during the rebuild waits for it and is applied to the recounted counts
+        rebuild = asyncio.create_task(counters.rebuild(FakeSession([(1, 1)], [])))
+        await asyncio.sleep(0)
+        async with counters.writing():
+            assert rebuild.done()
+            counters.apply(after=[TaskCount(1)])
+        assert counters.stage_count([1]) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,139 @@
+"""
+Smoke test of the Bitrix client against the local fake server (src/bitrix/fake_server.py).
+Run from the project root: python -m pytest tests
+"""
+import json
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager, aclosing
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from src.bitrix.api.bitrix import BitrixAPI  # noqa: E402
+from src.bitrix.api.cache import ResponseCache  # noqa: E402
+from src.bitrix.fake_server import FakeBitrix, FakeState  # noqa: E402
+
+USERS = 120  # three pages of user.get
+TASKS = 120
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def serve(tmp_path, latency: float = 0.0, jitter: float = 0.0, cache: ResponseCache = None, tasks: int = 0):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    fake = FakeBitrix(
+        FakeState.generate(users=USERS, tasks=tasks), latency=latency, jitter=jitter, rate=0, base_url=base_url
+    )
+    runner = await fake.start(port=port)
+
+    # filled config, so create_session does not configure the client
+    config_path = tmp_path / "bitrix_conf.json"
+    config_path.write_text(json.dumps({
+        "domain": base_url, "current_id": 1, "current_full_name": "Bot Bitrix", "user_storage_id": 1
+    }))
+    bitrix = BitrixAPI(f"{base_url}/rest/1/token/", config_path=config_path, max_retries=1, retry_delay=0, cache=cache)
+
+    try:
+        yield fake, bitrix
+    finally:
+        await bitrix.close()
+        await runner.cleanup()
+
+
+async def smoke(tmp_path) -> None:
+    async with serve(tmp_path) as (fake, bitrix):
+        current = await bitrix.call_method("user.current")
+        assert current["result"]["ID"] == "1"
+
+        pages = [page async for page in bitrix.paginate("user.get", params={"sort": "ID"})]
+        assert len(pages) == 3
+        assert [int(user["ID"]) for page in pages for user in page] == list(range(1, USERS + 1))
+
+        results = await bitrix.call_batch([
+            ("user.current", None),
+            ("user.get", {"sort": "ID", "start": 50}),
+            ("unknown.method", None),
+        ])
+        assert results[0]["result"]["ID"] == "1"
+        assert len(results[1]["result"]) == 50
+        assert results[1]["total"] == USERS and results[1]["next"] == 100
+        assert results[2]["error"] == "ERROR_METHOD_NOT_FOUND"
+
+        assert fake.stats["methods"]["batch"] == 1
+
+
+async def single_flight(tmp_path) -> None:
+    # user.get is not cached, concurrent reads still share one request
+    async with serve(tmp_path, latency=0.2, cache=ResponseCache()) as (fake, bitrix):
+        first, second = await asyncio.gather(
+            bitrix.call_method("user.get", {"sort": "ID"}),
+            bitrix.call_method("user.get", {"sort": "ID"}),
+        )
+        assert first == second
+        assert fake.stats["methods"]["user.get"] == 1
+        assert bitrix.coalesced == 1
+
+
+async def paging(tmp_path) -> None:
+    # pages come back in random order, they are returned in the order of "start"
+    async with serve(tmp_path, jitter=0.1) as (fake, bitrix):
+        for _ in range(3):
+            pages = [page async for page in bitrix.paginate("user.get", params={"sort": "ID"})]
+            assert [int(user["ID"]) for page in pages for user in page] == list(range(1, USERS + 1))
+
+        # the requests of the pages not read are cancelled
+        async with aclosing(bitrix.paginate("user.get", params={"sort": "ID"})) as pages:
+            async for page in pages:
+                if int(page[0]["ID"]) > 1:
+                    break
+
+        await asyncio.sleep(0)
+        assert not [t for t in asyncio.all_tasks() if t.get_coro().__name__ == "get_page" and not t.done()]
+
+
+async def changed_tasks(tmp_path) -> None:
+    async with serve(tmp_path, tasks=TASKS) as (fake, bitrix):
+        hour_ago = (datetime.now().astimezone() - timedelta(hours=1)).isoformat(timespec="seconds")
+        for task in fake.state.tasks.values():
+            task["changedDate"] = hour_ago
+
+        # tasks changed during the scan do not shift the pages
+        ids = []
+        async for tasks in bitrix.iter_changed_tasks(hour_ago):
+            if not ids:
+                for task in tasks:
+                    fake.state.touch_task(int(task["id"]))
+            ids += [int(task["id"]) for task in tasks]
+
+        assert sorted(ids) == sorted(fake.state.tasks)
+        assert fake.stats["methods"]["tasks.task.list"] == TASKS // 50 + 1
+
+        # the changed tasks are returned by the next call
+        last_change = max(task["changedDate"] for task in fake.state.tasks.values())
+        ids = [int(task["id"]) async for tasks in bitrix.iter_changed_tasks(last_change) for task in tasks]
+        assert len(ids) == 50
+
+
+def test_bitrix_against_fake_server(tmp_path):
+    asyncio.run(smoke(tmp_path))
+
+
+def test_uncached_reads_share_one_request(tmp_path):
+    asyncio.run(single_flight(tmp_path))
+
+
+def test_paginate_keeps_page_order(tmp_path):
+    asyncio.run(paging(tmp_path))
+
+
+def test_changed_tasks_are_not_skipped(tmp_path):
+    asyncio.run(changed_tasks(tmp_path))
@@ -0,0 +1,159 @@
+"""
+FifoQueue: positions in the queue, promotion of the head and its revert when Bitrix fails.
+Run from the project root: python -m pytest tests
+"""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("sqlalchemy", "aiohttp", "aiogram", "openpyxl", "pandas", "matplotlib"):
+    pytest.importorskip(module)
+
+from src.bitrix.api.breaker import BitrixUnavailable  # noqa: E402
+from src.bitrix.sync.fifo import FifoQueue  # noqa: E402
+from src.classes.cls_const import StageType  # noqa: E402
+from src.db.counters import QueueCounters  # noqa: E402
+
+DEV = SimpleNamespace(id=1, bit_stage_id=101, sort=100, stage_type=StageType.DEVELOP, in_queue=True)
+FIFO = SimpleNamespace(id=2, bit_stage_id=102, sort=200, stage_type=StageType.FIFO, in_queue=True)
+TESTING = SimpleNamespace(id=3, bit_stage_id=103, sort=300, stage_type=StageType.TESTING, in_queue=True)
+DONE = SimpleNamespace(id=4, bit_stage_id=104, sort=400, stage_type=StageType.WAIT, in_queue=False)
+STAGES = [DEV, FIFO, TESTING, DONE]
+GROUP = SimpleNamespace(id=1, max_tasks=2, fifo_queue=True, notify=False)
+START = datetime(2026, 1, 1)
+
+
+class FakeDB:
+    """Tasks of one group, the FIFO queries work like BitrixDB"""
+
+    def __init__(self):
+        self.counters = QueueCounters()  # not loaded, the queues are checked only by FifoQueue itself
+        self.tasks: dict[int, SimpleNamespace] = {}
+        self.promoted: list[tuple[int, int, int]] = []
+
+    def add(self, task_id: int, stage, queue_date: datetime = None) -> SimpleNamespace:
+        task = SimpleNamespace(
+            id=task_id, bit_task_id=task_id * 10, title=f"task {task_id}", group_id=GROUP.id, group=GROUP,
+            stage_id=stage.id, stage=stage, queue_date=queue_date
+        )
+        self.tasks[task_id] = task
+        return task
+
+    def move(self, task_id: int, stage) -> None:
+        self.tasks[task_id].stage_id, self.tasks[task_id].stage = stage.id, stage
+
+    async def get_fifo_keys(self, stage_id: int) -> list[tuple[datetime, int]]:
+        return sorted(FifoQueue.key(t) for t in self.tasks.values() if t.stage_id == stage_id)
+
+    async def get_stage_task_counts(self, stage_ids: list[int]) -> int:
+        return sum(1 for t in self.tasks.values() if t.stage_id in stage_ids)
+
+    async def promote_fifo_task(self, task_id: int, from_stage_id: int, to_stage_id: int):
+        task = self.tasks.get(task_id)
+        if not task or task.stage_id != from_stage_id:
+            return None
+        self.move(task_id, next(s for s in STAGES if s.id == to_stage_id))
+        self.promoted.append((task_id, from_stage_id, to_stage_id))
+        return task
+
+
+class FakeBitrix:
+    def __init__(self, result=True):
+        self.result = result
+        self.updates: list[tuple[int, int]] = []
+
+    async def update_task(self, bit_task_id: int, bit_stage_id: int):
+        self.updates.append((bit_task_id, bit_stage_id))
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeLogger:
+    def __init__(self):
+        self.errors = []
+
+    async def send_log(self, level, place, e=None, msg=None) -> None:
+        self.errors.append((place, msg))
+
+
+def make_queue(result=True) -> tuple[FifoQueue, FakeDB]:
+    db = FakeDB()
+    for task_id in (1, 2, 3):  # the queue order is 2, 3, 1
+        db.add(task_id, FIFO, START + timedelta(hours=(task_id + 1) % 3))
+    db.add(4, DEV, START)
+    bit_sync = SimpleNamespace(db=db, bitrix=FakeBitrix(result), logger=FakeLogger())
+    return FifoQueue(bit_sync), db
+
+
+def test_position():
+    async def run() -> None:
+        fifo, db = make_queue()
+        assert [await fifo.position(db.tasks[i]) for i in (1, 2, 3)] == [(3, 3), (1, 3), (2, 3)]
+        assert await fifo.position(db.tasks[4]) is None  # not in the FIFO stage
+        assert await fifo.head(GROUP.id, STAGES) == 2
+
+        # the task was moved by another process, the cached queue is reloaded
+        db.add(5, FIFO)
+        assert await fifo.position(db.tasks[5]) == (4, 4)
+
+    asyncio.run(run())
+
+
+def test_pop_and_promote():
+    async def run() -> None:
+        fifo, db = make_queue()
+        assert await fifo.head(GROUP.id, STAGES) == 2
+        db.move(2, DONE)  # the head left the stage, the queue in memory is old
+
+        promoted = await fifo.pop_and_promote(GROUP, STAGES)
+        assert promoted is db.tasks[3]
+        assert db.promoted == [(3, FIFO.id, TESTING.id)]
+        assert fifo.bit_sync.bitrix.updates == [(30, TESTING.bit_stage_id)]
+        assert await fifo.head(GROUP.id, STAGES) == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("result", [None, RuntimeError("bitrix"), BitrixUnavailable(10)])
+def test_failed_promotion_is_reverted(result):
+    async def run() -> None:
+        fifo, db = make_queue(result)
+        if isinstance(result, BitrixUnavailable):
+            with pytest.raises(BitrixUnavailable):
+                await fifo.pop_and_promote(GROUP, STAGES)
+        else:
+            assert await fifo.pop_and_promote(GROUP, STAGES) is None
+
+        assert db.promoted == [(2, FIFO.id, TESTING.id), (2, TESTING.id, FIFO.id)]
+        assert db.tasks[2].stage_id == FIFO.id
+        assert await fifo.position(db.tasks[2]) == (1, 3)  # the head again
+
+    asyncio.run(run())
+
+
+def test_enter_the_queue():
+    async def run() -> None:
+        db = FakeDB()
+        fifo = FifoQueue(SimpleNamespace(db=db, bitrix=FakeBitrix(), logger=FakeLogger()))
+        task = db.add(9, DEV, START)
+
+        # the queue is empty and there are less than "max_tasks" tasks in the queue stages
+        move = await fifo.on_stage_change(task, FIFO, STAGES)
+        assert move.stage is TESTING and not move.promote
+
+        db.add(6, DEV)
+        db.add(7, TESTING)
+        move = await fifo.on_stage_change(task, FIFO, STAGES)
+        assert move.stage is FIFO
+        assert await fifo.head(GROUP.id, STAGES) == 9
+
+        # leaving the queue stages promotes the head
+        db.move(9, FIFO)
+        move = await fifo.on_stage_change(task, DONE, STAGES)
+        assert move.stage is DONE and move.promote
+        assert await fifo.head(GROUP.id, STAGES) is None
+
+    asyncio.run(run())
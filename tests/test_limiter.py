@@ -0,0 +1,90 @@
+"""
+RateLimiter: tokens are given to the waiting requests by priority, backoff and limit errors.
+Run from the project root: python -m pytest tests
+"""
+import json
+import asyncio
+
+import pytest
+
+from src.bitrix.api import limiter as limiter_module
+from src.bitrix.api.limiter import (
+    RateLimiter, Priority, request_priority, backoff_delay, get_limit_error, QUERY_LIMIT_EXCEEDED
+)
+
+
+@pytest.fixture()
+def clock(monkeypatch) -> list[float]:
+    """The bucket is refilled only when the test moves the clock"""
+    now = [1000.0]
+    monkeypatch.setattr(limiter_module, "monotonic", lambda: now[0])
+    return now
+
+
+def test_waiters_get_tokens_by_priority(clock):
+    async def run() -> list[str]:
+        limiter = RateLimiter(rate=1, burst=3)
+        for _ in range(3):
+            await limiter.acquire(priority=Priority.BACKGROUND)
+        assert limiter.tokens == 0
+
+        order = []
+
+        async def request(name: str, priority: int = None) -> None:
+            await limiter.acquire(priority=priority)
+            order.append(name)
+
+        async def webhook(name: str) -> None:
+            request_priority.set(Priority.WEBHOOK)  # the priority of the task
+            await request(name)
+
+        tasks = [
+            asyncio.create_task(request("background 1", Priority.BACKGROUND)),
+            asyncio.create_task(webhook("webhook")),
+            asyncio.create_task(request("background 2", Priority.BACKGROUND)),
+            asyncio.create_task(request("cancelled", Priority.INTERACTIVE)),
+            asyncio.create_task(request("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        assert limiter.waiting == 5 and not order
+
+        tasks[3].cancel()
+        await asyncio.sleep(0)
+        assert limiter.waiting == 4
+
+        clock[0] += 3  # three tokens
+        limiter._release()
+        await asyncio.sleep(0)
+        assert order == ["interactive", "webhook", "background 1"]
+
+        clock[0] += 1
+        limiter._release()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "webhook", "background 1", "background 2"]
+
+
+def test_penalize_drains_the_bucket(clock):
+    limiter = RateLimiter(rate=1, burst=5)
+    limiter.penalize("tasks.task.list", QUERY_LIMIT_EXCEEDED)
+    assert limiter.tokens == 0
+
+    clock[0] += 2
+    limiter._refill()
+    assert limiter.tokens == 2
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        delay = min(60.0, 2 ** attempt)
+        assert delay / 2 <= backoff_delay(attempt) <= delay
+    assert backoff_delay(20, base=0.5, max_delay=10) <= 10
+
+
+def test_get_limit_error():
+    assert get_limit_error(503, json.dumps({"error": QUERY_LIMIT_EXCEEDED})) == QUERY_LIMIT_EXCEEDED
+    assert get_limit_error(400, b'{"error": "OPERATION_TIME_LIMIT"}') == "OPERATION_TIME_LIMIT"
+    assert get_limit_error(400, json.dumps({"error": "ACCESS_DENIED"})) is None
+    assert get_limit_error(502, "<html>Bad Gateway</html>") is None
+    assert get_limit_error(200, json.dumps({"error": QUERY_LIMIT_EXCEEDED})) is None
@@ -0,0 +1,77 @@
+"""
+run_phases: dependency order, cycles and unknown dependencies, failures of the phases.
+Run from the project root: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from src.bitrix.sync.phases import SyncPhase, run_phases, format_phases
+
+
+class Log:
+    def __init__(self):
+        self.events: list[str] = []
+
+    def phase(self, name: str, result=True, error: Exception = None, seconds: float = 0.0):
+        async def run():
+            self.events.append(f"{name} start")
+            await asyncio.sleep(seconds)
+            self.events.append(f"{name} end")
+            if error:
+                raise error
+            return result
+        return run
+
+
+def test_dependencies_are_finished_first():
+    log = Log()
+    phases = [
+        SyncPhase("tasks", log.phase("tasks"), after=("users", "groups")),
+        SyncPhase("users", log.phase("users", seconds=0.02)),
+        SyncPhase("groups", log.phase("groups", result=3)),
+        SyncPhase("report", log.phase("report"), after=("tasks",)),
+    ]
+    results = asyncio.run(run_phases(phases))
+
+    assert [r.name for r in results] == ["tasks", "users", "groups", "report"]
+    assert not any(r.failed for r in results)
+    assert results[2].result == 3
+    events = log.events
+    assert events.index("tasks start") > max(events.index("users end"), events.index("groups end"))
+    assert events.index("report start") > events.index("tasks end")
+    assert events.index("groups start") < events.index("users end")  # independent phases run together
+    assert results[0].waited >= 0.02
+
+
+def test_failures_do_not_stop_the_others():
+    log = Log()
+    phases = [
+        SyncPhase("users", log.phase("users", error=RuntimeError("bitrix <down>"))),
+        SyncPhase("departments", log.phase("departments", result=None), none_is_error=True),
+        SyncPhase("stages", log.phase("stages", result=None)),
+        SyncPhase("tasks", log.phase("tasks"), after=("users", "departments", "stages")),
+    ]
+    users, departments, stages, tasks = asyncio.run(run_phases(phases))
+
+    assert users.failed and isinstance(users.error, RuntimeError)
+    assert departments.failed and departments.error is None
+    assert not stages.failed
+    assert not tasks.failed and tasks.failed_after == ["users", "departments"]
+
+    report = format_phases([users, tasks]).split("\n")
+    assert report[0].startswith("❌ users") and "RuntimeError: bitrix &lt;down&gt;" in report[0]
+    assert report[1].startswith("✅ tasks") and report[1].endswith("после ошибки в users, departments")
+
+
+@pytest.mark.parametrize("after, error", [
+    ({"a": ("b",), "b": ("c",), "c": ("a",)}, "depends on itself"),
+    ({"a": ("a",), "b": (), "c": ()}, "depends on itself"),
+    ({"a": ("d",), "b": (), "c": ()}, "unknown phases"),
+])
+def test_invalid_dependencies(after, error):
+    log = Log()
+    phases = [SyncPhase(name, log.phase(name), after=names) for name, names in after.items()]
+    with pytest.raises(ValueError, match=error):
+        asyncio.run(run_phases(phases))
+    assert log.events == []  # nothing is started
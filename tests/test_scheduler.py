@@ -0,0 +1,99 @@
+"""
+KeyedDebouncer: coalescing of the events of one key, max delay, runs of one key do not overlap.
+Run from the project root: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from src.bitrix.sync.scheduler import KeyedDebouncer
+
+QUIET = 0.05
+
+
+class Handler:
+    def __init__(self, seconds: float = 0.0, error: Exception = None):
+        self.seconds = seconds
+        self.error = error
+        self.calls: list[int] = []
+        self.running: set[int] = set()
+        self.overlaps = 0
+
+    async def __call__(self, key: int) -> None:
+        if key in self.running:
+            self.overlaps += 1
+        self.running.add(key)
+        self.calls.append(key)
+        try:
+            await asyncio.sleep(self.seconds)
+            if self.error:
+                raise self.error
+        finally:
+            self.running.discard(key)
+
+
+def test_events_of_one_key_are_coalesced():
+    async def run() -> None:
+        handler = Handler()
+        debouncer = KeyedDebouncer(handler, quiet=QUIET, max_delay=1)
+        futures = [debouncer.submit(1) for _ in range(5)] + [debouncer.submit(2)]
+        assert debouncer.is_pending(1) and not handler.calls
+
+        await asyncio.gather(*futures)
+        assert sorted(handler.calls) == [1, 2]
+        assert (debouncer.events, debouncer.runs, debouncer.ratio) == (6, 2, 3.0)
+        assert not debouncer.is_pending(1)
+        assert "debounce_runs_total 2" in debouncer.prometheus("debounce")
+
+    asyncio.run(run())
+
+
+def test_quiet_window_is_extended_until_max_delay():
+    async def run() -> None:
+        handler = Handler()
+        debouncer = KeyedDebouncer(handler, quiet=QUIET, max_delay=QUIET * 3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = debouncer.submit(1)
+        while not first.done():  # events come faster than the quiet window
+            await asyncio.sleep(QUIET / 2)
+            debouncer.submit(1)
+
+        assert handler.calls == [1]
+        assert QUIET * 3 <= loop.time() - started < QUIET * 5
+
+    asyncio.run(run())
+
+
+def test_runs_of_one_key_do_not_overlap():
+    async def run() -> None:
+        handler = Handler(seconds=QUIET * 2)
+        debouncer = KeyedDebouncer(handler, quiet=QUIET, max_delay=1)
+        first = debouncer.submit(1)
+        await asyncio.sleep(QUIET * 1.5)
+        assert handler.running == {1}
+
+        second = debouncer.submit(1)  # during the run, it starts the next one
+        third = debouncer.submit(1)
+        await first
+        assert not second.done()
+
+        await asyncio.gather(second, third)
+        assert handler.calls == [1, 1]
+        assert handler.overlaps == 0
+
+    asyncio.run(run())
+
+
+def test_handler_error_is_set_to_the_waiters():
+    async def run() -> None:
+        debouncer = KeyedDebouncer(Handler(error=ValueError("bitrix")), quiet=QUIET, max_delay=1)
+        futures = [debouncer.submit(1), debouncer.submit(1)]
+        for result in await asyncio.gather(*futures, return_exceptions=True):
+            assert isinstance(result, ValueError)
+
+        assert not debouncer.is_pending(1)
+        with pytest.raises(ValueError):
+            await debouncer.submit(1)  # a new batch after the failed one
+
+    asyncio.run(run())
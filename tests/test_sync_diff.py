@@ -0,0 +1,201 @@
+"""
+Sync of users and departments: the changes found in memory and passed to the DB in one call.
+Run from the project root: python -m pytest tests
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiohttp")
+pytest.importorskip("aiogram")
+
+from src.bitrix.api.structs import BitDepartment, BitUser  # noqa: E402
+from src.bitrix.sync.base import BaseBitSync  # noqa: E402
+from src.classes.cls_const import AccessLevelConst  # noqa: E402
+from src.classes.data_classes import SyncSummary  # noqa: E402
+
+
+class FakeBitrix:
+    def __init__(self, users: list[BitUser] = (), departments: list[BitDepartment] = ()):
+        self.users = list(users)
+        self.departments = list(departments)
+
+    async def get_users(self) -> list[BitUser]:
+        return self.users
+
+    async def get_departments(self) -> list[BitDepartment]:
+        return self.departments
+
+
+class FakeDB:
+    """Rows of the DB and the arguments of the "sync_*" calls"""
+
+    def __init__(self, users=(), departments=(), dep_users=(), saved: bool = True):
+        self.users = list(users)
+        self.departments = list(departments)
+        self.dep_users = list(dep_users)
+        self.saved = saved
+        self.calls: dict[str, tuple] = {}
+
+    async def get_user(self):
+        return self.users
+
+    async def get_users(self, with_bit_id: bool = None):
+        return [u for u in self.users if u.bit_user_id or not with_bit_id]
+
+    async def get_department(self, bit_filter: bool = None):
+        return [d for d in self.departments if d.bit_dep_id or not bit_filter]
+
+    async def get_dep_users(self, head: bool = None):
+        return [d for d in self.dep_users if head is None or d.head == head]
+
+    async def sync_bitrix_users(self, *args, **kwargs) -> bool:
+        self.calls["users"] = args + tuple(kwargs.values())
+        return self.saved
+
+    async def sync_bitrix_departments(self, *args) -> bool:
+        self.calls["departments"] = args
+        return self.saved
+
+    async def sync_department_users(self, *args) -> bool:
+        self.calls["department_users"] = args
+        return self.saved
+
+
+class FakeLogger:
+    def __init__(self):
+        self.errors = []
+
+    async def send_log(self, level, place, e=None, msg=None) -> None:
+        self.errors.append((place, msg))
+
+
+def user(id_: int, bit_user_id: int | None, full_name: str = "", access_level: str = AccessLevelConst.BITRIX):
+    return SimpleNamespace(id=id_, bit_user_id=bit_user_id, full_name=full_name, access_level=access_level)
+
+
+def department(id_: int, bit_dep_id: int, name: str, parent_id: int = None):
+    return SimpleNamespace(id=id_, bit_dep_id=bit_dep_id, name=name, parent_id=parent_id)
+
+
+def dep_user(id_: int, department_id: int, user_: SimpleNamespace, head: bool = False):
+    return SimpleNamespace(id=id_, department_id=department_id, user_id=user_.id, user=user_, head=head)
+
+
+def bit_user(id_: int, name: str = "Ivan", active: bool = True, departments: list[int] = ()) -> BitUser:
+    return BitUser(id=id_, name=name, last_name="Ivanov", second_name="", active=active, departments=list(departments))
+
+
+def make_sync(bitrix: FakeBitrix, db: FakeDB) -> BaseBitSync:
+    return BaseBitSync(bitrix, db, FakeLogger())
+
+
+def test_sync_users():
+    db = FakeDB(users=[
+        user(1, 1, bit_user(1).full_name),
+        user(2, 2, "old name"),
+        user(3, 3, bit_user(3).full_name),
+        user(4, 4, bit_user(4).full_name, access_level=AccessLevelConst.BLOCKED),
+        user(5, None, "not from bitrix"),
+    ])
+    bitrix = FakeBitrix(users=[
+        bit_user(1), bit_user(2, name="Petr"), bit_user(3, active=False), bit_user(4, active=False),
+        bit_user(5, name="Anna"), bit_user(6, active=False),
+    ])
+    summary = asyncio.run(make_sync(bitrix, db).sync_users())
+
+    assert summary == SyncSummary(added=1, updated=1, blocked=1, unchanged=1)
+    upsert, block_bit_ids, blocked_level = db.calls["users"]
+    assert upsert == [
+        {"bit_user_id": 2, "full_name": "Ivanov Petr ", "access_level": AccessLevelConst.BITRIX},
+        {"bit_user_id": 5, "full_name": "Ivanov Anna ", "access_level": AccessLevelConst.BITRIX},
+    ]
+    assert block_bit_ids == [3]
+    assert blocked_level == AccessLevelConst.BLOCKED
+
+
+def test_sync_users_without_changes_and_errors():
+    db = FakeDB(users=[user(1, 1, bit_user(1).full_name)])
+    summary = asyncio.run(make_sync(FakeBitrix(), db).sync_users([bit_user(1)]))
+    assert summary == SyncSummary(unchanged=1)
+    assert not db.calls  # nothing to save
+
+    db = FakeDB(saved=False)
+    sync = make_sync(FakeBitrix(), db)
+    assert asyncio.run(sync.sync_users([bit_user(1)])) is None
+    assert sync.logger.errors
+
+
+def test_department_order():
+    departments = {
+        1: BitDepartment(1, "a", parent_id=3),
+        2: BitDepartment(2, "b", parent_id=None),
+        3: BitDepartment(3, "c", parent_id=2),
+        4: BitDepartment(4, "d", parent_id=99),  # the parent is not in Bitrix, a root
+        5: BitDepartment(5, "e", parent_id=6),  # a cycle
+        6: BitDepartment(6, "f", parent_id=5),
+    }
+    order = [d.id for d in BaseBitSync.department_order(departments)]
+    assert order == [2, 4, 3, 1, 5, 6]
+
+
+def test_sync_departments():
+    users = [user(1, 100), user(3, 300)]
+    db = FakeDB(
+        users=users,
+        departments=[
+            department(11, 1, "Company"),
+            department(12, 2, "Develop", parent_id=11),
+            department(13, 3, "Backend"),
+            department(15, 5, "Deleted"),
+        ],
+        dep_users=[
+            dep_user(51, 11, users[0], head=True),
+            dep_user(52, 12, users[1], head=True),
+            dep_user(53, 13, users[0]),  # not a head
+        ],
+    )
+    bitrix = FakeBitrix(departments=[
+        BitDepartment(1, "Company", head_id=100),
+        BitDepartment(2, "Dev", parent_id=1),  # renamed, the head of the parent
+        BitDepartment(3, "Backend", parent_id=2, head_id=300),  # new parent
+        BitDepartment(4, "Sales", parent_id=99),  # new
+    ])
+    summary = asyncio.run(make_sync(bitrix, db).sync_departments())
+
+    assert summary == SyncSummary(added=1, updated=2, deleted=1, unchanged=1)
+    departments, parents, add_heads, delete_head_ids, delete_ids = db.calls["departments"]
+    assert departments == [{"bit_dep_id": 4, "name": "Sales"}, {"bit_dep_id": 2, "name": "Dev"}]
+    assert parents == {3: 2}
+    assert add_heads == [(2, 1), (3, 3)]
+    assert delete_head_ids == [52]
+    assert delete_ids == [15]
+
+
+def test_sync_departments_users():
+    users = [user(1, 100), user(3, 300), user(4, 400), user(5, 600)]
+    db = FakeDB(
+        users=users,
+        departments=[department(11, 1, "a"), department(12, 2, "b"), department(13, 3, "c"), department(14, None, "d")],
+        dep_users=[
+            dep_user(61, 11, users[0]),
+            dep_user(63, 13, users[1], head=True),
+            dep_user(65, 12, users[3]),  # not in the department in Bitrix
+            dep_user(66, 12, users[1], head=True),  # heads are synced by sync_departments
+            dep_user(67, 14, users[0]),  # not a Bitrix department
+        ],
+    )
+    bit_users = [
+        bit_user(100, departments=[1, 2]),
+        bit_user(300, departments=[3, 77]),
+        bit_user(400, active=False, departments=[2]),
+        bit_user(500, departments=[1]),  # not in the DB
+    ]
+    summary = asyncio.run(make_sync(FakeBitrix(), db).sync_departments_users(bit_users))
+
+    assert summary == SyncSummary(added=1, deleted=1, unchanged=2)
+    add, delete_ids = db.calls["department_users"]
+    assert add == [(12, 1)]
+    assert delete_ids == [65]